@@ -0,0 +1,303 @@
+"""Minimal stand-in for the Blender Python API (bpy) for benchmarks.
+
+Only the parts of the API used by the render package and treegrow are
+implemented: objects with meshes backed by vertex arrays, materials,
+one scene with a camera and render settings, and operators that do
+nothing except create cameras and lamps. Use `reset` to start with an
+empty file and `add_mesh` to build a scene.
+
+"""
+import types
+import numpy as np
+from mathutils import Matrix, Vector
+
+
+class Collection():
+    """Named data blocks (e.g. bpy.data.objects) in creation order."""
+
+    def __init__(self, factory=None):
+        """Create an empty collection, `new` calls factory(name)."""
+        self._items = {}
+        self._factory = factory
+        self._suffixes = {}
+
+    def unique(self, name: str):
+        """Return name, with a numeric suffix if already used."""
+        base, _, suffix = name.rpartition('.')
+        if not (base and suffix.isdigit()):
+            base = name
+        while name in self._items:
+            self._suffixes[base] = self._suffixes.get(base, 0) + 1
+            name = "{:s}.{:03d}".format(base, self._suffixes[base])
+        return name
+
+    def add(self, item):
+        """Add item under a unique version of its name."""
+        item.name = self.unique(item.name)
+        self._items[item.name] = item
+        return item
+
+    def new(self, name: str):
+        """Create and add a new data block."""
+        return self.add(self._factory(name))
+
+    def get(self, name: str, default=None):
+        """Return data block name or default."""
+        return self._items.get(name, default)
+
+    def remove(self, item):
+        """Remove a data block."""
+        del self._items[item.name]
+
+    def __getitem__(self, key):
+        """Return data block by name, or by index or slice."""
+        if isinstance(key, str):
+            return self._items[key]
+        return list(self._items.values())[key]
+
+    def __contains__(self, name):
+        """Return True if a data block is named name."""
+        return name in self._items
+
+    def __iter__(self):
+        """Iterate over the data blocks."""
+        return iter(list(self._items.values()))
+
+    def __len__(self):
+        """Return the number of data blocks."""
+        return len(self._items)
+
+
+class MeshVertices():
+    """Vertices of a mesh as a (N, 3) array."""
+
+    def __init__(self, coords):
+        """Create vertices with coordinates."""
+        self.coords = np.asarray(coords, dtype=np.float32).reshape(-1, 3)
+
+    def foreach_get(self, attr: str, out):
+        """Copy the flattened coordinates into out."""
+        assert attr == 'co'
+        out[:] = self.coords.ravel()
+
+    def __len__(self):
+        """Return the number of vertices."""
+        return len(self.coords)
+
+
+class MeshMaterials(list):
+    """Materials of a mesh."""
+
+
+class Mesh():
+    """Mesh data block."""
+
+    def __init__(self, name: str, coords=()):
+        """Create a mesh with vertex coordinates."""
+        self.name = name
+        self.vertices = MeshVertices(coords)
+        self.materials = MeshMaterials()
+
+    def as_pointer(self):
+        """Return a unique integer for the mesh."""
+        return id(self)
+
+
+class NodeTree():
+    """Node tree with nodes by name (none by default)."""
+
+    def __init__(self, nodes: dict=None):
+        """Create a tree with nodes."""
+        self.nodes = nodes or {}
+
+
+class Material():
+    """Material data block."""
+
+    def __init__(self, name: str):
+        """Create a material with default settings."""
+        self.name = name
+        self.use_shadeless = False
+        self.diffuse_color = (0.8, 0.8, 0.8)
+        self.node_tree = NodeTree()
+
+
+class Camera():
+    """Camera data block."""
+
+    def __init__(self, name: str):
+        """Create a camera with Blender's default lens and sensor."""
+        self.name = name
+        self.lens = 35.
+        self.sensor_width = 32.
+        self.sensor_height = 24.
+        self.clip_end = 100.
+
+    @property
+    def angle_y(self):
+        """Return the vertical field of view."""
+        return 2*np.arctan(self.sensor_height/(2*self.lens))
+
+
+class Lamp():
+    """Lamp data block with an emission node."""
+
+    def __init__(self, name: str):
+        """Create a lamp."""
+        self.name = name
+        self.shadow_soft_size = 0.
+        emission = types.SimpleNamespace(inputs={
+            'Strength': types.SimpleNamespace(default_value=1.),
+            'Color': types.SimpleNamespace(default_value=(1, 1, 1, 1))})
+        self.node_tree = NodeTree({'Emission': emission})
+
+
+class Object():
+    """Object with a location, rotation and data."""
+
+    def __init__(self, name: str, block=None, kind: str='MESH'):
+        """Create an object of type kind with data block."""
+        self.name = name
+        self.type = kind
+        self.data = block
+        self.location = Vector((0, 0, 0))
+        self.rotation_euler = Vector((0, 0, 0))
+        self.scale = Vector((1, 1, 1))
+        self.select = False
+        self.hide_render = False
+        self.pass_index = 0
+
+    @property
+    def matrix_world(self):
+        """Return the transformation matrix (rotation XYZ, no parents)."""
+        angles = np.asarray(self.rotation_euler, dtype=float)
+        cos, sin = np.cos(angles), np.sin(angles)
+        rot_x = np.array([[1, 0, 0], [0, cos[0], -sin[0]],
+                          [0, sin[0], cos[0]]])
+        rot_y = np.array([[cos[1], 0, sin[1]], [0, 1, 0],
+                          [-sin[1], 0, cos[1]]])
+        rot_z = np.array([[cos[2], -sin[2], 0], [sin[2], cos[2], 0],
+                          [0, 0, 1]])
+        matrix = np.identity(4)
+        matrix[:3, :3] = rot_z.dot(rot_y).dot(rot_x) * np.asarray(self.scale)
+        matrix[:3, 3] = self.location
+        return Matrix(matrix)
+
+    @property
+    def bound_box(self):
+        """Return the 8 corners of the local bounding box."""
+        coords = self.data.vertices.coords
+        (x_0, y_0, z_0), (x_1, y_1, z_1) = (np.min(coords, axis=0),
+                                            np.max(coords, axis=0))
+        return [[x, y, z] for x in (x_0, x_1)
+                for y, z in ((y_0, z_0), (y_0, z_1), (y_1, z_1), (y_1, z_0))]
+
+    @property
+    def material_slots(self):
+        """Return a slot for every material of the mesh."""
+        return list(getattr(self.data, 'materials', []))
+
+    def copy(self):
+        """Return a copy sharing the data, not linked to a scene."""
+        obj = Object(self.name, self.data, self.type)
+        obj.location = Vector(self.location)
+        obj.rotation_euler = Vector(self.rotation_euler)
+        obj.scale = Vector(self.scale)
+        return data.objects.add(obj)
+
+
+class SceneObjects(list):
+    """Objects linked to a scene."""
+
+    active = None
+
+    def link(self, obj):
+        """Link obj to the scene."""
+        self.append(obj)
+
+
+class Scene():
+    """Scene with render settings that accept any value."""
+
+    def __init__(self, name: str):
+        """Create an empty scene."""
+        self.name = name
+        self.objects = SceneObjects()
+        self.camera = None
+        self.use_nodes = False
+        self.node_tree = NodeTree()
+        self.render = types.SimpleNamespace(layers=[types.SimpleNamespace()])
+        self.cycles = types.SimpleNamespace()
+        self.world = types.SimpleNamespace()
+        self.display_settings = types.SimpleNamespace()
+        self.sequencer_colorspace_settings = types.SimpleNamespace()
+
+
+class Operators():
+    """Operators of a category, doing nothing unless defined."""
+
+    def __init__(self, **operators):
+        """Create category with the given operator functions."""
+        self._operators = operators
+
+    def __getattr__(self, name: str):
+        """Return the operator name."""
+        return self._operators.get(name, lambda *args, **kwargs: {'FINISHED'})
+
+
+def _add_object(name: str, block, kind: str):
+    """Add an object with a new data block to the scene, make it active."""
+    obj = data.objects.add(Object(name, block, kind))
+    context.scene.objects.link(obj)
+    context.object = obj
+    return {'FINISHED'}
+
+
+def _delete(use_global: bool=False):  # pylint: disable=unused-argument
+    """Delete selected objects."""
+    for obj in [obj for obj in data.objects if obj.select]:
+        data.objects.remove(obj)
+        if obj in context.scene.objects:
+            context.scene.objects.remove(obj)
+    return {'FINISHED'}
+
+
+def reset():
+    """Start with an empty file with one scene and world."""
+    data.objects = Collection()
+    data.meshes = Collection(Mesh)
+    data.materials = Collection(Material)
+    data.scenes = Collection(Scene)
+    data.worlds = Collection(lambda name: types.SimpleNamespace(
+        name=name, node_tree=NodeTree()))
+    data.images = Collection()
+    data.filepath = ''
+    data.scenes.new("Scene")
+    data.worlds.new("World")
+    context.scene = data.scenes[0]
+    context.object = None
+
+
+def add_mesh(name: str, coords, location=(0, 0, 0)):
+    """Add a mesh object with vertex coordinates to the scene."""
+    obj = data.objects.add(Object(name, data.meshes.add(Mesh(name, coords))))
+    obj.location = Vector(location)
+    context.scene.objects.link(obj)
+    return obj
+
+
+data = types.SimpleNamespace()
+context = types.SimpleNamespace()
+app = types.SimpleNamespace(handlers=types.SimpleNamespace(render_stats=[]),
+                            binary_path='blender')
+ops = types.SimpleNamespace(
+    object=Operators(
+        camera_add=lambda **kwargs: _add_object(
+            "Camera", Camera("Camera"), 'CAMERA'),
+        lamp_add=lambda **kwargs: _add_object(
+            kwargs.get('type', 'POINT').title(),
+            Lamp(kwargs.get('type', 'POINT').title()), 'LAMP'),
+        delete=_delete),
+    render=Operators(), transform=Operators(), mesh=Operators(),
+    uv=Operators())
+reset()
@@ -0,0 +1,52 @@
+"""Minimal stand-in for Blender's mathutils backed by NumPy arrays."""
+import numpy as np
+from . import kdtree
+
+__all__ = ("Vector", "Matrix", "kdtree")
+
+
+class Vector(np.ndarray):
+    """Vector as a one-dimensional float array."""
+
+    def __new__(cls, values=(0, 0, 0)):
+        """Create a vector from a sequence of values."""
+        return np.array(values, dtype=float).view(cls)
+
+    @property
+    def length(self):
+        """Return the Euclidean length."""
+        return float(np.linalg.norm(self))
+
+    def normalized(self):
+        """Return a vector of unit length in the same direction."""
+        return self / self.length
+
+    def to_tuple(self):
+        """Return the values as a tuple."""
+        return tuple(self.tolist())
+
+
+class Matrix(np.ndarray):
+    """Matrix as a two-dimensional float array."""
+
+    def __new__(cls, rows=None):
+        """Create a matrix from rows (identity 4x4 if None)."""
+        if rows is None:
+            rows = np.identity(4)
+        return np.array(rows, dtype=float).view(cls)
+
+    @classmethod
+    def Identity(cls, size: int):  # pylint: disable=invalid-name
+        """Return the identity matrix of size."""
+        return cls(np.identity(size))
+
+    def inverted(self):
+        """Return the inverse matrix."""
+        return Matrix(np.linalg.inv(self))
+
+    def __matmul__(self, other):
+        """Multiply matrices, or transform a vector (w = 1 for 3D)."""
+        other = np.asarray(other, dtype=float)
+        if other.ndim == 1 and len(other) == len(self) - 1:
+            return Vector(np.dot(self[:-1, :-1], other) + self[:-1, -1])
+        return np.dot(np.asarray(self), other).view(type(self))
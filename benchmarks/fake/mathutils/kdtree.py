@@ -0,0 +1,43 @@
+"""Stand-in for mathutils.kdtree on top of a NumPy point array."""
+import numpy as np
+import scipy.spatial
+
+
+class KDTree():
+    """Balanced tree of points with the mathutils.kdtree interface."""
+
+    def __init__(self, size: int):
+        """Create an empty tree for size points."""
+        self.points = np.zeros((size, 3))
+        self.indices = np.zeros(size, dtype=int)
+        self._count = 0
+        self._tree = None
+
+    def insert(self, co, index: int):
+        """Insert point co with index."""
+        self.points[self._count] = co[:3]
+        self.indices[self._count] = index
+        self._count += 1
+
+    def balance(self):
+        """Build the tree, must be called before finding points."""
+        self._tree = scipy.spatial.cKDTree(self.points[:self._count])
+
+    def find(self, co):
+        """Return (co, index, dist) of the point closest to co."""
+        dist, found = self._tree.query(np.asarray(co, dtype=float)[:3])
+        return self.points[found], int(self.indices[found]), float(dist)
+
+    def find_n(self, co, n: int):
+        """Return (co, index, dist) of the n points closest to co."""
+        dist, found = self._tree.query(np.asarray(co, dtype=float)[:3],
+                                       min(n, self._count))
+        return [(self.points[i], int(self.indices[i]), float(d))
+                for d, i in zip(np.atleast_1d(dist), np.atleast_1d(found))]
+
+    def find_range(self, co, radius: float):
+        """Return (co, index, dist) of all points within radius of co."""
+        co = np.asarray(co, dtype=float)[:3]
+        return [(self.points[i], int(self.indices[i]),
+                 float(np.linalg.norm(self.points[i] - co)))
+                for i in self._tree.query_ball_point(co, radius)]
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""Benchmark the Python hot paths without Blender.
+
+The render package and treegrow are imported with a fake bpy and
+mathutils (benchmarks/fake) and timed on synthetic scenes of several
+sizes. Each benchmark is set up and timed `repeat` times and the
+median time is reported (the best time of a few runs varies too much
+between invocations on a busy machine). Times are compared with a
+stored baseline after scaling by a fixed calibration workload, so that
+baselines recorded on another machine remain usable; a benchmark
+regresses if it is slower than the baseline by more than the
+tolerance, which is confirmed by measuring it again.
+
+"""
+import sys
+import os
+import io
+import json
+import time
+import argparse
+import contextlib
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'benchmarks', 'fake'),
+                os.path.join(ROOT, 'benchmarks'), ROOT]
+
+# pylint: disable=wrong-import-position
+import bpy  # noqa: E402 pylint: disable=import-error
+import render  # noqa: E402
+import treegrow  # noqa: E402
+import scene  # noqa: E402
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+# Benchmarks whose measured run-to-run spread exceeds the default
+# tolerance (slowest ratio to baseline seen in 14 runs + margin)
+TOLERANCES = {
+    'color_level[1000]': 0.6,
+    'texture[100]': 0.6,
+    'bounding_sphere[100]': 0.75,
+    'bounding_sphere[5000]': 0.6,
+}
+
+
+def random_camera(size: int):
+    """Time 1000 random camera placements around a bridge of size objects."""
+    objects = scene.build(size)
+    renderer = render.render.Render(objects)
+    np.random.seed(0)
+    return lambda: [renderer.random_camera() for _ in range(1000)]
+
+
+def random_points(size: int):
+    """Time generating 200 points with a bridge of size objects."""
+    objects = scene.build(size)
+    renderer = render.render.Render(objects)
+    return lambda: renderer.random_points(range(200), 0)
+
+
+def grow_trees(size: int):
+    """Time growing size trees one by one around the seed trees."""
+    scene.build(100)
+    landscape = bpy.data.objects['Landscape']
+    seeds = [obj for obj in bpy.data.objects if obj.name.startswith('tree')]
+    grower = treegrow.TreeGrowRandom(
+        landscape, set(obj.name for obj in seeds), 8., 4.)
+    np.random.seed(0)
+    return lambda: grower.grow_trees(size, [seeds[0]])
+
+
+def color_level(size: int):
+    """Time coloring size objects on every label level 5 times."""
+    objects = scene.build(size)
+    labels = render.labels.Labels(objects, render.materials.Materials())
+    labels.levels, labels.parts = scene.labels()
+    return lambda: [labels.color_level(level) for level in (2, 1, 0)*5]
+
+
+def texture(size: int):
+    """Time 20 random texturings of size objects."""
+    objects = scene.build(size)
+    textures = render.textures.Textures(objects,
+                                        render.materials.Materials())
+    for part in scene.PARTS + ["Landscape"]:
+        textures.add_textures(part, scene.TEXTURES)
+    textures.add_parts_to_group("structure", scene.PARTS[:3])
+    textures.add_textures("structure", scene.TEXTURES)
+    np.random.seed(0)
+    return lambda: [textures.texture() for _ in range(20)]
+
+
+def bounding_sphere(size: int):
+    """Time finding the bounding sphere of size objects."""
+    objects = scene.build(size)[1:]
+    return lambda: render.helpers.BoundingSphere().find(objects)
+
+
+BENCHMARKS = [
+    (random_camera, (10, 100, 1000)),
+    (random_points, (10, 100, 1000)),
+    (grow_trees, (20, 100, 400)),
+    (color_level, (100, 1000, 5000)),
+    (texture, (100, 1000, 5000)),
+    (bounding_sphere, (100, 1000, 5000)),
+]
+
+
+def calibrate(repeat: int=9):
+    """Return the median time of a fixed Python and NumPy workload."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        total = 0
+        for value in range(1000000):
+            total += value % 7
+        np.sort(np.random.RandomState(0).random_sample(2000000))
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def measure(setup, size: int, repeat: int):
+    """Return the median time of the benchmark set up by setup(size)."""
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            run = setup(size)
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def main():
+    """Run the benchmarks and compare them with the baseline."""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+    parser.add_argument('-k', '--select', metavar='NAME', nargs='+',
+                        help="Run only benchmarks with given names")
+    parser.add_argument('-r', '--repeat', metavar='N', type=int, default=9,
+                        help="Number of runs of each benchmark (default: 9)")
+    parser.add_argument('-b', '--baseline', metavar='FILE',
+                        default=BASELINE, help="Baseline file")
+    parser.add_argument(
+        '-t', '--tolerance', metavar='FRACTION', type=float, default=0.3,
+        help="Allowed slowdown relative to baseline (default: 0.3, more "
+        "for benchmarks with a larger spread)")
+    parser.add_argument('--save', action='store_true',
+                        help="Store results as the new baseline")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    calibration = calibrate(args.repeat)
+    scale = calibration / baseline.get('calibration', calibration)
+    print("calibration {:.3f} s (x{:.2f} baseline)".format(
+        calibration, scale))
+
+    results, regressions = {}, []
+    for setup, sizes in BENCHMARKS:
+        if args.select is not None and setup.__name__ not in args.select:
+            continue
+        for size in sizes:
+            name = "{:s}[{:d}]".format(setup.__name__, size)
+            results[name] = measure(setup, size, args.repeat)
+            tolerance = max(args.tolerance, TOLERANCES.get(name, 0.))
+            if name in baseline.get('times', {}):
+                limit = baseline['times'][name] * scale * (1 + tolerance)
+                if results[name] > limit:
+                    # Confirm, a slow run is often a busy machine
+                    results[name] = min(results[name],
+                                        measure(setup, size, args.repeat))
+            line = "{:<24s}{:>10.4f} s".format(name, results[name])
+            if name in baseline.get('times', {}):
+                ratio = results[name] / (baseline['times'][name] * scale)
+                line += "{:>8.2f}x".format(ratio)
+                if ratio > 1 + tolerance:
+                    line += "  REGRESSION"
+                    regressions.append(name)
+            print(line)
+            sys.stdout.flush()
+
+    if args.save:
+        times = baseline.get('times', {}) if args.select else {}
+        # Rescale kept times so that all are relative to this machine
+        times = {name: value*scale for name, value in times.items()}
+        times.update(results)
+        with open(args.baseline, 'w') as file:
+            json.dump({'calibration': calibration, 'times': times}, file,
+                      indent=4, sort_keys=True)
+            file.write('\n')
+    if len(regressions) > 0:
+        sys.exit("{:s}: {:d} regression(s): {:s}".format(
+            os.path.basename(__file__), len(regressions),
+            ", ".join(regressions)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Build synthetic bridge scenes in the fake bpy for benchmarks."""
+import numpy as np
+import bpy  # pylint: disable=import-error
+
+PARTS = ["deck", "pier", "cable", "tower", "railing", "bearing", "abutment",
+         "girder", "brace", "lamp"]
+TEXTURES = ["concrete", "steel", "asphalt", "rust", "paint"]
+
+
+def landscape(extent: float=400., resolution: int=101):
+    """Add a rolling landscape mesh centred on the origin."""
+    axis = np.linspace(-extent/2, extent/2, resolution)
+    x, y = np.meshgrid(axis, axis, indexing='ij')
+    z = 5*np.sin(x/40) * np.cos(y/55) + 0.02*x
+    return bpy.add_mesh("Landscape", np.stack([x, y, z], axis=-1))
+
+
+def box(size, points: int, rng):
+    """Return points random vertices on the surface of a box of size."""
+    coords = rng.uniform(-0.5, 0.5, (points, 3))
+    face = rng.randint(3, size=points)
+    coords[np.arange(points), face] = np.sign(
+        coords[np.arange(points), face]) * 0.5
+    return coords * np.asarray(size)
+
+
+def bridge(objects: int, vertices: int=64, seed: int=0):
+    """Add objects bridge parts (instances of PARTS) along the x axis."""
+    rng = np.random.RandomState(seed)
+    parts = []
+    for index in range(objects):
+        name = PARTS[index % len(PARTS)]
+        location = (rng.uniform(-60, 60), rng.uniform(-8, 8),
+                    rng.uniform(8, 30))
+        parts.append(bpy.add_mesh(name, box(rng.uniform(0.5, 6, 3),
+                                            vertices, rng), location))
+    return parts
+
+
+def trees(kinds: int=2, seed: int=0):
+    """Add seed trees away from the bridge."""
+    rng = np.random.RandomState(seed)
+    return [bpy.add_mesh("tree_{:d}".format(kind), box((4, 4, 10), 128, rng),
+                         (120 + 10*kind, 100, 0)) for kind in range(kinds)]
+
+
+def materials():
+    """Add the texture materials."""
+    for name in TEXTURES:
+        bpy.data.materials.new(name)
+    return TEXTURES
+
+
+def labels():
+    """Return label levels and parts for PARTS (as in labels.json)."""
+    colors = ["#{:06x}".format(0x102030 * (index + 1) % 0xffffff)
+              for index in range(len(PARTS))]
+    parts = {"superstructure": PARTS[:5], "substructure": PARTS[5:]}
+    levels = [{"bridge": "#ffffff", "Landscape": "#404040"},
+              {"superstructure": "#ff0000", "substructure": "#00ff00",
+               "Landscape": "#404040"},
+              dict(zip(PARTS, colors), Landscape="#404040")]
+    return levels, parts
+
+
+def build(objects: int, seed: int=0):
+    """Start a new file with landscape, bridge of objects and trees."""
+    bpy.reset()
+    landscape()
+    bridge(objects, seed=seed)
+    trees(seed=seed)
+    materials()
+    return bpy.data.objects[:]
@@ -1,29 +1,171 @@
 #!/usr/bin/env python2
-"""Convert an OpenEXR image file containing depth data to plain text
-tab-separated values."""
+"""Convert OpenEXR image files containing depth data to arrays.
+
+Images are written as plain text tab-separated values (one channel),
+NumPy arrays, or stacked into a single memory-mappable NumPy array of
+shape (N, height, width[, channels]) with the names of the source
+files in a JSON file next to it. Sources can be files, patterns or
+directories (searched recursively for depth files). Files are
+converted in parallel and outputs newer than their source are skipped
+unless forced. Files converted into a directory are named after their
+source, so sources with the same name (e.g. from two runs) must be
+converted separately.
+
+"""
+from __future__ import division, print_function
 import sys
 import os
 import glob
+import json
+import fnmatch
 import argparse
+import multiprocessing
 import numpy as np
 import OpenEXR
 import Imath
 
+DTYPES = {
+    Imath.PixelType(Imath.PixelType.HALF).v: np.float16,
+    Imath.PixelType(Imath.PixelType.FLOAT).v: np.float32,
+    Imath.PixelType(Imath.PixelType.UINT).v: np.uint32,
+}
+# Files of a directory to convert
+PATTERN = '*.dep.exr'
 
-def convert_to_tsv(src, dest):
-    """Convert OpenEXR to TSV."""
-    # Input from any channel as binary data
-    exr = OpenEXR.InputFile(src)
-    red_str = exr.channel('R', Imath.PixelType(Imath.PixelType.FLOAT))
-    red = np.fromstring(red_str, dtype=np.float32)
 
-    # Shape the array according to image dimensions
-    window = exr.header()['dataWindow']
-    red.shape = (window.max.y - window.min.y + 1,
+def read_exr(src, channels=('R',)):
+    """Return channels of an OpenEXR file as an array.
+
+    The shape is that of the data window, with a last axis for the
+    channels if more than one (all channels in name order if channels
+    is None). Channels are read in their stored pixel type without
+    copying.
+
+    """
+    exr = OpenEXR.InputFile(src)
+    try:
+        header = exr.header()
+        window = header['dataWindow']
+        shape = (window.max.y - window.min.y + 1,
                  window.max.x - window.min.x + 1)
-    np.savetxt(dest, red,
-               header=("Depth data converted from OpenEXR ({:s})".format(
-                   os.path.basename(__file__))))
+        if channels is None:
+            channels = sorted(header['channels'])
+        arrays = [np.frombuffer(
+            exr.channel(name), dtype=DTYPES[header['channels'][name].type.v])
+                  .reshape(shape) for name in channels]
+    finally:
+        exr.close()
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.stack(arrays, axis=-1)
+
+
+def convert(src, channels=('R',), half=False):
+    """Return channels of src as float32 (float16 if half) array."""
+    return read_exr(src, channels).astype(
+        np.float16 if half else np.float32, copy=False)
+
+
+def write(array, dest):
+    """Write array to dest as TSV or NumPy array by extension."""
+    if dest.endswith('.npy'):
+        np.save(dest, array)
+    else:
+        np.savetxt(dest, array, header=(
+            "Depth data converted from OpenEXR ({:s})".format(
+                os.path.basename(__file__))))
+
+
+def is_current(src, dest):
+    """Return True if dest exists and is not older than src."""
+    return (os.path.isfile(dest) and
+            os.path.getmtime(dest) >= os.path.getmtime(src))
+
+
+def _convert_worker(args):
+    """Convert src to dest in a worker process, return src."""
+    src, dest, channels, half = args
+    write(convert(src, channels, half), dest)
+    return src
+
+
+def _read_worker(args):
+    """Return the converted array of src in a worker process."""
+    src, channels, half = args
+    return convert(src, channels, half)
+
+
+def batches(items, size):
+    """Yield successive lists of size items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def find_sources(paths, pattern=PATTERN):
+    """Return sorted files matching paths, and pattern in directories.
+
+    Hidden files in directories (temporary outputs of renders in
+    progress) are skipped.
+
+    """
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                sources += [os.path.join(dirpath, filename)
+                            for filename in fnmatch.filter(filenames, pattern)
+                            if not filename.startswith('.')]
+        else:
+            sources += [name for name in glob.glob(path)
+                        if os.path.isfile(name)]
+    return sorted(set(sources))
+
+
+def convert_files(pool, jobs, processes):
+    """Convert (src, dest) pairs in the pool, return number converted."""
+    done = 0
+    # Submit a few batches at a time so that memory use is bounded
+    for batch in batches(jobs, 4 * processes):
+        done += len(pool.map(_convert_worker, batch))
+        print("{:d}/{:d}".format(done, len(jobs)), end='\r')
+        sys.stdout.flush()
+    print()
+    return done
+
+
+def convert_stack(pool, src, dest, channels, half, processes):
+    """Convert src files into one array in dest, one after another."""
+    first = convert(src[0], channels, half)
+    stack = np.lib.format.open_memmap(
+        dest, mode='w+', dtype=first.dtype, shape=(len(src),) + first.shape)
+    stack[0] = first
+    done = 1
+    for batch in batches(src[1:], 4 * processes):
+        for array in pool.map(_read_worker,
+                              [(path, channels, half) for path in batch]):
+            if array.shape != first.shape:
+                sys.exit("{:s}: Shape of {:s} differs from {:s}".format(
+                    os.path.basename(__file__), src[done], src[0]))
+            stack[done] = array
+            done += 1
+        print("{:d}/{:d}".format(done, len(src)), end='\r')
+        sys.stdout.flush()
+    print()
+    stack.flush()
+    del stack
+    with open(os.path.splitext(dest)[0] + '.json', 'w') as file:
+        json.dump(src, file, indent=1)
+
+
+def stack_is_current(src, dest):
+    """Return True if dest stacks exactly src and is not older."""
+    names = os.path.splitext(dest)[0] + '.json'
+    if not os.path.isfile(names):
+        return False
+    with open(names) as file:
+        if json.load(file) != src:
+            return False
+    return all(is_current(path, dest) for path in src)
 
 
 def main():
@@ -32,26 +174,86 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description=__doc__)
     parser.add_argument(
-        'src', type=str, nargs='+', help="Input OpenEXR file(s)")
+        'src', type=str, nargs='+',
+        help="Input OpenEXR file(s) or directories")
     parser.add_argument(
         'dest', type=str,
-        help="Output file, or directory (tsv extension is added to filenames)")
+        help="Output file, or directory (extension of format is added "
+        "to filenames), or stacked array with --stack")
+    parser.add_argument(
+        '-f', '--format', choices=['tsv', 'npy'], default='tsv',
+        help="Output format of files in a directory (default: tsv)")
+    parser.add_argument(
+        '-s', '--stack', action='store_true',
+        help="Stack all inputs into one NumPy array file dest")
+    parser.add_argument(
+        '-c', '--channels', metavar='NAMES', default='R',
+        help="Comma separated channels to convert, or \"all\" "
+        "(default: R)")
+    parser.add_argument('--half', action='store_true',
+                        help="Convert to float16 (default: float32)")
+    parser.add_argument(
+        '--pattern', default=PATTERN,
+        help="Files to convert in directories (default: {:s})".format(
+            PATTERN))
+    parser.add_argument(
+        '-j', '--jobs', metavar='N', type=int,
+        default=multiprocessing.cpu_count(),
+        help="Number of parallel processes (default: all CPUs)")
+    parser.add_argument('--force', action='store_true',
+                        help="Convert even if outputs are up to date")
     args = parser.parse_args()
+    channels = (None if args.channels == 'all' else
+                args.channels.split(','))
 
-    src = [path for pathname in args.src for path in glob.glob(pathname)]
+    src = find_sources(args.src, args.pattern)
     if len(src) == 0:
         sys.exit("{:s}: No matching source files found".format(
             os.path.basename(__file__)))
-    if os.path.isdir(args.dest):
-        for exr in src:
-            convert_to_tsv(exr, os.path.join(
-                args.dest,
-                os.path.splitext(os.path.basename(exr))[0] + '.tsv'))
+    if args.stack:
+        if not args.force and stack_is_current(src, args.dest):
+            print("Stack is up to date")
+            return
+        jobs = None
+    elif os.path.isdir(args.dest):
+        jobs = [(path, os.path.join(
+            args.dest, os.path.splitext(os.path.basename(path))[0] + '.' +
+            args.format)) for path in src]
+        sources = {}
+        for path, dest in jobs:
+            if dest in sources:
+                sys.exit("{:s}: {:s} and {:s} would both be written to "
+                         "{:s}".format(os.path.basename(__file__),
+                                       sources[dest], path, dest))
+            sources[dest] = path
     elif len(src) == 1:
-        convert_to_tsv(src[0], args.dest)
+        jobs = [(src[0], args.dest)]
     else:
         sys.exit("{:s}: Output directory does not exist".format(
             os.path.basename(__file__)))
+    if jobs is not None:
+        if not args.force:
+            jobs = [(path, dest) for path, dest in jobs
+                    if not is_current(path, dest)]
+        text = [dest for _, dest in jobs if not dest.endswith('.npy')]
+        if len(text) > 0 and (channels is None or len(channels) != 1):
+            sys.exit("{:s}: TSV output needs exactly one channel".format(
+                os.path.basename(__file__)))
+        jobs = [(path, dest, channels, args.half) for path, dest in jobs]
+
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        if jobs is None:
+            convert_stack(pool, src, args.dest, channels, args.half,
+                          args.jobs)
+            print("Stacked {:d} files".format(len(src)))
+        else:
+            done = convert_files(pool, jobs, args.jobs)
+            print("Converted {:d} files ({:d} up to date)".format(
+                done, len(src) - done))
+    finally:
+        pool.close()
+        pool.join()
 
 if __name__ == "__main__":
     main()
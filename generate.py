@@ -10,13 +10,24 @@ exit 127
 '''
 import sys
 import os
+import re
 import shutil
 import datetime
 import json
 import argparse
+import subprocess
+import threading
+import multiprocessing
+import time
+import tempfile
+import traceback
+import numpy as np
 import bpy  # pylint: disable=import-error
 import render
 import treegrow
+import manifest
+import semconvert
+import spool
 
 __doc__ = """Run this script with model to generate data.
 
@@ -24,6 +35,8 @@ For help: blender --background --python generate.py -- --help
 
 """
 
+METRICS = "metrics.{:d}.jsonl"
+
 
 class Generate():
     """Generate random views of the model with textures and labels.
@@ -34,52 +47,109 @@ class Generate():
 
     """
 
-    def __init__(self, path: str, files: dict):
-        """Initialise with specified configuration files and output to path."""
+    def __init__(self, path: str, files: dict, fixed_threads: bool=False):
+        """Initialise with specified configuration files and output to path.
+
+        Render threads are taken from the host profile unless
+        fixed_threads is set (see set_threads).
+
+        """
         clean_scene()
+        self.fixed_threads = fixed_threads
         self.objects = bpy.data.objects[:]
+        # One registry of objects by name (grown trees are added to it)
+        self.registry = render.helpers.Registry(self.objects)
+        # Model trees of grown keys: (object, location, rotation, hidden)
+        self.tree_origins = {}
+        self.cache = render.cache.GeometryCache()
+        self.manifest = None
+        self.existing = set()
+        # Time phases of every output (operator calls are counted in run)
+        self.metrics = render.metrics.Metrics()
+        self.metrics.watch_render()
+        self.open(path, files)
+
+    def open(self, path: str, files: dict):
+        """Use configuration files of the run in path and output to path."""
         self.path = path
         self.files = files
+        self.trees_loaded = None
+        self.load()
 
-        # Initialise objects with configurations from files
-        self.labels = render.labels.Labels(self.objects)
+    def load(self):
+        """Initialise objects with configurations from files."""
+        clean_scene()
+        self.labels = render.labels.Labels(self.registry)
         self.labels.read(self.files['labels'])
-        self.textures = render.textures.Textures(self.objects)
+        self.textures = render.textures.Textures(self.registry)
         self.textures.read(self.files['textures'])
         # Render file can be created automatically but probably not
         # when running, spheres and lines are in render file
-        self.render = render.render.Render(self.objects, self.files['render'])
+        self.render = render.render.Render(self.objects, self.files['render'],
+                                           self.cache)
+        self.render.metrics = self.metrics
+        self.render.fixed_threads = self.fixed_threads
+        self.loaded = self.config_stamp()
+
+    def config_stamp(self):
+        """Return modification times of the configuration files.
+
+        Points and trees files are excluded: they are written by runs
+        and trees are only grown again if their file changes (see
+        `grow_trees`).
+
+        """
+        return {key: os.path.getmtime(path)
+                for key, path in self.files.items()
+                if key not in ('out', 'trees')}
+
+    def grow_trees(self, write: bool=True):
+        """Grow trees according to the coordinates specified in file.
+
+        Newly fixed coordinates are written back to the file unless
+        `write` is False (workers must not race on the shared file).
+        Nothing is done if the file has not changed since trees were
+        last grown from it. Trees of keys grown from an earlier file
+        but not in this one are put back as in the model.
 
-    def grow_trees(self):
-        """Grow trees according to the coordinates specified in file."""
+        """
+        if self.trees_loaded == os.path.getmtime(self.files['trees']):
+            return
         with open(self.files['trees']) as file:
             trees = json.load(file)
-            grower = treegrow.TreeGrow(self.render.landscape, trees)
+            for key in trees:
+                self.tree_origins.setdefault(key, [
+                    (tree, tuple(tree.location), tuple(tree.rotation_euler),
+                     tree.hide_render) for tree in self.registry.find(key)])
+            self.reset_trees(set(self.tree_origins) - set(trees))
+            grower = treegrow.TreeGrow(self.render.landscape, trees,
+                                       self.render.heightfield, self.cache,
+                                       self.registry)
             trees = grower.grow_all()
-        with open(self.files['trees'], 'w') as file:
-            json.dump(trees, file)
+        if write:
+            with open(self.files['trees'], 'w') as file:
+                json.dump(trees, file)
+        self.trees_loaded = os.path.getmtime(self.files['trees'])
 
-    def point(self):
-        """Return a random sun and camera setup."""
-        sun_rotation = self.render.random_sun()
-        lens, location, rotation = self.render.random_camera()
-        return {'sun_rotation': sun_rotation, 'camera_lens': lens,
-                'camera_location': location, 'camera_rotation': rotation}
+    def reset_trees(self, keys):
+        """Hide grown trees of keys and put back the trees of the model."""
+        for key in keys:
+            for tree in self.registry.find(key):
+                tree.hide_render = True
+            for tree, location, rotation, hidden in \
+                    self.tree_origins.pop(key):
+                tree.location = location
+                tree.rotation_euler = rotation
+                tree.hide_render = hidden
 
-    def run(self, size: int=1, all_levels: bool=False, gpu: bool=False,
-            render_type: list=None):
-        """Generate the data, `size` sets of visual images and labels.
+    def load_points(self, size: int=1, seed: int=None):
+        """Return points from the output file, generating them if empty.
 
-        If data output file already exists, only create missing images
-        (`size` is ignored). Otherwise, generate points to file and
-        create images.
+        Point i is generated from the random stream keyed by (seed, i),
+        a random seed is used if not given. Scene states are added to
+        the points (see `add_scenes`).
 
         """
-        # Grow trees if file is provided
-        if self.files.get('trees') is not None:
-            self.grow_trees()
-
-        # If output file is not empty, load points, otherwise generate points
         out_path = self.files['out']
         if os.path.getsize(out_path):
             print("==Load points from file==")
@@ -87,9 +157,123 @@ class Generate():
                 data = json.load(file)
         else:
             print("==Generate points==")
-            data = {"{:03d}".format(i): self.point() for i in range(size)}
-            with open(out_path, 'w') as file:
+            if seed is None:
+                seed = int.from_bytes(os.urandom(4), 'little')
+            points = self.render.random_points(range(size), seed)
+            data = {"{:03d}".format(i): point for i, point in points.items()}
+            self.add_scenes(data, seed)
+            for test, rate in sorted(self.render.acceptance_rates().items()):
+                print("==> Acceptance of {:s}: {:.1%}".format(test, rate))
+            with open(manifest.temp_path(out_path), 'w') as file:
                 json.dump(data, file)
+            manifest.commit(manifest.temp_path(out_path), out_path)
+        return data
+
+    def add_scenes(self, data: dict, seed: int):
+        """Add random scene states to points, each shared by several views.
+
+        Every `views_per_state` consecutive points share a state with
+        the texture draw, sun, sky and landscape displacement, drawn
+        from the random stream keyed by (seed, state, 1). States are
+        stored in the points so that reruns reproduce them.
+
+        """
+        views = self.render.opts['views_per_state']
+        scene = None
+        for position, seq in enumerate(sorted(data)):
+            state = position // views
+            if scene is None or scene['state'] != state:
+                rng = np.random.RandomState([seed, state, 1])
+                sun_rotation = self.render.random_sun(rng)
+                scene = {'state': state,
+                         'textures': self.textures.random_draw(rng),
+                         'sky': self.render.random_sky(rng),
+                         'displacement': self.render.random_displacement(rng)}
+            data[seq]['sun_rotation'] = sun_rotation
+            data[seq]['scene'] = scene
+        return data
+
+    def set_scene(self, point: dict):
+        """Set textures, sky, landscape and sun of the scene of a point.
+
+        Points without a recorded scene state get random textures,
+        clouds and landscape displacement.
+
+        """
+        scene = point.get('scene', {})
+        with self.metrics.phase('texture'):
+            self.textures.texture(scene.get('textures'))
+        with self.metrics.phase('displace'):
+            self.render.displace_landscape(scene.get('displacement'))
+        with self.metrics.phase('sun'):
+            self.render.place_sun(point['sun_rotation'], scene.get('sky'))
+
+    def place_camera(self, point: dict):
+        """Place the camera of a point."""
+        with self.metrics.phase('camera'):
+            self.render.place_camera(point['camera_lens'],
+                                     point['camera_location'],
+                                     point['camera_rotation'])
+
+    def prepare(self, size: int=1, seed: int=None):
+        """Grow trees and fix the points before starting any workers."""
+        if self.files.get('trees') is not None:
+            self.grow_trees()
+        return self.load_points(size, seed)
+
+    def run(self, size: int=1, all_levels: bool=False, gpu: bool=False,
+            render_type: list=None, shard: tuple=(0, 1), seed: int=None,
+            points: list=None):
+        """Generate the data, `size` sets of visual images and labels.
+
+        If data output file already exists, only create missing or
+        stale images according to the run manifest (`size` is
+        ignored). Otherwise, generate points to file and create
+        images. With `shard` as (index, count), only every
+        count-th scene state starting from index is rendered; points
+        and trees must then already be fixed in the files (see
+        `prepare`). Views of the same scene state are rendered back to
+        back and only the camera is moved between them. If `points` is
+        given, only points with these sequence numbers are rendered.
+        Temporary outputs of the points left by a crash are removed.
+
+        """
+        index, count = shard
+        # Grow trees if file is provided
+        if self.files.get('trees') is not None:
+            self.grow_trees(write=count == 1)
+
+        # If output file is not empty, load points, otherwise generate points
+        data = self.load_points(size, seed)
+        data = {seq: data[seq] for position, seq in enumerate(sorted(data))
+                if scene_state(data[seq], position) % count == index}
+        if points is not None:
+            data = {seq: data[seq] for seq in points if seq in data}
+
+        # Only this process renders these points, so their temporary
+        # files can only be left over from a crash
+        manifest.remove_temps(self.path, data)
+
+        # Outputs are up to date if produced from the current inputs
+        self.manifest = manifest.Manifest(self.path, "{:d}".format(index))
+        # Outputs deleted since they were recorded are rendered again
+        self.existing = manifest.existing(self.path)
+        self.metrics.path = os.path.join(self.path, METRICS.format(index))
+        # Operator calls are only counted while rendering
+        self.metrics.count_ops()
+        try:
+            self._render_outputs(data, render_type, all_levels, gpu)
+        finally:
+            self.metrics.stop_ops()
+
+        # Only merge the manifest when no other workers are running
+        if count == 1:
+            self.manifest.compact()
+
+    def _render_outputs(self, data: dict, render_type: list=None,
+                        all_levels: bool=False, gpu: bool=False):
+        """Render outputs of render_type of points that are not current."""
+        inputs = self.inputs()
 
         # Check which renders to do and default to all
         if render_type is None:
@@ -97,44 +281,218 @@ class Generate():
 
         if "visual" in render_type:
             print("==Render visual images==")
-            for seq, point in data.items():
-                path = os.path.join(self.path, "{:s}.vis.png".format(seq))
-                if os.path.isfile(path):
+            pending = self._pending(data, "vis.png", inputs['visual'])
+            scene = None
+            for done, (point, path, key) in enumerate(
+                    pending, len(data) - len(pending)):
+                progress("visual", done, len(data))
+                self.metrics.start("visual", sequence(path))
+                temp = manifest.temp_path(path)
+                if point.get('scene') is None or point['scene'] != scene:
+                    self.set_scene(point)
+                    scene = point.get('scene')
+                self.place_camera(point)
+                self.render.render(temp, gpu)
+                self._commit(temp, path, key)
+                self.metrics.finish(path)
+            progress("visual", len(data), len(data))
+
+        if "combined" in render_type:
+            print("==Render combined visual, depth and index==")
+            self.labels.index_level(2)
+            outputs = (("vis.png", inputs['visual']),
+                       ("dep" + self.render.depth_extension(),
+                        inputs['depth']),
+                       ("idx.exr", inputs['semantic']))
+            scene = None
+            for done, (seq, point) in enumerate(sorted(data.items())):
+                progress("combined", done, len(data))
+                targets = [self._output(seq, suffix, inputs_, point)
+                           for suffix, inputs_ in outputs]
+                if all(self._current(path, key) for path, key in targets):
                     continue
-                self.textures.texture()
-                self.render.displace_landscape()
-                self.render.place_sun(point['sun_rotation'])
-                self.render.place_camera(point['camera_lens'],
-                                         point['camera_location'],
-                                         point['camera_rotation'])
-                self.render.render(path, gpu)
+                self.metrics.start("combined", seq)
+                temps = [manifest.temp_path(path) for path, _ in targets]
+                os.makedirs(os.path.dirname(temps[0]), exist_ok=True)
+                if point.get('scene') is None or point['scene'] != scene:
+                    self.set_scene(point)
+                    scene = point.get('scene')
+                self.place_camera(point)
+                self.render.render_combined(*temps, gpu=gpu)
+                for temp, (path, key) in zip(temps, targets):
+                    self._commit(temp, path, key)
+                self.metrics.finish(*[path for path, _ in targets])
+            progress("combined", len(data), len(data))
 
         if "semantic" in render_type:
             print("==Render semantic labels==")
-            levels = range(3) if all_levels else [2]
-            for level in levels:
-                # Only change materials once per level for efficiency
-                self.labels.color_level(level)
-                for seq, point in data.items():
-                    path = os.path.join(self.path,
-                                        "{:s}.sem.{:d}.png".format(seq, level))
-                    if os.path.isfile(path):
-                        continue
-                    self.render.place_camera(point['camera_lens'],
-                                             point['camera_location'],
-                                             point['camera_rotation'])
-                    self.render.render_semantic(path)
+            pending = self._pending(data, "sem.2.png", inputs['semantic'])
+            if len(pending) > 0:
+                self.labels.color_level(2)
+            for done, (point, path, key) in enumerate(
+                    pending, len(data) - len(pending)):
+                progress("semantic", done, len(data))
+                self.metrics.start("semantic", sequence(path))
+                temp = manifest.temp_path(path)
+                self.place_camera(point)
+                self.render.render_semantic(temp)
+                self._commit(temp, path, key)
+                self.metrics.finish(path)
+            progress("semantic", len(data), len(data))
+            if all_levels:
+                self.derive_levels(data, inputs['semantic'])
 
         if "depth" in render_type:
             print("==Render depth==")
-            for seq, point in data.items():
-                path = os.path.join(self.path, "{:s}.dep.exr".format(seq))
-                if os.path.isfile(path):
-                    continue
-                self.render.place_camera(point['camera_lens'],
-                                         point['camera_location'],
-                                         point['camera_rotation'])
-                self.render.render_depth(path, gpu)
+            pending = self._pending(
+                data, "dep" + self.render.depth_extension(), inputs['depth'])
+            for done, (point, path, key) in enumerate(
+                    pending, len(data) - len(pending)):
+                progress("depth", done, len(data))
+                self.metrics.start("depth", sequence(path))
+                temp = manifest.temp_path(path)
+                self.place_camera(point)
+                self.render.render_depth(temp, gpu)
+                self._commit(temp, path, key)
+                self.metrics.finish(path)
+            progress("depth", len(data), len(data))
+
+    def derive_levels(self, data: dict, inputs: str):
+        """Derive semantic levels 0 and 1 from the level 2 renders.
+
+        Lower levels are written as paletted images of class indices
+        that look the same as rendering them with their own colors.
+
+        """
+        print("==Derive semantic levels==")
+        lookup = semconvert.Lookup(self.files['labels'])
+        for seq, point in sorted(data.items()):
+            targets = [self._output(seq, "sem.{:d}.png".format(level),
+                                    inputs, point) for level in (0, 1)]
+            if all(self._current(path, key) for path, key in targets):
+                continue
+            source, _ = self._output(seq, "sem.2.png", inputs, point)
+            index = lookup.read(source)
+            for level, (path, key) in enumerate(targets):
+                temp = manifest.temp_path(path)
+                lookup.write(temp, lookup.convert(index, level), level)
+                self._commit(temp, path, key)
+
+    def verify_semantic(self, count: int=4):
+        """Compare the semantic backends on count points of the run.
+
+        Level 2 labels are rendered with Blender Render and with the
+        rasterizer into a temporary directory. Return the fraction of
+        differing pixels by point.
+
+        """
+        print("==Verify semantic backends==")
+        data = self.load_points()
+        self.labels.color_level(2)
+        differing = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for seq in spread(sorted(data), count):
+                self.place_camera(data[seq])
+                images, times = [], []
+                for backend in ('internal', 'raster'):
+                    path = os.path.join(directory, "{:s}.{:s}.png".format(
+                        seq, backend))
+                    start = time.time()
+                    self.render.render_semantic(path, backend)
+                    times.append(time.time() - start)
+                    images.append(render.raster.read(path))
+                differing[seq] = float(np.mean(
+                    np.any(images[0] != images[1], axis=2)))
+                print("==> {:s}: {:.4%} of pixels differ (internal {:.2f} s, "
+                      "raster {:.2f} s)".format(seq, differing[seq], *times))
+                sys.stdout.flush()
+        return differing
+
+    def verify_depth(self, count: int=4):
+        """Compare rasterized depth with the Cycles Z pass on count points.
+
+        Return the median relative difference by point. Differences
+        are expected at edges, where Cycles takes the depth of a
+        jittered sample rather than of the pixel centre.
+
+        """
+        print("==Verify depth backends==")
+        data = self.load_points()
+        differences = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for seq in spread(sorted(data), count):
+                self.place_camera(data[seq])
+                images, times = [], []
+                for backend in ('cycles', 'raster'):
+                    path = os.path.join(directory, "{:s}.{:s}.exr".format(
+                        seq, backend))
+                    start = time.time()
+                    self.render.render_depth(path, backend=backend)
+                    times.append(time.time() - start)
+                    images.append(render.depth.read(path))
+                relative = np.abs(images[1] - images[0]) / images[0]
+                differences[seq] = float(np.median(relative))
+                print("==> {:s}: median difference {:.2e}, {:.2%} of pixels "
+                      "within 1% (cycles {:.2f} s, raster {:.2f} s)".format(
+                          seq, differences[seq], np.mean(relative < 0.01),
+                          *times))
+                sys.stdout.flush()
+        return differences
+
+    def inputs(self):
+        """Return digests of the inputs shared by outputs of each type.
+
+        Visual images depend on the whole render and texture
+        configuration, semantic and depth images only on the camera
+        settings (and labels, or depth output settings). All depend on
+        the model and trees.
+
+        """
+        def load(key):
+            """Return contents of configuration file if provided."""
+            if self.files.get(key) is None:
+                return None
+            with open(self.files[key]) as file:
+                return json.load(file)
+
+        model = manifest.file_digest(bpy.data.filepath)
+        trees = load('trees')
+        camera = {key: self.render.opts[key]
+                  for key in ('resolution', 'camera_clip_end')}
+        return {
+            'visual': manifest.digest(model, trees, load('render'),
+                                      load('textures')),
+            'semantic': manifest.digest(model, trees, camera, load('labels')),
+            'depth': manifest.digest(model, trees, camera,
+                                     self.render.depth_output())}
+
+    def _output(self, seq: str, suffix: str, inputs: str, point: dict):
+        """Return path and input key of the output of a point."""
+        path = manifest.shard_path(self.path, "{:s}.{:s}".format(seq, suffix))
+        return path, manifest.digest(inputs, point)
+
+    def _current(self, path: str, key: str):
+        """Return True if output at path exists and is up to date with key."""
+        name = os.path.relpath(path, self.path)
+        return name in self.existing and self.manifest.current(name, key)
+
+    def _pending(self, data: dict, suffix: str, inputs: str):
+        """Return (point, path, key) of outputs that are stale or missing."""
+        pending = []
+        for seq, point in sorted(data.items()):
+            path, key = self._output(seq, suffix, inputs, point)
+            if not self._current(path, key):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                pending.append((point, path, key))
+        return pending
+
+    def _commit(self, temp: str, path: str, key: str):
+        """Move a completed output into place and record it."""
+        with self.metrics.phase('commit'):
+            manifest.commit(temp, path)
+            name = os.path.relpath(path, self.path)
+            self.manifest.record(name, key)
+            self.existing.add(name)
 
 
 def clean_scene():
@@ -146,6 +504,215 @@ def clean_scene():
         bpy.ops.object.delete(use_global=False)
 
 
+def sequence(path: str):
+    """Return the sequence number of the point of an output path."""
+    return os.path.basename(path).split('.')[0]
+
+
+def spread(seqs: list, count: int):
+    """Return count items spread evenly over seqs."""
+    return [seqs[index] for index in np.unique(np.round(np.linspace(
+        0, len(seqs) - 1, min(count, len(seqs)))).astype(int))]
+
+
+def scene_state(point: dict, default: int):
+    """Return the scene state of a point, default if not recorded."""
+    return point.get('scene', {}).get('state', default)
+
+
+def progress(render_type: str, done: int, total: int):
+    """Print progress in a format the supervising process can parse."""
+    print("==Progress== {:s} {:d}/{:d}".format(render_type, done, total))
+    sys.stdout.flush()
+
+
+def output_kinds(render_type: list, all_levels: bool, depth_extension: str):
+    """Return the kinds of outputs of every point rendered by a run."""
+    if render_type is None:
+        render_type = ["visual", "semantic", "depth"]
+    kinds = []
+    if "visual" in render_type or "combined" in render_type:
+        kinds.append("vis.png")
+    if "semantic" in render_type:
+        kinds += ["sem.{:d}.png".format(level)
+                  for level in ((0, 1, 2) if all_levels else (2,))]
+    if "depth" in render_type or "combined" in render_type:
+        kinds.append("dep" + depth_extension)
+    if "combined" in render_type:
+        kinds.append("idx.exr")
+    return kinds
+
+
+def start_packer(path: str, kinds: list, points: str):
+    """Start packing the run in path as its samples are completed.
+
+    The packer (see pack.py) writes full shards while the run renders
+    and the remaining samples once it is terminated.
+
+    """
+    script = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                          "pack.py")
+    return subprocess.Popen(
+        [bpy.app.binary_path_python, script, path, "--watch",
+         "--points", os.path.basename(points), "--kinds"] + kinds)
+
+
+def stop_packer(packer):
+    """Stop the packer (if any) and wait for it to pack the rest."""
+    if packer is not None:
+        packer.terminate()
+        packer.wait()
+
+
+def set_threads(threads: int):
+    """Fix the number of threads Blender uses for rendering."""
+    bpy.data.scenes[0].render.threads_mode = 'FIXED'
+    bpy.data.scenes[0].render.threads = threads
+
+
+def worker_command(args, name: str, index: int, workers: int, threads: int):
+    """Return the command line for a worker rendering one shard."""
+    argv = ["--name", name, "--conf", args.conf,
+            "--shard", "{:d}/{:d}".format(index, workers),
+            "--threads", str(threads)]
+    if args.all_levels:
+        argv += ["--all-levels"]
+    if args.gpu is not None:
+        argv += ["--gpu"] + ([args.gpu] if len(args.gpu) > 0 else [])
+    if args.render is not None:
+        argv += ["--render"] + args.render
+    if args.materials is not None:
+        argv += ["--materials", args.materials]
+    return [bpy.app.binary_path, bpy.data.filepath, "--factory-startup",
+            "--background", "--python", os.path.realpath(__file__),
+            "--"] + argv
+
+
+def supervise(commands: list, path: str):
+    """Run worker commands in parallel and merge their progress.
+
+    Output of each worker is logged to a file in `path` and only the
+    progress reports are parsed and summed over all workers. Return
+    the list of worker exit codes.
+
+    """
+    pattern = re.compile(r"^==Progress== (\w+) (\d+)/(\d+)$")
+    state = [{} for _ in commands]
+    lock = threading.Lock()
+
+    def follow(index, proc, log):
+        """Copy worker output to log and record progress reports."""
+        for line in proc.stdout:
+            log.write(line)
+            match = pattern.match(line.strip())
+            if match is None:
+                continue
+            render_type, done, total = match.groups()
+            with lock:
+                state[index][render_type] = (int(done), int(total))
+                merged = [state_[render_type] for state_ in state
+                          if render_type in state_]
+                print("==> {:s}: {:d}/{:d} ({:d} workers)".format(
+                    render_type, sum(done for done, _ in merged),
+                    sum(total for _, total in merged), len(merged)))
+                sys.stdout.flush()
+
+    procs, threads, logs = [], [], []
+    try:
+        for index, command in enumerate(commands):
+            log = open(os.path.join(
+                path, "worker.{:d}.log".format(index)), 'w')
+            proc = subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                universal_newlines=True)
+            thread = threading.Thread(target=follow, args=(index, proc, log))
+            thread.start()
+            logs.append(log)
+            procs.append(proc)
+            threads.append(thread)
+        codes = [proc.wait() for proc in procs]
+    except KeyboardInterrupt:
+        for proc in procs:
+            proc.terminate()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+        for log in logs:
+            log.close()
+    return codes
+
+
+def setup_run(conf: str, name: str):
+    """Copy configuration files into the folder of run name.
+
+    Return the path of the run and the configuration files in it.
+    Files already in the folder are kept.
+
+    """
+    path = os.path.abspath(os.path.join('data', name))
+    with open(conf) as file:
+        files = json.load(file)
+    os.makedirs(path, exist_ok=True)
+    for filepath in files.values():
+        filepath = os.path.join(os.path.dirname(conf), filepath)
+        if not os.path.isfile(os.path.join(path, os.path.basename(filepath))):
+            shutil.copy(filepath, path)
+    # And make files dict point to the new files
+    for key in files:
+        files[key] = os.path.join(path, os.path.basename(files[key]))
+    return path, files
+
+
+def serve(spool_path: str, gpu: bool=False, fixed_threads: bool=False,
+          interval: float=1.):
+    """Render jobs submitted to the spool directory (see spool.py).
+
+    The model and the state of the last run are kept between jobs:
+    configuration files are only read again if they change, and trees
+    are only grown again if the trees file changes. Jobs claimed by
+    daemons that have stopped are submitted again first, and a job
+    that is not completed is finished with an error.
+
+    """
+    print("==Serve jobs from {:s}==".format(spool_path))
+    spool.init(spool_path)
+    for job_id in spool.requeue(spool_path):
+        print("==> Submitted job {:s} of a stopped daemon again".format(
+            job_id))
+    gen = None
+    while True:
+        claimed = spool.claim(spool_path)
+        if claimed is None:
+            time.sleep(interval)
+            continue
+        job_id, job = claimed
+        print("==Job {:s}==".format(job_id))
+        start = time.time()
+        # Unless the job completes, the client gets an error
+        result = {'status': 'error', 'error': "Daemon stopped"}
+        try:
+            path, files = setup_run(job['conf'], job['name'])
+            if gen is None:
+                gen = Generate(path, files, fixed_threads)
+            elif gen.path != path or gen.files != files:
+                gen.open(path, files)
+            elif gen.config_stamp() != gen.loaded:
+                print("==Reload configuration==")
+                gen.load()
+            gen.run(job.get('size', 4), job.get('all_levels', False), gpu,
+                    job.get('render'), seed=job.get('seed'),
+                    points=job.get('points'))
+            result = {'status': 'ok'}
+        except Exception as error:  # pylint: disable=broad-except
+            traceback.print_exc()
+            result = {'status': 'error', 'error': str(error)}
+        finally:
+            result['time'] = time.time() - start
+            spool.finish(spool_path, job_id, result)
+            sys.stdout.flush()
+
+
 def main():
     """Parse the arguments and generate data."""
     print("\n==> {:s}".format(os.path.relpath(__file__)))
@@ -168,6 +735,9 @@ def main():
                         help="Configuration file (default: conf.json)")
     parser.add_argument("-s", "--size", metavar="N", type=int, default=4,
                         help="Number of images to generate (default: 4)")
+    parser.add_argument(
+        "--seed", metavar="N", type=int,
+        help="Seed for generating points (default: random)")
     parser.add_argument(
         "-l", "--all-levels", action='store_true',
         help="Generate all levels of semantic labels (default only level 2)")
@@ -178,30 +748,37 @@ def main():
     parser.add_argument(
         "-r", "--render", metavar="TYPE", nargs="*",
         help="Render only given types; possible options: \"visual\", "
-        "\"semantic\", \"depth\" (default all)")
+        "\"semantic\", \"depth\" (default all), or \"combined\" to "
+        "render visual, depth and label index passes together")
     parser.add_argument("-m", "--materials", metavar="FILE",
                         help="Link materials from given library file.")
+    parser.add_argument(
+        "-w", "--workers", metavar="N", type=int,
+        help="Render in N Blender processes, each with a shard of points")
+    parser.add_argument(
+        "-t", "--threads", metavar="N", type=int,
+        help="Number of render threads (default: profiled for the host by "
+        "hostprofile.py, or all, or shared equally between workers)")
+    parser.add_argument(
+        "-d", "--daemon", metavar="SPOOL",
+        help="Keep the model loaded and render jobs submitted to the "
+        "spool directory (see spool.py)")
+    parser.add_argument(
+        "--verify-semantic", metavar="N", type=int,
+        help="Compare semantic renders of the rasterizer with Blender "
+        "Render on N points of the run and exit")
+    parser.add_argument(
+        "--verify-depth", metavar="N", type=int,
+        help="Compare rasterized depth with the Cycles Z pass on N points "
+        "of the run and exit")
+    parser.add_argument(
+        "-p", "--pack", action='store_true',
+        help="Pack samples into tar shards as they are completed "
+        "(see pack.py)")
+    parser.add_argument("--shard", metavar="INDEX/COUNT", default="0/1",
+                        help=argparse.SUPPRESS)
     args = parser.parse_args(argv)
-
-    # Paths
-    subpath = 'data/'
-    if args.name is None:
-        subpath += datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
-    else:
-        subpath += args.name
-    path = os.path.abspath(subpath)
-
-    # Copy files into path
-    with open(args.conf) as file:
-        files = json.load(file)
-    os.makedirs(path, exist_ok=True)
-    for filepath in files.values():
-        filepath = os.path.join(os.path.dirname(args.conf), filepath)
-        if not os.path.isfile(os.path.join(path, os.path.basename(filepath))):
-            shutil.copy(filepath, path)
-    # And make files dict point to the new files
-    for key in files:
-        files[key] = os.path.join(path, os.path.basename(files[key]))
+    shard = tuple(int(x) for x in args.shard.split('/'))
 
     # Use GPU if specified
     gpu = False
@@ -215,9 +792,71 @@ def main():
         with bpy.data.libraries.load(
                 args.materials, link=True, relative=True) as (src, dest):
             dest.materials = src.materials
+    if args.threads is not None:
+        set_threads(args.threads)
+    if args.daemon is not None:
+        serve(args.daemon, gpu, args.threads is not None)
+        return
+
+    # Copy files into path
+    if args.name is None:
+        args.name = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
+    path, files = setup_run(args.conf, args.name)
     # Generate data
-    gen = Generate(path, files)
-    gen.run(args.size, args.all_levels, gpu, args.render)
+    gen = Generate(path, files, args.threads is not None)
+    if args.verify_semantic is not None or args.verify_depth is not None:
+        if files.get('trees') is not None:
+            gen.grow_trees(write=False)
+        failed = []
+        if args.verify_semantic is not None:
+            differing = gen.verify_semantic(args.verify_semantic)
+            if any(value > 0 for value in differing.values()):
+                failed.append("semantic")
+        if args.verify_depth is not None:
+            # Only edges may differ, most pixels must match closely
+            differences = gen.verify_depth(args.verify_depth)
+            if any(value > 1e-3 for value in differences.values()):
+                failed.append("depth")
+        if len(failed) > 0:
+            sys.exit("{:s}: Backends differ: {:s}".format(
+                os.path.basename(__file__), ", ".join(failed)))
+        return
+    packer = None
+    if args.pack:
+        kinds = output_kinds(args.render, args.all_levels,
+                             gen.render.depth_extension())
+        packer = start_packer(path, kinds, files['out'])
+    try:
+        if args.workers is not None:
+            # Set thread budget of workers: profiled for this host (see
+            # hostprofile.py) or shared equally if not given
+            if args.threads is None:
+                args.threads = gen.render.profiles.worker_threads(
+                    gen.render.opts['resolution'], args.workers,
+                    'GPU' if gpu else 'CPU')
+            if args.threads is None:
+                args.threads = max(
+                    1, multiprocessing.cpu_count() // args.workers)
+            # Fix trees and points once, then render shards in parallel
+            gen.prepare(args.size, args.seed)
+            codes = supervise([worker_command(args, args.name, index,
+                                              args.workers, args.threads)
+                               for index in range(args.workers)], path)
+            # Pack the rest before the journals it reads are merged
+            stop_packer(packer)
+            packer = None
+            manifest.Manifest(path).compact()
+            failed = [index for index, code in enumerate(codes) if code != 0]
+            if len(failed) > 0:
+                sys.exit(
+                    "{:s}: Workers failed: {:s} (see worker logs)".format(
+                        os.path.basename(__file__),
+                        ", ".join(str(index) for index in failed)))
+        else:
+            gen.run(args.size, args.all_levels, gpu, args.render, shard,
+                    args.seed)
+    finally:
+        stop_packer(packer)
     print()
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+#!/bin/bash
+# -*- mode: python;-*-
+"true" '''\'
+model=$1
+shift
+
+exec ./blender "$model" --factory-startup --background --python "$0" -- "$@"
+
+exit 127
+'''
+import sys
+import os
+import re
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import bpy  # pylint: disable=import-error
+import render
+
+__doc__ = """Profile tile sizes and threads for rendering on this host.
+
+A random view of the scene is rendered with every tile size using all
+threads, then with the best tile size and every number of threads.
+For every number of parallel workers (separate Blender processes as
+with `generate.py --workers`), the throughput is measured with the
+threads shared equally between the workers and with twice as many
+(which can keep the cores busy while workers synchronise the scene).
+
+The best settings are stored for the host, device and resolution (see
+render.profiles) and are applied by generate.py.
+
+"""
+
+
+def setup(conf_file: str, seed: int=0):
+    """Return a renderer with a random view of the scene.
+
+    Stored profiles are not applied when rendering with it.
+
+    """
+    with open(conf_file) as file:
+        files = json.load(file)
+    renderer = render.render.Render(
+        bpy.data.objects[:],
+        os.path.join(os.path.dirname(conf_file), files['render']))
+    renderer.profiles = None
+    np.random.seed(seed)
+    renderer.place_sun()
+    renderer.place_camera()
+    return renderer
+
+
+def set_tile_threads(tile: int, threads: int=None):
+    """Set square tiles and fixed threads (all threads if None)."""
+    settings = bpy.data.scenes[0].render
+    settings.tile_x = settings.tile_y = tile
+    if threads is None:
+        settings.threads_mode = 'AUTO'
+    else:
+        settings.threads_mode = 'FIXED'
+        settings.threads = threads
+
+
+def time_render(renderer, path: str, gpu: bool, repeat: int):
+    """Return the best render time of repeat renders."""
+    times = []
+    for _ in range(repeat):
+        renderer.metrics.start('profile', os.path.basename(path))
+        renderer.render(path, gpu)
+        times.append(renderer.metrics.finish(path)['phases']['render'])
+    return min(times)
+
+
+def time_workers(args, tile: int, workers: int, threads: int):
+    """Return the renders per second of parallel worker processes."""
+    command = [bpy.app.binary_path, bpy.data.filepath, "--factory-startup",
+               "--background", "--python", os.path.realpath(__file__), "--",
+               "--conf", args.conf, "--samples", str(args.samples),
+               "--child", str(tile), str(threads), str(args.repeat)]
+    procs = [subprocess.Popen(command, stdout=subprocess.PIPE,
+                              universal_newlines=True)
+             for _ in range(workers)]
+    pattern = re.compile(r"^==Worker== (\S+) (\S+)$", re.MULTILINE)
+    spans = []
+    for proc in procs:
+        output, _ = proc.communicate()
+        match = pattern.search(output)
+        if proc.returncode != 0 or match is None:
+            sys.exit("{:s}: profiling worker failed".format(
+                os.path.basename(__file__)))
+        spans.append([float(value) for value in match.groups()])
+    spans = np.array(spans)
+    return workers * args.repeat / (spans[:, 1].max() - spans[:, 0].min())
+
+
+def child(args, renderer, directory: str):
+    """Render repeat times as a profiling worker and print the span."""
+    tile, threads, repeat = args.child
+    set_tile_threads(tile, threads)
+    path = os.path.join(directory, "worker.png")
+    renderer.render(path)  # Load the scene before timing
+    start = time.time()
+    for _ in range(repeat):
+        renderer.render(path)
+    print("==Worker== {:f} {:f}".format(start, time.time()))
+
+
+def profile_host(args, renderer, directory: str, gpu: bool):
+    """Measure tile sizes, threads and workers and return the profile."""
+    path = os.path.join(directory, "profile.png")
+    renderer.render(path, gpu)  # Load the scene before timing
+    tile_times = {}
+    for tile in args.tiles:
+        set_tile_threads(tile)
+        tile_times[tile] = time_render(renderer, path, gpu, args.repeat)
+        print("==> Tile {:d}: {:.2f} s".format(tile, tile_times[tile]))
+        sys.stdout.flush()
+    tile = min(tile_times, key=tile_times.get)
+    profile = {'tile': [tile, tile], 'samples': args.samples,
+               'tile_times': {str(key): value
+                              for key, value in tile_times.items()},
+               'time': time.time()}
+    if gpu:
+        return profile
+
+    cpus = multiprocessing.cpu_count()
+    thread_times = {}
+    for threads in sorted(set(args.threads or [
+            2**power for power in range(cpus.bit_length())] + [cpus])):
+        set_tile_threads(tile, threads)
+        thread_times[threads] = time_render(renderer, path, gpu,
+                                            args.repeat)
+        print("==> {:d} threads: {:.2f} s".format(
+            threads, thread_times[threads]))
+        sys.stdout.flush()
+    threads = min(thread_times, key=thread_times.get)
+    profile['threads'] = threads
+    profile['thread_times'] = {str(key): value
+                               for key, value in thread_times.items()}
+
+    worker_threads, throughput = {1: threads}, {1: 1 / thread_times[threads]}
+    for workers in args.workers:
+        if workers < 2:
+            continue
+        shared = max(1, cpus // workers)
+        rates = {count: time_workers(args, tile, workers, count)
+                 for count in sorted(set([shared, 2*shared]))}
+        worker_threads[workers] = max(rates, key=rates.get)
+        throughput[workers] = rates[worker_threads[workers]]
+        print("==> {:d} workers: {:d} threads each, {:.2f} renders/s".format(
+            workers, worker_threads[workers], throughput[workers]))
+        sys.stdout.flush()
+    profile['workers'] = max(throughput, key=throughput.get)
+    profile['worker_threads'] = {str(key): value
+                                 for key, value in worker_threads.items()}
+    profile['throughput'] = {str(key): value
+                             for key, value in throughput.items()}
+    return profile
+
+
+def main():
+    """Parse the arguments, profile the host and store the profile."""
+    print("\n==> {:s}".format(os.path.relpath(__file__)))
+    # Get all arguments after '--'
+    try:
+        argv = sys.argv[sys.argv.index('--') + 1:]
+    except ValueError:
+        argv = []
+
+    prog_text = "( {0:s} MODEL | blender MODEL --background " \
+                "--python {0:s} -- )".format(
+                    os.path.relpath(os.path.realpath(__file__)))
+    parser = argparse.ArgumentParser(
+        prog=prog_text, formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__, epilog="===")
+    parser.add_argument("-c", "--conf", metavar="FILE", default="conf.json",
+                        help="Configuration file (default: conf.json)")
+    parser.add_argument(
+        "--tiles", metavar="N", type=int, nargs="+",
+        help="Tile sizes to try (default: 16 32 64 128, or 128 256 512 "
+        "with GPU)")
+    parser.add_argument(
+        "--threads", metavar="N", type=int, nargs="+",
+        help="Threads to try (default: powers of two and all threads)")
+    parser.add_argument(
+        "-w", "--workers", metavar="N", type=int, nargs="*",
+        default=[2, 4], help="Parallel workers to try (default: 2 4)")
+    parser.add_argument(
+        "--samples", metavar="N", type=int,
+        help="Cycles samples (default: from the render configuration)")
+    parser.add_argument("-r", "--repeat", metavar="N", type=int, default=2,
+                        help="Renders of every setting (default: 2)")
+    parser.add_argument(
+        "-p", "--profiles", metavar="FILE",
+        help="Profiles file (default: {:s})".format(
+            render.profiles.PROFILES))
+    parser.add_argument(
+        "-g", "--gpu", nargs="?", const="", metavar="DEVICE",
+        help="Use GPU device for rendering. If specified without an "
+        "argument, the default will be selected.")
+    parser.add_argument("--child", metavar="N", type=int, nargs=3,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.conf = os.path.abspath(args.conf)
+
+    gpu = False
+    if args.gpu is not None:
+        gpu = True
+        bpy.context.user_preferences.system.compute_device_type = 'CUDA'
+        if len(args.gpu) > 0:
+            bpy.context.user_preferences.system.compute_device = args.gpu
+    if args.tiles is None:
+        args.tiles = [128, 256, 512] if gpu else [16, 32, 64, 128]
+
+    renderer = setup(args.conf)
+    if args.samples is None:
+        args.samples = renderer.opts['cycles_samples']
+    renderer.opts['cycles_samples'] = args.samples
+    renderer.opts['cycles_samples_sun'] = None
+    with tempfile.TemporaryDirectory() as directory:
+        if args.child is not None:
+            child(args, renderer, directory)
+            return
+        profile = profile_host(args, renderer, directory, gpu)
+
+    profiles = render.profiles.Profiles(args.profiles)
+    device = 'GPU' if gpu else 'CPU'
+    profiles.store(renderer.opts['resolution'], device, profile)
+    print("==> Tile {0:d}x{0:d}".format(profile['tile'][0]))
+    if not gpu:
+        print("==> {:d} threads, best with {:d} workers".format(
+            profile['threads'], profile['workers']))
+    print("==Stored {:s} in {:s}==".format(
+        profiles.key(renderer.opts['resolution'], device), profiles.path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Keep track of generated outputs and the inputs that produced them.
+
+Every output of a generation run is recorded in a per-run manifest
+with a digest of its inputs (point, relevant configuration, model
+file). An output is up to date if the recorded digest matches the
+digest of the current inputs, otherwise it is stale and rendered
+again. Outputs are stored in a hierarchical layout of shard
+directories and written under a temporary name before being renamed.
+
+"""
+import sys
+import os
+import glob
+import json
+import hashlib
+import argparse
+
+INDEX = "manifest.json"
+JOURNAL = "manifest.{:s}.jsonl"
+
+
+def digest(*items):
+    """Return a digest of JSON serialisable items."""
+    text = json.dumps(items, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def file_digest(path: str, chunk: int=1 << 20):
+    """Return a digest of the contents of file at path."""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(chunk), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def shard_path(path: str, name: str):
+    """Return path of output name in the shard directory for its prefix.
+
+    Outputs belonging to the same point (name up to the first dot)
+    are placed in the same one of 256 shard directories.
+
+    """
+    prefix = name.split('.')[0]
+    shard = hashlib.sha1(prefix.encode()).hexdigest()[:2]
+    return os.path.join(path, shard, name)
+
+
+def existing(path: str):
+    """Return names of the outputs present in the shard directories of path.
+
+    Each of the 256 shard directories is listed once instead of
+    checking every output.
+
+    """
+    names = set()
+    for shard in range(256):
+        shard = "{:02x}".format(shard)
+        try:
+            entries = os.scandir(os.path.join(path, shard))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if not entry.name.startswith('.'):
+                names.add(os.path.join(shard, entry.name))
+    return names
+
+
+def temp_path(path: str):
+    """Return a hidden temporary path with the same extension as path."""
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, '.' + basename)
+
+
+def commit(temp: str, path: str):
+    """Atomically move the completed temporary file into place."""
+    os.replace(temp, path)
+
+
+def remove_temps(path: str, prefixes):
+    """Remove temporary outputs of points (by prefix) left by crashes."""
+    for prefix in prefixes:
+        for temp in glob.glob(temp_path(shard_path(path, prefix + '.*'))):
+            os.remove(temp)
+
+
+class Manifest():
+    """Index of outputs in a run directory and their input digests.
+
+    The index is kept in a single file. Records are appended to a
+    journal per process (named by `tag`) so that parallel workers can
+    record outputs without locking. Journals are merged into the index
+    by `compact`, which must only be called when no workers are
+    running.
+
+    """
+
+    def __init__(self, path: str, tag: str="main"):
+        """Load the manifest of the run in path."""
+        self.path = path
+        self.journal = os.path.join(path, JOURNAL.format(tag))
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        """Read the index and all journals (later records override).
+
+        A journal removed while reading has been merged into the index
+        by `compact` in another process, so the index is read again.
+
+        """
+        self.entries = {}
+        index = os.path.join(self.path, INDEX)
+        if os.path.isfile(index):
+            with open(index) as file:
+                self.entries = json.load(file)
+        for journal in sorted(glob.glob(
+                os.path.join(self.path, JOURNAL.format('*')))):
+            try:
+                with open(journal) as file:
+                    lines = file.readlines()
+            except FileNotFoundError:
+                return self.load()
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Truncated by a crash, render again
+                self.entries[record['name']] = record['digest']
+        return self.entries
+
+    def current(self, name: str, key: str):
+        """Return True if output name was produced from inputs with key."""
+        return self.entries.get(name) == key
+
+    def record(self, name: str, key: str):
+        """Record that output name is complete for inputs with key."""
+        self.entries[name] = key
+        with open(self.journal, 'a') as file:
+            file.write(json.dumps({'name': name, 'digest': key}) + '\n')
+
+    def compact(self):
+        """Merge all journals into the index and remove them."""
+        journals = glob.glob(os.path.join(self.path, JOURNAL.format('*')))
+        self.load()
+        index = os.path.join(self.path, INDEX)
+        with open(temp_path(index), 'w') as file:
+            json.dump(self.entries, file)
+        commit(temp_path(index), index)
+        for journal in journals:
+            os.remove(journal)
+
+
+def main():
+    """Summarise or compact the manifest of a generation run."""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+    parser.add_argument('path', type=str, help="Run directory")
+    parser.add_argument('-c', '--compact', action='store_true',
+                        help="Merge journals into the index")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.path):
+        sys.exit("{:s}: Run directory does not exist".format(
+            os.path.basename(__file__)))
+    manifest = Manifest(args.path)
+    if args.compact:
+        manifest.compact()
+    counts = {}
+    for name in manifest.entries:
+        kind = '.'.join(os.path.basename(name).split('.')[1:-1])
+        counts[kind] = counts.get(kind, 0) + 1
+    for kind, count in sorted(counts.items()):
+        print("{:s}\t{:d}".format(kind, count))
+
+if __name__ == "__main__":
+    main()
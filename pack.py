@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""Pack the outputs of a generation run into tar shards with an index.
+
+Every sample (the outputs of a point and its pose from the points
+file as NNN.json) is written as consecutive members of one tar shard
+(WebDataset layout, shards of about --shard-size MB). The index gives
+for every sample its shard, the byte range of all its members and the
+offset and size of the data of every member, so that a sample is read
+with one seek (see `Index.read`).
+
+Only samples with all outputs of --kinds recorded in the run manifest
+are packed, and samples whose outputs have not changed since they were
+packed are skipped, so packing can be run again as the run grows.
+With --watch, the run is packed repeatedly (only full shards) until
+interrupted, then the remaining samples are packed. Shards are written
+in parallel and never changed once written: repacked samples are
+written to new shards and the old copies are left unused.
+
+"""
+import sys
+import os
+import io
+import re
+import json
+import time
+import signal
+import tarfile
+import argparse
+import multiprocessing
+import manifest
+
+PACKED = "packed"
+INDEX = "index.json"
+SHARD = "shard-{:05d}"
+# Tar header of a member and the padding of its data
+BLOCK = tarfile.BLOCKSIZE
+
+
+def sample_kinds(name: str):
+    """Return (sequence, kind) of an output name, e.g. ("001", "vis.png")."""
+    seq, _, kind = os.path.basename(name).partition('.')
+    return seq, kind
+
+
+def padded(size: int):
+    """Return size rounded up to whole tar blocks."""
+    return -(-size // BLOCK) * BLOCK
+
+
+def write_shard(args):
+    """Write samples to a tar shard and its index, return the index.
+
+    Samples are (seq, digest, members) with members (name, path or
+    bytes). Offsets are relative to the start of the shard for samples
+    and to the start of the sample for members.
+
+    """
+    out, shard, samples = args
+    index = {}
+    path = os.path.join(out, shard + '.tar')
+    temp = manifest.temp_path(path)
+    with tarfile.open(temp, 'w', format=tarfile.GNU_FORMAT) as tar:
+        for seq, digest, members in samples:
+            start = tar.offset
+            entry = {'offset': start, 'digest': digest, 'members': {}}
+            for name, data in members:
+                if isinstance(data, bytes):
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    info.mtime = time.time()
+                    tar.addfile(info, io.BytesIO(data))
+                else:
+                    info = tar.gettarinfo(data, name)
+                    with open(data, 'rb') as file:
+                        tar.addfile(info, file)
+                # The data ends at the (padded) end of the archive
+                entry['members'][name] = [
+                    tar.offset - padded(info.size) - start, info.size]
+            entry['size'] = tar.offset - start
+            index[seq] = entry
+    manifest.commit(temp, path)
+    path = os.path.join(out, shard + '.json')
+    with open(manifest.temp_path(path), 'w') as file:
+        json.dump(index, file)
+    manifest.commit(manifest.temp_path(path), path)
+    return index
+
+
+class Index():
+    """Index of the samples packed into the shards of a directory.
+
+    Shard indexes are merged in shard order, so that the latest copy
+    of a sample is used. The merged index is also written to a single
+    file for readers that do not load the package.
+
+    """
+
+    def __init__(self, out: str):
+        """Load the index of shards in out."""
+        self.out = out
+        self.samples = {}
+        self.shards = []
+        self.load()
+
+    def load(self):
+        """Read the indexes of all shards (later shards override)."""
+        self.samples = {}
+        self.shards = sorted(
+            filename[:-len('.json')] for filename in os.listdir(self.out)
+            if re.match(r'^shard-\d+\.json$', filename))
+        for shard in self.shards:
+            with open(os.path.join(self.out, shard + '.json')) as file:
+                for seq, entry in json.load(file).items():
+                    entry['shard'] = shard
+                    self.samples[seq] = entry
+        return self.samples
+
+    def next_shard(self):
+        """Return the number of the next shard to write."""
+        if len(self.shards) == 0:
+            return 0
+        return int(self.shards[-1].split('-')[1]) + 1
+
+    def add(self, shard: str, index: dict):
+        """Add the index of a newly written shard."""
+        self.shards.append(shard)
+        for seq, entry in index.items():
+            entry['shard'] = shard
+            self.samples[seq] = entry
+
+    def save(self):
+        """Write the merged index of all samples."""
+        path = os.path.join(self.out, INDEX)
+        with open(manifest.temp_path(path), 'w') as file:
+            json.dump(self.samples, file, sort_keys=True)
+        manifest.commit(manifest.temp_path(path), path)
+
+    def read(self, seq: str):
+        """Return the members of a packed sample as {name: bytes}."""
+        entry = self.samples[seq]
+        with open(os.path.join(self.out, entry['shard'] + '.tar'),
+                  'rb') as file:
+            file.seek(entry['offset'])
+            data = file.read(entry['size'])
+        return {name: data[offset:offset + size]
+                for name, (offset, size) in entry['members'].items()}
+
+
+class Packer():
+    """Pack complete samples of a run that are new or have changed."""
+
+    def __init__(self, path: str, out: str=None, points: str="out.json",
+                 kinds: list=None, shard_size: float=1024.):
+        """Pack run in path into out (default: `packed` in path).
+
+        Samples are complete once all outputs of kinds are recorded
+        (default: all kinds found in the manifest).
+
+        """
+        self.path = path
+        self.out = os.path.join(path, PACKED) if out is None else out
+        os.makedirs(self.out, exist_ok=True)
+        self.points = os.path.join(path, points)
+        self.kinds = kinds
+        self.shard_size = int(shard_size * (1 << 20))
+        self.index = Index(self.out)
+
+    def pending(self):
+        """Return (seq, digest, members) of samples to pack, in order."""
+        entries = manifest.Manifest(self.path).load()
+        outputs = {}
+        for name in entries:
+            seq, kind = sample_kinds(name)
+            outputs.setdefault(seq, {})[kind] = name
+        kinds = self.kinds
+        if kinds is None:
+            kinds = sorted(set(kind for names in outputs.values()
+                               for kind in names))
+        points = {}
+        if os.path.isfile(self.points) and os.path.getsize(self.points):
+            with open(self.points) as file:
+                points = json.load(file)
+        samples = []
+        for seq, names in sorted(outputs.items()):
+            if any(kind not in names for kind in kinds):
+                continue
+            names = [names[kind] for kind in kinds]
+            digest = manifest.digest(*[entries[name] for name in names])
+            packed = self.index.samples.get(seq)
+            if packed is not None and packed['digest'] == digest:
+                continue
+            paths = [os.path.join(self.path, name) for name in names]
+            if not all(os.path.isfile(path) for path in paths):
+                continue
+            members = [(os.path.basename(path), path) for path in paths]
+            if seq in points:
+                members.append(("{:s}.json".format(seq), json.dumps(
+                    points[seq], sort_keys=True).encode()))
+            samples.append((seq, digest, members))
+        return samples
+
+    def size(self, members: list):
+        """Return the size of members in a tar shard."""
+        return sum(BLOCK + padded(len(data) if isinstance(data, bytes)
+                                  else os.path.getsize(data))
+                   for _, data in members)
+
+    def groups(self, samples: list, full: bool=False):
+        """Split samples into shards of about shard size.
+
+        If full, the last shard is left out unless it is full.
+
+        """
+        groups, group, size = [], [], 0
+        for sample in samples:
+            group.append(sample)
+            size += self.size(sample[2])
+            if size >= self.shard_size:
+                groups.append(group)
+                group, size = [], 0
+        if len(group) > 0 and not full:
+            groups.append(group)
+        return groups
+
+    def pack(self, pool=None, full: bool=False):
+        """Pack pending samples into new shards, return number packed."""
+        groups = self.groups(self.pending(), full)
+        if len(groups) == 0:
+            return 0
+        first = self.index.next_shard()
+        jobs = [(self.out, SHARD.format(first + number), group)
+                for number, group in enumerate(groups)]
+        if pool is None:
+            indexes = [write_shard(job) for job in jobs]
+        else:
+            indexes = pool.map(write_shard, jobs)
+        for (_, shard, _), index in zip(jobs, indexes):
+            self.index.add(shard, index)
+        self.index.save()
+        return sum(len(group) for group in groups)
+
+
+def watch(packer: Packer, pool, interval: float=10.):
+    """Pack full shards until interrupted, then pack the rest."""
+    stop = []
+
+    def handler(signum, frame):  # pylint: disable=unused-argument
+        """Stop after the current pass."""
+        stop.append(signum)
+
+    signal.signal(signal.SIGINT, handler)
+    signal.signal(signal.SIGTERM, handler)
+    packed = 0
+    while len(stop) == 0:
+        packed += packer.pack(pool, full=True)
+        # Sleep in short steps to stop soon after a signal
+        end = time.time() + interval
+        while len(stop) == 0 and time.time() < end:
+            time.sleep(min(0.5, interval))
+    return packed + packer.pack(pool)
+
+
+def main():
+    """Pack a run directory."""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+    parser.add_argument('path', type=str, help="Run directory")
+    parser.add_argument(
+        '-o', '--out', metavar='DIR',
+        help="Output directory (default: {:s} in the run directory)".format(
+            PACKED))
+    parser.add_argument(
+        '-k', '--kinds', metavar='KIND', nargs='+',
+        help="Outputs of a complete sample, e.g. vis.png sem.2.png dep.exr "
+        "(default: all kinds in the manifest)")
+    parser.add_argument(
+        '--points', metavar='FILE', default="out.json",
+        help="Points file in the run directory (default: out.json)")
+    parser.add_argument(
+        '-s', '--shard-size', metavar='MB', type=float, default=1024.,
+        help="Size of shards in MB (default: 1024)")
+    parser.add_argument(
+        '-p', '--processes', metavar='N', type=int,
+        help="Number of processes (default: number of CPUs)")
+    parser.add_argument(
+        '-w', '--watch', action='store_true',
+        help="Pack full shards as samples are completed until interrupted "
+        "(needs --kinds)")
+    parser.add_argument(
+        '--interval', metavar='SECONDS', type=float, default=10.,
+        help="Time between passes with --watch (default: 10)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.path):
+        sys.exit("{:s}: Run directory does not exist".format(
+            os.path.basename(__file__)))
+    if args.watch and args.kinds is None:
+        sys.exit("{:s}: --watch needs --kinds".format(
+            os.path.basename(__file__)))
+    packer = Packer(args.path, args.out, args.points, args.kinds,
+                    args.shard_size)
+    # Workers ignore interrupts, the main process stops them when done
+    handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    pool = multiprocessing.Pool(args.processes)
+    signal.signal(signal.SIGINT, handler)
+    try:
+        if args.watch:
+            packed = watch(packer, pool, args.interval)
+        else:
+            packed = packer.pack(pool)
+    finally:
+        pool.close()
+        pool.join()
+    print("{:s}: Packed {:d} sample(s), {:d} in {:d} shard(s)".format(
+        os.path.basename(__file__), packed, len(packer.index.samples),
+        len(packer.index.shards)))
+
+if __name__ == "__main__":
+    main()
@@ -5,5 +5,14 @@ from . import textures
 from . import render
 from . import helpers
 from . import modify
+from . import cache
+from . import materials
+from . import metrics
+from . import profiles
+from . import raster
+from . import depth
+from . import coverage
 
-__all__ = ("labels", "render", "textures", "helpers", "modify")
+__all__ = ("labels", "render", "textures", "helpers", "modify", "cache",
+           "materials", "metrics", "profiles", "raster", "depth",
+           "coverage")
@@ -0,0 +1,81 @@
+"""Provides a cache of geometry derived from the model on disk."""
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+import bpy  # pylint: disable=import-error
+from . import helpers
+
+
+class GeometryCache():
+    """Arrays computed from objects, cached in a directory by the model.
+
+    Every array is stored as a NumPy file named by a digest of the
+    mesh data (bounding box for other objects), world matrices and
+    names of the objects it was computed from, so that changing the
+    model invalidates it automatically. Arrays computed with different
+    parameters are kept as separate entries (see entry). Arrays are
+    loaded memory-mapped so that parallel workers share a single copy.
+
+    Caching is disabled if the model has not been saved and no path
+    is given.
+
+    """
+
+    def __init__(self, path: str=None):
+        """Create cache in path, default is model path with .geometry."""
+        if path is None and bpy.data.filepath:
+            path = os.path.splitext(bpy.data.filepath)[0] + '.geometry'
+        self.path = path
+
+    @staticmethod
+    def key(objects: list, *params):
+        """Return a digest of the geometry of objects and parameters."""
+        sha = hashlib.sha1()
+        for obj in objects:
+            sha.update(obj.name.encode())
+            if obj.type == 'MESH':
+                sha.update(helpers.vertices(obj, world=False).tobytes())
+            else:
+                sha.update(np.array(obj.bound_box).tobytes())
+            sha.update(np.array(obj.matrix_world).tobytes())
+        sha.update(json.dumps(params).encode())
+        return sha.hexdigest()
+
+    @staticmethod
+    def entry(name: str, *params):
+        """Return the entry name of array name for parameters."""
+        if not params:
+            return name
+        return "{:s}-{:s}".format(name, hashlib.sha1(
+            json.dumps(params).encode()).hexdigest()[:8])
+
+    def get(self, name: str, key: str, compute):
+        """Return the array name for key, calling compute() if missing.
+
+        Arrays of the same name stored for other keys are stale and
+        are removed when a new one is stored. Another worker may be
+        doing the same, so missing files are ignored.
+
+        """
+        if self.path is None:
+            return compute()
+        filename = os.path.join(self.path, "{:s}.{:s}.npy".format(name, key))
+        if os.path.isfile(filename):
+            return np.load(filename, mmap_mode='r')
+        array = compute()
+        os.makedirs(self.path, exist_ok=True)
+        for stale in glob.glob(os.path.join(self.path, name + '.*.npy')):
+            if stale == filename:
+                continue
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+        # Write under a unique name first as workers may race here
+        temp = os.path.join(self.path, ".{:s}.{:d}.npy".format(
+            name, os.getpid()))
+        np.save(temp, array)
+        os.replace(temp, filename)
+        return np.load(filename, mmap_mode='r')
@@ -0,0 +1,128 @@
+"""Provides estimates of the screen coverage of objects before rendering."""
+import itertools
+import numpy as np
+from . import helpers
+
+# Number of cells along each axis of the image sampled for coverage
+GRID = 32
+# Pairs of box corners: edges and diagonals, all inside the box
+PAIRS = np.array(list(itertools.combinations(range(8), 2)))
+
+
+def euler_matrices(rotations):
+    """Return rotation matrices (N, 3, 3) of XYZ Euler angles (N, 3)."""
+    rotations = np.asarray(rotations, dtype=float)
+    cos, sin = np.cos(rotations), np.sin(rotations)
+    one, zero = np.ones(len(rotations)), np.zeros(len(rotations))
+    rot_x = np.stack([one, zero, zero,
+                      zero, cos[:, 0], -sin[:, 0],
+                      zero, sin[:, 0], cos[:, 0]], axis=1).reshape(-1, 3, 3)
+    rot_y = np.stack([cos[:, 1], zero, sin[:, 1],
+                      zero, one, zero,
+                      -sin[:, 1], zero, cos[:, 1]], axis=1).reshape(-1, 3, 3)
+    rot_z = np.stack([cos[:, 2], -sin[:, 2], zero,
+                      sin[:, 2], cos[:, 2], zero,
+                      zero, zero, one], axis=1).reshape(-1, 3, 3)
+    return np.matmul(rot_z, np.matmul(rot_y, rot_x))
+
+
+class Coverage():
+    """Fraction of the image covered by objects seen from camera poses.
+
+    Bounding boxes of the objects are projected through the camera and
+    the image is sampled on a grid of GRID x GRID cell centres: a
+    cell is covered if it lies within the screen rectangle of any box.
+    This ignores occlusion and overestimates thin or diagonal objects,
+    but needs no render and tests a batch of poses at once.
+
+    """
+
+    def __init__(self, objects: list, camera, resolution, near: float=0.1):
+        """Create estimator for objects seen through camera data.
+
+        Only the sensor and the near clipping distance of camera are
+        used, the lens and pose are given by the candidates.
+
+        """
+        self.corners = np.array([
+            helpers.transform(np.array(obj.bound_box), obj.matrix_world)
+            for obj in objects if obj.type == 'MESH']).reshape(-1, 8, 3)
+        self.resolution = np.asarray(resolution, dtype=float)
+        self.fit = getattr(camera, 'sensor_fit', 'AUTO')
+        self.sensor = (camera.sensor_width, camera.sensor_height)
+        self.near = getattr(camera, 'clip_start', near)
+        self.cells = [(np.arange(GRID) + 0.5) * size / GRID
+                      for size in self.resolution]
+
+    def scale(self, lens: float):
+        """Return pixels per unit image plane at unit depth for lens."""
+        width, height = self.resolution
+        if self.fit == 'VERTICAL':
+            return height * lens / self.sensor[1]
+        if self.fit == 'HORIZONTAL':
+            return width * lens / self.sensor[0]
+        return max(width, height) * lens / self.sensor[0]
+
+    def rectangles(self, locations, rotations, lens: float):
+        """Return screen rectangles (N, M, 2, 2) of boxes from poses.
+
+        Rectangles are (min, max) of pixel (x, y), empty if the box is
+        entirely behind the near plane. Boxes crossing the near plane
+        are clipped to it.
+
+        """
+        # Camera space is (point - location) . R (camera looks down -z)
+        count, boxes = len(locations), len(self.corners)
+        points = np.matmul(
+            (self.corners[np.newaxis] - np.asarray(locations)[
+                :, np.newaxis, np.newaxis]).reshape(count, -1, 3),
+            euler_matrices(rotations)).reshape(count, boxes, 8, 3)
+        front = -points[..., 2] >= self.near
+        rectangles = np.empty((count, boxes, 2, 2))
+        rectangles[:, :, 0], rectangles[:, :, 1] = np.inf, -np.inf
+        whole = np.all(front, axis=2)
+        screen = self.project(points[whole], lens)
+        rectangles[whole] = np.stack([np.min(screen, axis=1),
+                                      np.max(screen, axis=1)], axis=1)
+        # Boxes crossing the near plane are clipped where the segments
+        # between their corners cross it
+        crossing = np.any(front, axis=2) & ~whole
+        if np.any(crossing):
+            points, front = points[crossing], front[crossing]
+            depth = -points[..., 2]
+            start, end = PAIRS[:, 0], PAIRS[:, 1]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction = ((self.near - depth[:, start]) /
+                            (depth[:, end] - depth[:, start]))
+                crossed = points[:, start] + fraction[..., np.newaxis] * (
+                    points[:, end] - points[:, start])
+            crossed[..., 2] = -self.near
+            points = np.concatenate([points, crossed], axis=1)
+            valid = np.concatenate(
+                [front, (fraction > 0) & (fraction < 1)], axis=1)
+            # Points behind are replaced by the first in front of the box
+            first = points[np.arange(len(points)), np.argmax(front, axis=1)]
+            points = np.where(valid[..., np.newaxis], points,
+                              first[:, np.newaxis])
+            screen = self.project(points, lens)
+            rectangles[crossing] = np.stack([np.min(screen, axis=1),
+                                             np.max(screen, axis=1)], axis=1)
+        return rectangles
+
+    def project(self, points, lens: float):
+        """Return pixel (x, y) of camera space points in front."""
+        return (self.scale(lens) * points[..., :2] /
+                -points[..., 2:] + self.resolution / 2)
+
+    def estimate(self, locations, rotations, lens: float):
+        """Return the covered fraction of the image for camera poses."""
+        if len(self.corners) == 0:
+            return np.zeros(len(locations))
+        rectangles = self.rectangles(locations, rotations, lens)
+        inside = [((rectangles[:, :, 0, axis, np.newaxis] <= cells) &
+                   (cells <= rectangles[:, :, 1, axis, np.newaxis]))
+                  .astype(np.float32)
+                  for axis, cells in enumerate(self.cells)]
+        # Cell (y, x) is covered if a box covers both its x and its y
+        covered = np.matmul(np.transpose(inside[1], (0, 2, 1)), inside[0])
+        return np.mean(covered > 0, axis=(1, 2))
@@ -0,0 +1,89 @@
+"""Provides depth maps from the rasterized scene geometry."""
+import numpy as np
+import bpy  # pylint: disable=import-error
+from . import raster
+
+# Depth of pixels whose ray hits nothing (as in the Cycles Z pass)
+MISS = 1e10
+# Scene output settings changed to write OpenEXR (restored in order)
+IMAGE_SETTINGS = ('file_format', 'color_mode', 'color_depth', 'exr_codec')
+
+
+def rays(scale: float, centre, width: int, rows):
+    """Return camera space directions through pixel centres of rows.
+
+    Directions have unit depth (z = -1), see raster.projection for
+    scale and centre.
+
+    """
+    x = (np.arange(width) + raster.PIXEL_CENTRE - centre[0]) / scale
+    y = (np.asarray(rows) + raster.PIXEL_CENTRE - centre[1]) / scale
+    x, y = np.meshgrid(x, y)
+    return np.stack([x.ravel(), y.ravel(), -np.ones(x.size)], axis=1)
+
+
+def render(rasterizer, scene=None):
+    """Return the depth image (top row first) of the scene camera.
+
+    The depth buffer of rasterizer (see raster.Rasterizer) holds the
+    exact inverse depth at every pixel centre, which is scaled to the
+    distance from the camera along the ray through it. As for Cycles,
+    geometry is clipped at the near and far planes.
+
+    """
+    if scene is None:
+        scene = bpy.data.scenes[0]
+    buffer = rasterizer.draw(scene)
+    (width, height), scale, centre = raster.projection(scene)
+    lengths = np.linalg.norm(rays(scale, centre, width, range(height)),
+                             axis=1)
+    hit = buffer.depth > 0
+    depth = np.full(width * height, MISS, dtype=np.float32)
+    depth[hit] = lengths[hit] / buffer.depth[hit]
+    return depth.reshape(height, width)[::-1]
+
+
+def write(depth, path: str, half: bool=False, codec: str='ZIP'):
+    """Write depth (top row first) to path, format by extension.
+
+    Depth is written as RGB OpenEXR (.exr) compressed with codec, or
+    as a NumPy array (.npy) or compressed archive (.npz, array
+    "depth"), in half floats if half.
+
+    """
+    if path.endswith('.npy') or path.endswith('.npz'):
+        depth = np.asarray(depth, dtype=np.float16 if half else np.float32)
+        with open(path, 'wb') as file:
+            if path.endswith('.npy'):
+                np.save(file, depth)
+            else:
+                np.savez_compressed(file, depth=depth)
+        return
+    height, width = depth.shape
+    image = bpy.data.images.new("depth", width, height, float_buffer=True)
+    pixels = np.ones((height, width, 4), dtype=np.float32)
+    pixels[..., :3] = depth[::-1, :, np.newaxis]
+    image.pixels[:] = pixels.ravel().tolist()
+    # The image is saved with the scene output settings, set for now
+    settings = bpy.data.scenes[0].render.image_settings
+    saved = [(attr, getattr(settings, attr)) for attr in IMAGE_SETTINGS]
+    settings.file_format = 'OPEN_EXR'
+    settings.color_mode = 'RGB'
+    settings.color_depth = '16' if half else '32'
+    settings.exr_codec = codec
+    try:
+        image.save_render(path)
+    finally:
+        for attr, value in saved:
+            setattr(settings, attr, value)
+        bpy.data.images.remove(image)
+
+
+def read(path: str):
+    """Return the first channel of an image (top row first)."""
+    image = bpy.data.images.load(path)
+    width, height = image.size
+    pixels = np.array(image.pixels[:], dtype=np.float32).reshape(
+        height, width, image.channels)
+    bpy.data.images.remove(image)
+    return pixels[::-1, :, 0]
@@ -1,8 +1,9 @@
 """Objects used by multiple modules."""
 import json
 import numpy as np
+import scipy.interpolate
+import scipy.spatial
 import bpy  # pylint: disable=import-error
-import mathutils  # pylint: disable=import-error
 
 
 class Dict(dict):
@@ -21,31 +22,222 @@ def all_instances(part: str, objects):
         return [obj for obj in objects if part in obj.name.split('.')]
 
 
-def landscape_tree(landscape):
+class Registry():
+    """Objects indexed by the dot-separated components of their names.
+
+    Finding all instances of a part (see `all_instances`) is a lookup
+    instead of a scan of all object names. Objects created later, such
+    as grown trees, must be added to keep the index valid.
+
+    """
+
+    def __init__(self, objects=()):
+        """Create registry of objects."""
+        self.objects = []
+        self.index = Dict()
+        self.add(objects)
+
+    def add(self, objects):
+        """Add objects to the registry."""
+        for obj in objects:
+            self.objects.append(obj)
+            for part in set(obj.name.split('.')):
+                self.index.setdefault(part, []).append(obj)
+
+    def find(self, part: str):
+        """Return all objects with a given name or all if part is None."""
+        if part is None:
+            return self.objects[:]
+        return self.index[part][:]
+
+    def __iter__(self):
+        """Iterate over all objects in the order they were added."""
+        return iter(self.objects)
+
+    def __len__(self):
+        """Return the number of objects."""
+        return len(self.objects)
+
+
+def linked_copies(obj, number: int, scene=None):
+    """Return number new objects sharing the data of obj in scene.
+
+    Objects are created through the data API rather than duplicate
+    operators, which update the scene and push undo for every call.
+    Copies share the mesh of obj, so memory and Cycles BVH build time
+    grow with the number of unique meshes (they are instanced).
+
+    """
+    if scene is None:
+        scene = bpy.context.scene
+    copies = [obj.copy() for _ in range(number)]
+    for copy in copies:
+        scene.objects.link(copy)
+    return copies
+
+
+def vertices(obj, world: bool=True):
+    """Return vertex coordinates of a mesh object, in world space default."""
+    coords = np.empty(3 * len(obj.data.vertices), dtype=np.float32)
+    obj.data.vertices.foreach_get('co', coords)
+    coords = coords.reshape(-1, 3).astype(float)
+    if world:
+        return transform(coords, obj.matrix_world)
+    return coords
+
+
+def transform(points, matrix):
+    """Apply a 4x4 transformation matrix to an array of points."""
+    matrix = np.array(matrix)
+    return np.dot(points, matrix[:3, :3].T) + matrix[:3, 3]
+
+
+class KDTree():
+    """Balanced tree of points for (batched) nearest neighbour queries.
+
+    Provides `find` and `find_range` like mathutils.kdtree.KDTree
+    (returning coordinates as arrays) on top of scipy's cKDTree, and
+    `query` for arrays of points.
+
+    """
+
+    def __init__(self, points):
+        """Create the tree of an array of points."""
+        self.points = np.asarray(points, dtype=float)
+        self.tree = scipy.spatial.cKDTree(self.points)
+
+    def find(self, co):
+        """Return (co, index, dist) of the point closest to co."""
+        dist, index = self.tree.query(np.asarray(co, dtype=float)[:3])
+        return self.points[index], index, dist
+
+    def find_range(self, co, radius: float):
+        """Return (co, index, dist) of all points within radius of co."""
+        co = np.asarray(co, dtype=float)[:3]
+        indices = self.tree.query_ball_point(co, radius)
+        return [(self.points[index], index,
+                 np.linalg.norm(self.points[index] - co))
+                for index in indices]
+
+    def query(self, points):
+        """Return closest points, indices and distances for points."""
+        dist, index = self.tree.query(np.asarray(points, dtype=float))
+        return self.points[index], index, dist
+
+
+def cached(cache, name: str, objects: list, compute, *params):
+    """Return compute() through a GeometryCache (if not None).
+
+    The result is keyed by the geometry of objects and stored in a
+    separate entry for each set of parameters.
+
+    """
+    if cache is None:
+        return compute()
+    return cache.get(cache.entry(name, *params), cache.key(objects),
+                     compute)
+
+
+def landscape_tree(landscape, cache=None):
     """Return a balanced tree of landscape vertices for find operations."""
-    tree = mathutils.kdtree.KDTree(len(landscape.data.vertices))
-    for i, vertex in enumerate(landscape.data.vertices):
-        tree.insert(landscape.matrix_world * vertex.co, i)
-    tree.balance()
-    return tree
+    return KDTree(cached(cache, 'landscape', [landscape],
+                         lambda: vertices(landscape)))
 
 
-def avoid_tree(objects):
+def avoid_tree(objects, cache=None):
     """Return a balanced tree of vertices for find operations."""
-    vertices = [(obj, vert) for obj in objects for vert in obj.data.vertices]
-    tree = mathutils.kdtree.KDTree(len(vertices))
-    for i, vertex in enumerate(vertices):
-        tree.insert(vertex[0].matrix_world * vertex[1].co, i)
-    tree.balance()
-    return tree
+    return KDTree(cached(cache, 'avoid', objects, lambda: np.concatenate(
+        [vertices(obj) for obj in objects])))
+
+
+class Heightfield():
+    """Ground height on a regular grid over the landscape.
+
+    The heights are interpolated from the landscape mesh vertices onto
+    a grid with spacing `step` once. Queries are answered by bilinear
+    interpolation of the grid for any number of (x, y) points at
+    once.
+
+    """
+
+    def __init__(self, landscape, step: float=1., cache=None):
+        """Create the height grid of landscape (using cache if given)."""
+        points = vertices(landscape)
+        self.step = step
+        self.origin = np.min(points[:, :2], axis=0)
+        ground = cached(cache, 'ground', [landscape],
+                        lambda: self._interpolate(points), step)
+        self.heights, self.outside = ground[0], ground[1] > 0
+
+    def _interpolate(self, points):
+        """Return heights on the grid and where they are extrapolated.
+
+        The second layer of the array is 1 outside the convex hull of
+        points and 0 inside.
+
+        """
+        shape = np.ceil((np.max(points[:, :2], axis=0) - self.origin)
+                        / self.step).astype(int) + 1
+        grid = np.meshgrid(*[self.origin[axis] + self.step*np.arange(
+            max(2, shape[axis])) for axis in range(2)], indexing='ij')
+        heights = scipy.interpolate.griddata(
+            points[:, :2], points[:, 2], tuple(grid), method='linear')
+        # Outside the convex hull of the vertices use the closest vertex
+        outside = np.isnan(heights)
+        if np.any(outside):
+            heights[outside] = scipy.interpolate.griddata(
+                points[:, :2], points[:, 2],
+                tuple(axis[outside] for axis in grid), method='nearest')
+        return np.stack([heights, outside])
+
+    def _cells(self, points):
+        """Return grid cell indices (i, j) and fractions (x, y) of points."""
+        coords = (points[..., :2] - self.origin)/self.step
+        coords = np.clip(coords, 0, np.array(self.heights.shape) - 1)
+        index = np.minimum(coords.astype(int),
+                           np.array(self.heights.shape) - 2)
+        frac = coords - index
+        return index[..., 0], index[..., 1], frac[..., 0], frac[..., 1]
+
+    def height(self, points, floor: float=None):
+        """Return the ground height at (x, y) of points (extra axes ok).
+
+        Heights are at least `floor` if given (e.g. water level).
+
+        """
+        i, j, x, y = self._cells(np.asarray(points, dtype=float))
+        height = ((self.heights[i, j]*(1 - x) + self.heights[i + 1, j]*x)
+                  * (1 - y) +
+                  (self.heights[i, j + 1]*(1 - x)
+                   + self.heights[i + 1, j + 1]*x) * y)
+        if floor is not None:
+            height = np.maximum(height, floor)
+        return height
+
+    def on_landscape(self, points):
+        """Return mask of (x, y) of points over the landscape (extra axes ok).
+
+        Points off the grid or in a cell with a corner outside the
+        convex hull of the landscape vertices are not on it.
+
+        """
+        points = np.asarray(points, dtype=float)
+        coords = (points[..., :2] - self.origin)/self.step
+        on_grid = np.all((coords >= 0) &
+                         (coords <= np.array(self.heights.shape) - 1),
+                         axis=-1)
+        i, j, _, _ = self._cells(points)
+        return on_grid & ~(self.outside[i, j] | self.outside[i + 1, j] |
+                           self.outside[i, j + 1] |
+                           self.outside[i + 1, j + 1])
 
 
 def bounding_box(obj):
     """Return a bounding box for an object aligned with the global axes."""
-    vertices = [obj.matrix_world * vertex.co for vertex in obj.data.vertices]
+    points = vertices(obj)
     box = np.zeros((2, 3))
-    box[0] = np.min(vertices, axis=0)
-    box[1] = np.max(vertices, axis=0)
+    box[0] = np.min(points, axis=0)
+    box[1] = np.max(points, axis=0)
     return box
 
 
@@ -93,20 +285,17 @@ class BoundingSphere():
     def find(self, objects: list, centre=None):
         """Return a bounding sphere for objects with optional centre."""
         # TODO: Spheres are too large and bounding box is not always correct.
-        def minmax(index, axis):
-            """Choose min or max depending on axis at box corner index."""
-            is_max = (index >> axis) % 2  # Control bit in index for axis
-            if axis == 0:
-                # Cyclic index: 0 -> 00, 1 -> 01, 2 -> 11, 3 -> 10
-                is_max ^= (index >> 1) % 2
-            return max if is_max else min
+        # Control bit in corner index for each axis chooses min or max,
+        # cyclic on axis 0: 0 -> 00, 1 -> 01, 2 -> 11, 3 -> 10
+        index = np.arange(8)[:, np.newaxis]
+        is_max = (index >> np.arange(3)) % 2
+        is_max[:, 0] ^= (index[:, 0] >> 1) % 2
 
         # For corner i of box, for axis j, choose min/max of objects along axis
-        box = np.array([
-            [minmax(i, j)(
-                [(x.matrix_world * mathutils.Vector(x.bound_box[i]))[j]
-                 for x in objects]
-            ) for j in range(3)] for i in range(8)])
+        corners = np.array([transform(np.array(obj.bound_box),
+                                      obj.matrix_world) for obj in objects])
+        box = np.where(is_max, np.max(corners, axis=0),
+                       np.min(corners, axis=0))
         self.centre = np.sum(box, axis=0)/8 if centre is None else centre
         self.radius = np.max(np.linalg.norm(box - self.centre, axis=1))
         return {"centre": self.centre, "radius": self.radius}
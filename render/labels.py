@@ -3,14 +3,25 @@ import json
 import randomcolor
 import bpy  # pylint: disable=import-error
 from . import helpers
+from .materials import DEFAULT
 
 
 class Labels():
     """Identify parts by name and assign semantic labels as colors."""
 
-    def __init__(self, objects: list):
-        """Create Labels for given list of Blender objects."""
-        self.objects = objects[:]
+    def __init__(self, objects, materials=None):
+        """Create Labels for given list or registry of Blender objects.
+
+        A registry (see helpers.Registry) can be shared with others so
+        that objects added later are labelled as well. Materials are
+        assigned through `materials` (see materials.Materials),
+        default is the engine shared with Textures.
+
+        """
+        if not isinstance(objects, helpers.Registry):
+            objects = helpers.Registry(objects)
+        self.objects = objects
+        self.materials = DEFAULT if materials is None else materials
         self.levels = []
         self.levels += [dict()]  # 0: feature -> color
         self.levels += [dict()]  # 1: structure -> color
@@ -94,65 +105,90 @@ class Labels():
         # Switch off color management
         bpy.context.scene.display_settings.display_device = 'None'
         bpy.context.scene.sequencer_colorspace_settings.name = 'Raw'
+        # Resolve the final color of every object before assigning, so
+        # objects are not recolored black first
+        colors = {}
+        self._apply_level(level, lambda part, color: colors.update(
+            (obj.name, (obj, color)) for obj in self.objects.find(part)))
+        for obj, color in colors.values():
+            self.materials.assign(obj, color_material(color, self.materials))
 
+    def index_level(self, level: int):
+        """Set object pass indices to label indices according to level.
+
+        The index of a label is its position in the palette of the
+        level (see `palette`), so that unlabelled objects and the
+        background are 0 in the object index pass.
+
+        """
+        palette = self.palette(level)
+        self._apply_level(level, lambda part, color: self._index_parts(
+            part, palette.index(color.lower())))
+
+    def palette(self, level: int):
+        """Return the colors of level: black first, then sorted."""
+        colors = set(color.lower() for color in self.levels[level].values())
+        return ['#000000'] + sorted(colors - {'#000000'})
+
+    def _apply_level(self, level: int, apply):
+        """Call apply(part, color) for all labelled parts on level."""
         # Start with all objects black
-        self._color_parts(None, '#000000')
+        apply(None, '#000000')
         # Level 2: parts
         if level == 2:
             for part, color in self.levels[2].items():
-                self._color_parts(part, color)
+                apply(part, color)
         # Level 1: structures
         elif level == 1:
             for structure, color in self.levels[1].items():
                 # If in self.parts, object names start with labels on level 2
                 if structure in self.parts:
                     for part in self.parts[structure]:
-                        self._color_parts(part, color)
+                        apply(part, color)
                 # Non-bridge structures/features are directly named
                 else:
-                    self._color_parts(structure, color)
+                    apply(structure, color)
         # Level 0: features
         elif level == 0:
             for feature, color in self.levels[0].items():
                 # Non-bridge features/structures are directly named
                 if feature != 'bridge':
-                    self._color_parts(feature, color)
+                    apply(feature, color)
                 # Bridge object names start with labels on level 2
                 else:
                     for part in [part for structure in self.parts
                                  for part in self.parts[structure]]:
-                        self._color_parts(part, self.levels[0]['bridge'])
+                        apply(part, self.levels[0]['bridge'])
 
-    def _color_parts(self, part: str, color: str):
-        """Color all instances of a part, or all objects if part is ''."""
-        instances = helpers.all_instances(part, self.objects)
-        for obj in instances:
-            color_object(obj, color)
+    def _index_parts(self, part: str, index: int):
+        """Set pass index of all instances of a part, or all objects."""
+        for obj in self.objects.find(part):
+            obj.pass_index = index
 
 
-def color_object(obj, color: str):
+def color_object(obj, color: str, materials=None):
     """Color an object with color.
 
     Find or create a material with the specified color and make this
-    the active material of the object
+    the only material of the object (unless it already is)
 
     """
-    material_name = "shadeless.{:s}".format(color)
-
-    # Create a shadeless diffuse material with the right color if it
-    # does not exist
-    if material_name in [material.name for material in bpy.data.materials]:
-        material = bpy.data.materials[material_name]
-    else:
-        material = bpy.data.materials.new(material_name)
+    if materials is None:
+        materials = DEFAULT
+    materials.assign(obj, color_material(color, materials))
+
+
+def color_material(color: str, materials=None):
+    """Return the shadeless material with color, creating it if needed."""
+    def create(name: str):
+        """Create a shadeless diffuse material with the right color."""
+        material = bpy.data.materials.new(name)
         material.use_shadeless = True
         material.diffuse_color = hex_to_rgb(color)
-
-    # Assign the material to object
-    for _ in range(len(obj.material_slots)):
-        bpy.ops.object.material_slot_remove({'object': obj})
-    obj.data.materials.clear()
-    obj.active_material = material
+        return material
+    if materials is None:
+        materials = DEFAULT
+    return materials.get("shadeless.{:s}".format(color), create)
 
 
 def hex_to_rgb(color: str):
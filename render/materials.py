@@ -0,0 +1,55 @@
+"""Assign materials to objects, only changing what actually changes."""
+import bpy  # pylint: disable=import-error
+
+
+class Materials():
+    """Materials currently assigned to meshes and material lookups.
+
+    The material assigned to every mesh is remembered, so assigning
+    the same material again costs a dictionary lookup and switching
+    textures or labels only touches meshes whose material changes.
+    Materials are changed through the data API (objects sharing a mesh
+    share its material) and looked up by name once.
+
+    All assignments must go through the same instance (see `DEFAULT`)
+    for the remembered state to be valid; call `forget` if materials
+    are changed by other means.
+
+    """
+
+    def __init__(self):
+        """Create an empty engine, nothing is assumed to be assigned."""
+        self.assigned = {}  # mesh pointer -> material name
+        self.materials = {}  # material name -> material
+
+    def get(self, name: str, create=None):
+        """Return material name, calling create(name) if it does not exist."""
+        material = self.materials.get(name)
+        if material is None:
+            material = bpy.data.materials.get(name)
+            if material is None:
+                if create is None:
+                    raise KeyError("No material named {:s}".format(name))
+                material = create(name)
+            self.materials[name] = material
+        return material
+
+    def assign(self, obj, material):
+        """Make material the only material of obj; return True if changed."""
+        mesh = obj.data
+        key = mesh.as_pointer()
+        if self.assigned.get(key) == material.name:
+            return False
+        # Clearing the mesh materials also removes the object slots
+        mesh.materials.clear()
+        mesh.materials.append(material)
+        self.assigned[key] = material.name
+        return True
+
+    def forget(self):
+        """Forget assigned materials (materials were changed elsewhere)."""
+        self.assigned = {}
+        self.materials = {}
+
+
+DEFAULT = Materials()
@@ -0,0 +1,170 @@
+"""Record timings of the phases of generating every output."""
+import os
+import re
+import json
+import time
+import collections
+import contextlib
+import bpy  # pylint: disable=import-error
+
+STATS_TIME = re.compile(r"Time:(?:(\d+):)?(\d+):(\d+(?:\.\d+)?)")
+STATS_PEAK = re.compile(r"Peak (\d+(?:\.\d+)?)M")
+
+
+class Metrics():
+    """Wall time of each phase of an output and render statistics.
+
+    Call `start` before generating an output, wrap its phases in
+    `phase` and call `finish` with the written files. Every finished
+    output is appended as a JSON line to `path` (if set) with the time
+    of each phase, the render time and peak memory reported by the
+    renderer, the number of operator calls (while counting, see
+    `count_ops`) and the size of the files. Phases outside of an
+    output are not recorded.
+
+    """
+
+    def __init__(self, path: str=None):
+        """Create metrics appended to path (not written if None)."""
+        self.path = path
+        self.record = None
+        self.ops = None  # Operator -> number of calls while counting
+        self._ops = 0
+        self._bpy_ops = None
+        self._start = 0.
+
+    def count_ops(self):
+        """Count calls of all bpy.ops operators until `stop_ops`.
+
+        bpy.ops is replaced for the whole process while counting.
+
+        """
+        if self._bpy_ops is None:
+            self.ops = collections.Counter()
+            self._bpy_ops = bpy.ops
+            bpy.ops = CountingOps(bpy.ops, self.ops)
+        return self.ops
+
+    def stop_ops(self):
+        """Stop counting operator calls and restore bpy.ops."""
+        if self._bpy_ops is not None:
+            bpy.ops = self._bpy_ops
+            self._bpy_ops = None
+        self.ops = None
+
+    def watch_render(self):
+        """Record render statistics reported by the renderer."""
+        handlers = getattr(bpy.app.handlers, 'render_stats', None)
+        if handlers is not None and self._render_stats not in handlers:
+            handlers.append(self._render_stats)
+
+    def _render_stats(self, stats: str):
+        """Keep the last render time and the peak memory of a render."""
+        if self.record is None:
+            return
+        match = STATS_TIME.search(stats)
+        if match is not None:
+            hours, minutes, seconds = match.groups()
+            self.record['render_time'] = (
+                int(hours or 0)*3600 + int(minutes)*60 + float(seconds))
+        match = STATS_PEAK.search(stats)
+        if match is not None:
+            self.record['peak_memory'] = max(
+                self.record.get('peak_memory', 0.), float(match.group(1)))
+
+    def start(self, render_type: str, seq: str):
+        """Start recording an output of render_type for point seq."""
+        self.record = {'type': render_type, 'seq': seq, 'phases': {}}
+        self._start = time.time()
+        if self.ops is not None:
+            self._ops = sum(self.ops.values())
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Add the wall time of the enclosed block to phase name."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            if self.record is not None:
+                phases = self.record['phases']
+                phases[name] = phases.get(name, 0.) + time.time() - start
+
+    def finish(self, *paths):
+        """Finish recording the output written to paths and return it."""
+        record, self.record = self.record, None
+        if record is None:
+            return None
+        record['start'] = self._start
+        record['time'] = time.time() - self._start
+        if self.ops is not None:
+            record['ops'] = sum(self.ops.values()) - self._ops
+        record['bytes'] = sum(os.path.getsize(path) for path in paths
+                              if os.path.isfile(path))
+        if self.path is not None:
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(record) + '\n')
+        return record
+
+
+class CountingOps():
+    """Stand-in for bpy.ops counting calls of every operator."""
+
+    def __init__(self, ops, counts):
+        """Wrap the operator module ops, counting calls in counts."""
+        self._ops = ops
+        self._counts = counts
+        self._categories = {}
+
+    def __getattr__(self, category: str):
+        """Return the operators of category (e.g. object)."""
+        if category not in self._categories:
+            self._categories[category] = CountingCategory(
+                getattr(self._ops, category), category, self._counts)
+        return self._categories[category]
+
+    def __dir__(self):
+        """Return the operator categories."""
+        return dir(self._ops)
+
+
+class CountingCategory():
+    """Operators of a bpy.ops category counting their calls."""
+
+    def __init__(self, category, name: str, counts):
+        """Wrap the operators of category name."""
+        self._category = category
+        self._name = name
+        self._counts = counts
+        self._operators = {}
+
+    def __getattr__(self, name: str):
+        """Return a counting operator."""
+        if name not in self._operators:
+            self._operators[name] = CountingOperator(
+                getattr(self._category, name),
+                "{:s}.{:s}".format(self._name, name), self._counts)
+        return self._operators[name]
+
+    def __dir__(self):
+        """Return the operators of the category."""
+        return dir(self._category)
+
+
+class CountingOperator():
+    """Operator counting its calls (other attributes pass through)."""
+
+    def __init__(self, operator, key: str, counts):
+        """Wrap operator, counting calls as key in counts."""
+        self._operator = operator
+        self._key = key
+        self._counts = counts
+
+    def __call__(self, *args, **kwargs):
+        """Count the call and call the operator."""
+        self._counts[self._key] += 1
+        return self._operator(*args, **kwargs)
+
+    def __getattr__(self, attr: str):
+        """Return attribute of the operator (e.g. poll)."""
+        return getattr(self._operator, attr)
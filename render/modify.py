@@ -5,11 +5,24 @@ import bpy  # pylint: disable=import-error
 from . import helpers
 
 
-def translate_group(group, translate):
-    """Translate all objects in group list by translate."""
+def find_objects(name: str, registry=None):
+    """Return the object name, or all instances of part name in registry."""
+    if registry is None:
+        return [bpy.data.objects[name]]
+    return registry.find(name)
+
+
+def translate_group(group, translate, registry=None):
+    """Translate all objects in group list by translate.
+
+    Names in group are resolved through registry if given (see
+    helpers.Registry), otherwise they are exact object names.
+
+    """
     bpy.ops.object.select_all(action='DESELECT')
     for name in group:
-        bpy.data.objects[name].select = True
+        for obj in find_objects(name, registry):
+            obj.select = True
     bpy.ops.transform.translate(value=translate)
     bpy.ops.object.select_all(action='DESELECT')
 
@@ -28,9 +41,15 @@ def scale_object(obj, value: float, axis):
 class Scale():
     """Scaling operations."""
 
-    def __init__(self, groups: dict=None):
-        """Scaling class with groups scale, min, max defined in groups."""
+    def __init__(self, groups: dict=None, registry=None):
+        """Scaling class with groups scale, min, max defined in groups.
+
+        Names in groups are resolved as parts through registry if given
+        (see helpers.Registry), otherwise they are exact object names.
+
+        """
         self.groups = groups
+        self.registry = registry
 
     def load_groups(self, filename: str, name: str):
         """Load groups definition from file by name."""
@@ -72,25 +91,32 @@ class Scale():
         # Resize scale group using offsets as end structures should be
         # translated without scaling
         for name in self.groups['scale']:
-            if name == reference:
-                continue
-            start_box = helpers.bounding_box(bpy.data.objects[name])
-            start_length = start_box[1] - start_box[0]
-            end_box = start_box - start_ref + end_ref
-            end_length = end_box[1] - end_box[0]
-            scale_object(bpy.data.objects[name], end_length/start_length, axis)
+            for obj in find_objects(name, self.registry):
+                if obj == bpy.data.objects[reference]:
+                    continue
+                start_box = helpers.bounding_box(obj)
+                start_length = start_box[1] - start_box[0]
+                end_box = start_box - start_ref + end_ref
+                end_length = end_box[1] - end_box[0]
+                scale_object(obj, end_length/start_length, axis)
 
         # Translate the groups according to base selection
         translate = (end_ref - start_ref)*axis
         if base == 'min':
-            translate_group(self.groups['scale'], -translate[0])
-            translate_group(self.groups['max'], translate[1] - translate[0])
+            translate_group(self.groups['scale'], -translate[0],
+                            self.registry)
+            translate_group(self.groups['max'], translate[1] - translate[0],
+                            self.registry)
         elif base == 'scale':
-            translate_group(self.groups['min'], translate[0])
-            translate_group(self.groups['max'], translate[1])
+            translate_group(self.groups['min'], translate[0],
+                            self.registry)
+            translate_group(self.groups['max'], translate[1],
+                            self.registry)
         elif base == 'max':
-            translate_group(self.groups['min'], translate[0] - translate[1])
-            translate_group(self.groups['scale'], -translate[1])
+            translate_group(self.groups['min'], translate[0] - translate[1],
+                            self.registry)
+            translate_group(self.groups['scale'], -translate[1],
+                            self.registry)
         else:
             raise ValueError(
                 "Translate failed: base group name invalid {:s}".format(base))
@@ -0,0 +1,76 @@
+"""Provides tile size and thread profiles of machines for rendering."""
+import os
+import json
+import socket
+import bpy  # pylint: disable=import-error
+
+PROFILES = os.path.join(os.path.expanduser('~'), '.cache',
+                        'render-profiles.json')
+
+
+class Profiles():
+    """Best render settings of this host, by device and resolution.
+
+    Profiles are measured by hostprofile.py and stored in one JSON
+    file (shared by hosts if the home directory is) keyed by host
+    name, device ("CPU" or "GPU") and resolution. A profile has the
+    tile size (`tile`), the number of render threads of a single
+    Blender process (`threads`), and for the profiled numbers of
+    parallel workers the number of threads of each (`worker_threads`)
+    and their throughput, with the best number of workers
+    (`workers`).
+
+    """
+
+    def __init__(self, path: str=None):
+        """Use profiles stored in path (default PROFILES)."""
+        self.path = PROFILES if path is None else path
+        self._profiles = None
+
+    @staticmethod
+    def key(resolution, device: str='CPU'):
+        """Return the key of the profile for resolution on this host."""
+        return "{:s}/{:s}/{:d}x{:d}".format(
+            socket.gethostname(), device, resolution[0], resolution[1])
+
+    def load(self):
+        """Return all stored profiles (read the file once)."""
+        if self._profiles is None:
+            self._profiles = {}
+            if os.path.isfile(self.path):
+                with open(self.path) as file:
+                    self._profiles = json.load(file)
+        return self._profiles
+
+    def get(self, resolution, device: str='CPU'):
+        """Return the profile for resolution and device or None."""
+        return self.load().get(self.key(resolution, device))
+
+    def store(self, resolution, device: str, profile: dict):
+        """Add or replace the profile for resolution and device."""
+        self._profiles = None
+        profiles = self.load()
+        profiles[self.key(resolution, device)] = profile
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        # Write under a unique name first as other hosts may race here
+        temp = "{:s}.{:d}".format(self.path, os.getpid())
+        with open(temp, 'w') as file:
+            json.dump(profiles, file, indent=4, sort_keys=True)
+        os.replace(temp, self.path)
+
+    def worker_threads(self, resolution, workers: int, device: str='CPU'):
+        """Return the profiled threads of each of workers or None."""
+        profile = self.get(resolution, device)
+        if profile is None:
+            return None
+        return profile.get('worker_threads', {}).get(str(workers))
+
+
+def apply(profile: dict, threads: bool=True):
+    """Set the tile size and threads (unless threads is False) from profile."""
+    settings = bpy.data.scenes[0].render
+    settings.tile_x, settings.tile_y = profile['tile']
+    if threads and profile.get('threads') is not None:
+        settings.threads_mode = 'FIXED'
+        settings.threads = profile['threads']
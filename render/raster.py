@@ -0,0 +1,329 @@
+"""Provides a rasterizer for flat colored semantic renders."""
+import numpy as np
+from PIL import Image
+import bpy  # pylint: disable=import-error
+from . import helpers
+
+# Pixel (x, y) is sampled at (x + PIXEL_CENTRE, y + PIXEL_CENTRE)
+PIXEL_CENTRE = 0.5
+# Triangles with larger bounding boxes (in pixels) are drawn one by one
+BATCH_BOX = 32
+# Maximum number of samples tested at once
+CHUNK = 1 << 22
+# Color of objects without materials (Blender's default material)
+DEFAULT_COLOR = (0.8, 0.8, 0.8)
+DRAWN_TYPES = ('MESH', 'CURVE', 'SURFACE', 'FONT', 'META')
+
+
+def mesh_triangles(mesh):
+    """Return vertex coordinates, triangles and their material indices.
+
+    Polygons are split into triangle fans.
+
+    """
+    coords = np.empty(3 * len(mesh.vertices), dtype=np.float32)
+    mesh.vertices.foreach_get('co', coords)
+    count = len(mesh.polygons)
+    starts = np.empty(count, dtype=np.int32)
+    totals = np.empty(count, dtype=np.int32)
+    slots = np.empty(count, dtype=np.int32)
+    mesh.polygons.foreach_get('loop_start', starts)
+    mesh.polygons.foreach_get('loop_total', totals)
+    mesh.polygons.foreach_get('material_index', slots)
+    loops = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get('vertex_index', loops)
+    fans = np.maximum(totals - 2, 0)
+    polygons = np.repeat(np.arange(count), fans)
+    corner = np.arange(fans.sum()) - np.repeat(np.cumsum(fans) - fans, fans)
+    first = starts[polygons]
+    triangles = loops[np.stack([first, first + corner + 1,
+                                first + corner + 2], axis=1)]
+    return coords.reshape(-1, 3).astype(float), triangles, slots[polygons]
+
+
+def visible(obj, scene):
+    """Return True if obj is drawn when rendering scene."""
+    if obj.type not in DRAWN_TYPES or getattr(obj, 'hide_render', False):
+        return False
+    layers = getattr(obj, 'layers', None)
+    return layers is None or any(
+        mine and shown for mine, shown in zip(layers, scene.layers))
+
+
+def projection(scene):
+    """Return resolution, pixels per unit image plane and centre.
+
+    A point at (x, y) in camera space and depth d is drawn at pixel
+    centre + scale * (x, y) / d.
+
+    """
+    settings = scene.render
+    percentage = getattr(settings, 'resolution_percentage', 100)
+    width = settings.resolution_x * percentage // 100
+    height = settings.resolution_y * percentage // 100
+    camera = scene.camera.data
+    fit = getattr(camera, 'sensor_fit', 'AUTO')
+    if fit == 'VERTICAL':
+        scale = height * camera.lens / camera.sensor_height
+    elif fit == 'HORIZONTAL':
+        scale = width * camera.lens / camera.sensor_width
+    else:
+        scale = max(width, height) * camera.lens / camera.sensor_width
+    centre = (np.array([width, height]) / 2 + max(width, height) *
+              np.array([getattr(camera, 'shift_x', 0.),
+                        getattr(camera, 'shift_y', 0.)]))
+    return (width, height), scale, centre
+
+
+def clip_near(points, ids, near: float):
+    """Clip triangles in camera space to depth near.
+
+    Return the triangles in front (split in two if necessary) and
+    their ids.
+
+    """
+    front = -points[..., 2] > near
+    count = np.sum(front, axis=1)
+    clipped, clipped_ids = [points[count == 3]], [ids[count == 3]]
+    for in_front in (1, 2):
+        select = count == in_front
+        if not np.any(select):
+            continue
+        # Rotate vertices so that the odd one out comes first
+        odd = np.argmax(front[select] == (in_front == 1), axis=1)
+        order = (odd[:, np.newaxis] + np.arange(3)) % 3
+        triangle = points[select][np.arange(len(odd))[:, np.newaxis], order]
+        first, second, third = triangle[:, 0], triangle[:, 1], triangle[:, 2]
+
+        def cut(start, end):
+            """Return the points at depth near between start and end."""
+            fraction = ((near + start[:, 2]) /
+                        (start[:, 2] - end[:, 2]))[:, np.newaxis]
+            return start + fraction * (end - start)
+
+        to_second, to_third = cut(first, second), cut(first, third)
+        if in_front == 1:
+            clipped.append(np.stack([first, to_second, to_third], axis=1))
+            clipped_ids.append(ids[select])
+        else:
+            clipped.append(np.stack([to_second, second, third], axis=1))
+            clipped.append(np.stack([to_second, third, to_third], axis=1))
+            clipped_ids += [ids[select], ids[select]]
+    return np.concatenate(clipped), np.concatenate(clipped_ids)
+
+
+class Buffer():
+    """Depth buffer holding the closest triangle id of every pixel.
+
+    Depth is stored as inverse depth, which is affine in screen space
+    so that it is interpolated exactly; 0 is the background.
+
+    """
+
+    def __init__(self, width: int, height: int, far: float):
+        """Create an empty buffer clipping at depth far."""
+        self.width, self.height = width, height
+        self.inverse_far = 1 / far
+        self.depth = np.zeros(width * height)
+        self.ids = np.zeros(width * height, dtype=np.int64)
+
+    def draw(self, pixels, inverse, ids):
+        """Draw triangles with pixel coordinates and inverse depths."""
+        first, second, third = pixels[:, 0], pixels[:, 1], pixels[:, 2]
+        area = ((second[:, 0] - first[:, 0]) * (third[:, 1] - first[:, 1]) -
+                (second[:, 1] - first[:, 1]) * (third[:, 0] - first[:, 0]))
+        low = np.maximum(np.ceil(pixels.min(axis=1) - PIXEL_CENTRE), 0)
+        high = np.minimum(np.floor(pixels.max(axis=1) - PIXEL_CENTRE),
+                          [self.width - 1, self.height - 1])
+        size = np.max(high - low + 1, axis=1)
+        drawn = (area != 0) & np.all(high >= low, axis=1)
+        boxes = 2**np.ceil(np.log2(np.maximum(size, 1))).astype(int)
+        for box in np.unique(boxes[drawn]):
+            select = np.flatnonzero(drawn & (boxes == box))
+            if box > BATCH_BOX:
+                batches = [[index] for index in select]
+            else:
+                batches = np.array_split(
+                    select, int(np.ceil(len(select) * box**2 / CHUNK)))
+            for batch in batches:
+                batch = np.asarray(batch)
+                box_size = int(size[batch].max())
+                self._draw_batch(pixels[batch], inverse[batch], ids[batch],
+                                 area[batch], low[batch].astype(int),
+                                 high[batch].astype(int), box_size)
+
+    def _draw_batch(self, pixels, inverse, ids, area, low, high, box: int):
+        """Test box x box pixels from low of every triangle and draw."""
+        offset_y, offset_x = np.arange(box**2) // box, np.arange(box**2) % box
+        x = low[:, 0, np.newaxis] + offset_x
+        y = low[:, 1, np.newaxis] + offset_y
+        inside = (x <= high[:, 0, np.newaxis]) & (y <= high[:, 1, np.newaxis])
+        sample_x, sample_y = x + PIXEL_CENTRE, y + PIXEL_CENTRE
+        area = area[:, np.newaxis]
+        depth = np.zeros(x.shape)
+        for vertex in range(3):
+            start = pixels[:, (vertex + 1) % 3]
+            end = pixels[:, (vertex + 2) % 3]
+            # Barycentric weight of vertex from the opposite edge
+            weight = ((end[:, 0, np.newaxis] - start[:, 0, np.newaxis]) *
+                      (sample_y - start[:, 1, np.newaxis]) -
+                      (end[:, 1, np.newaxis] - start[:, 1, np.newaxis]) *
+                      (sample_x - start[:, 0, np.newaxis])) / area
+            inside &= weight >= 0
+            depth += weight * inverse[:, vertex, np.newaxis]
+        inside &= depth >= self.inverse_far
+        pixel = (y * self.width + x)[inside]
+        depth = depth[inside]
+        ids = np.broadcast_to(ids[:, np.newaxis], x.shape)[inside]
+        # Closest sample of every pixel, then test against the buffer
+        order = np.lexsort((-depth, pixel))
+        pixel, first = np.unique(pixel[order], return_index=True)
+        depth, ids = depth[order][first], ids[order][first]
+        closer = depth > self.depth[pixel]
+        self.depth[pixel[closer]] = depth[closer]
+        self.ids[pixel[closer]] = ids[closer]
+
+
+class Rasterizer():
+    """Draw the scene with flat material colors, one sample per pixel.
+
+    This replaces rendering semantic labels with Blender Render when
+    all objects have shadeless materials (see labels.color_material):
+    every pixel gets the color of the closest triangle at its centre,
+    the world horizon color otherwise, without anti-aliasing or color
+    management. Materials that are not shadeless are drawn with their
+    diffuse color (shading is ignored).
+
+    Scene geometry in world space is kept between renders and is only
+    collected again when objects are added or moved, or after
+    `forget`.
+
+    """
+
+    def __init__(self):
+        """Create a rasterizer with no geometry."""
+        self.key = None
+        self.objects = []
+        self.vertices = np.zeros((0, 3))
+        self.triangles = np.zeros((0, 3), dtype=np.int64)
+        self.owners = np.zeros(0, dtype=np.int64)
+        self.slots = np.zeros(0, dtype=np.int64)
+
+    def forget(self):
+        """Collect the geometry again at the next render."""
+        self.key = None
+
+    def _scene_key(self, objects: list):
+        """Return names and world matrices of objects."""
+        return [(obj.name, np.array(obj.matrix_world).tobytes())
+                for obj in objects]
+
+    def collect(self, scene):
+        """Collect triangles of the drawn objects in world space."""
+        objects = [obj for obj in scene.objects if visible(obj, scene)]
+        key = self._scene_key(objects)
+        if key == self.key:
+            return
+        vertices, triangles, owners, slots = [], [], [], []
+        offset = 0
+        for owner, obj in enumerate(objects):
+            if obj.type == 'MESH' and len(getattr(obj, 'modifiers', ())) == 0:
+                coords, faces, face_slots = mesh_triangles(obj.data)
+            else:
+                mesh = obj.to_mesh(scene, True, 'RENDER')
+                coords, faces, face_slots = mesh_triangles(mesh)
+                bpy.data.meshes.remove(mesh)
+            vertices.append(helpers.transform(coords, obj.matrix_world))
+            triangles.append(faces + offset)
+            owners.append(np.full(len(faces), owner, dtype=np.int64))
+            slots.append(face_slots)
+            offset += len(coords)
+        self.objects = objects
+        if len(objects) > 0:
+            self.vertices = np.concatenate(vertices)
+            self.triangles = np.concatenate(triangles)
+            self.owners = np.concatenate(owners)
+            self.slots = np.concatenate(slots).astype(np.int64)
+        else:
+            self.vertices = np.zeros((0, 3))
+            self.triangles = np.zeros((0, 3), dtype=np.int64)
+            self.owners = np.zeros(0, dtype=np.int64)
+            self.slots = np.zeros(0, dtype=np.int64)
+        self.key = key
+
+    def palette(self, scene):
+        """Return colors (background first) and palette index by triangle."""
+        colors = [scene.world.horizon_color]
+        first = np.zeros(len(self.objects), dtype=np.int64)
+        count = np.zeros(len(self.objects), dtype=np.int64)
+        for owner, obj in enumerate(self.objects):
+            materials = [material for material in obj.data.materials
+                         if material is not None]
+            first[owner] = len(colors)
+            count[owner] = max(len(materials), 1)
+            colors += [material.diffuse_color for material in materials]
+            if len(materials) == 0:
+                colors.append(DEFAULT_COLOR)
+        colors = np.round(np.array(colors)[:, :3] * 255)
+        index = first[self.owners] + np.minimum(self.slots,
+                                                count[self.owners] - 1)
+        return np.clip(colors, 0, 255).astype(np.uint8), index
+
+    def draw(self, scene):
+        """Return the buffer of scene drawn from its camera.
+
+        Ids in the buffer are triangle indices plus one (0 is the
+        background).
+
+        """
+        self.collect(scene)
+        (width, height), scale, centre = projection(scene)
+        camera = scene.camera
+
+        # Camera space, looking along -z
+        points = helpers.transform(
+            self.vertices, np.linalg.inv(np.array(camera.matrix_world)))
+        depth = -points[:, 2]
+        # Cull triangles entirely outside one plane of the view frustum
+        near, far = camera.data.clip_start, camera.data.clip_end
+        outside = np.stack([
+            depth <= near, depth > far,
+            scale * points[:, 0] + centre[0] * depth < 0,
+            scale * points[:, 0] + (centre[0] - width) * depth > 0,
+            scale * points[:, 1] + centre[1] * depth < 0,
+            scale * points[:, 1] + (centre[1] - height) * depth > 0],
+                           axis=1)
+        culled = np.any(np.all(outside[self.triangles], axis=1), axis=1)
+        triangles = self.triangles[~culled]
+        ids = np.arange(len(self.triangles))[~culled]
+
+        triangles, ids = clip_near(points[triangles], ids, near)
+        depth = -triangles[..., 2]
+        buffer = Buffer(width, height, far)
+        buffer.draw(centre + scale * triangles[..., :2] /
+                    depth[..., np.newaxis], 1 / depth, ids + 1)
+        return buffer
+
+    def render(self, scene=None):
+        """Return an image of scene (top row first) as uint8 RGB."""
+        if scene is None:
+            scene = bpy.data.scenes[0]
+        buffer = self.draw(scene)
+        colors, color_index = self.palette(scene)
+        pixel_colors = np.concatenate([[0], color_index])[buffer.ids]
+        return colors[pixel_colors].reshape(
+            buffer.height, buffer.width, 3)[::-1]
+
+
+def write(image, path: str, color_mode: str='RGB'):
+    """Write a uint8 RGB image to path as PNG in color_mode."""
+    image = Image.fromarray(image, 'RGB')
+    if color_mode != 'RGB':
+        image = image.convert('L' if color_mode == 'BW' else color_mode)
+    image.save(path)
+
+
+def read(path: str):
+    """Return the image in path as uint8 RGB."""
+    with Image.open(path) as image:
+        return np.array(image.convert('RGB'))
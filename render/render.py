@@ -1,11 +1,17 @@
 """Provides methods for rendering the labelled model."""
 import json
 import os
-import hashlib
-import glob
 import numpy as np
 import bpy  # pylint: disable=import-error
 from . import helpers
+from . import metrics
+from . import profiles
+from . import raster
+from . import depth
+from . import coverage
+
+# Width of the cloud edges if not configured (see Render.set_sky)
+CLOUD_DIFF = 0.2
 
 
 class Render():
@@ -55,6 +61,9 @@ class Render():
         position. It might be useful to set this to the water level if
         applicable.
 
+    heightfield_step (float): Grid spacing of the landscape heights
+        used for placing the camera above ground.
+
     camera_lens (dict: mean, log_sigma): Camera lens focal length is
         drawn from lognormal distribution with the given mean (in mm)
         and log_sigma.
@@ -65,13 +74,26 @@ class Render():
     camera_noise (float): Noise to add to the camera angle to increase
         viewpoint variety.
 
+    camera_min_coverage (float): Reject camera poses where the bridge
+        covers less than this fraction of the image, estimated from
+        the bounding boxes of its objects before rendering (0
+        disables the test).
+
     resolution (list: x, y): Resolution of rendered images.
 
     film_exposure (float): Film exposure for visual renders (see note
         at sun_strength).
 
     cycles_samples (int): Number of samples to render, higher numbers
-        decrease noise but take longer.
+        decrease noise but take longer (see tune.py for choosing it).
+
+    cycles_denoise (bool): Denoise visual renders (Blender 2.79),
+        which allows fewer samples for the same image quality.
+
+    cycles_samples_sun (list of dict: theta, samples, denoise):
+        Samples and denoising by sun polar angle: the entry with the
+        largest theta not above the sun's polar angle overrides
+        cycles_samples and cycles_denoise (low suns are noisier).
 
     clamp_indirect (float): Limit speckles caused by high intensity
         reflections. If this is set to 0 (disables), get random white
@@ -83,6 +105,33 @@ class Render():
 
     sky (dict): Sky configuration (see help for set_sky).
 
+    views_per_state (int): Number of camera views rendered of each
+        random scene state (textures, sun, sky and landscape
+        displacement).
+
+    persistent_data (bool): Keep Cycles scene data between visual
+        renders so that only what changed is synchronised again.
+
+    semantic_backend (str): Render semantic labels with Blender Render
+        ("internal") or draw them with the rasterizer ("raster"),
+        which is faster and gives the same pixels for shadeless
+        materials (check with generate.py --verify-semantic).
+
+    depth_backend (str): Render depth with the Cycles Z pass
+        ("cycles") or take the distance along rays through pixel
+        centres from the rasterizer ("raster"), which needs no
+        render (check with generate.py --verify-depth).
+
+    depth_format (str): File format of depth outputs: "exr" (RGB
+        OpenEXR), "npy" or "npz" (compressed) NumPy arrays.
+
+    depth_half (bool): Write depth as half floats (float16), which
+        halves the size at a relative precision of about 1e-3 (and
+        pixels where nothing is hit become infinite).
+
+    depth_codec (str): Compression of depth OpenEXR files, e.g. "ZIP"
+        or "PIZ" (lossless), "DWAA" (lossy) or "NONE".
+
     spheres (dict: name, (dict: centre, radius)): Positions of spheres
         to use for positioning the camera.
 
@@ -98,8 +147,13 @@ class Render():
 
     """
 
-    def __init__(self, objects: list, conf_file=None):
-        """Create Render object for specified Blender objects."""
+    def __init__(self, objects: list, conf_file=None, cache=None):
+        """Create Render object for specified Blender objects.
+
+        Landscape heights are stored in the geometry cache if given
+        (see cache.GeometryCache).
+
+        """
         # Load configuration
         self.opts = {}
         if conf_file is not None:
@@ -110,12 +164,13 @@ class Render():
         # Initialise objects, terrain should be the first item in landscape
         self.objects = objects[:]
         self.landscape = None
-        self.landscape_tree = None
+        self.heightfield = None
         landscape_list = helpers.all_instances(
             self.opts['landscape'][0], self.objects)
         if len(landscape_list) > 0:
             self.landscape = landscape_list[0]
-            self.landscape_tree = helpers.landscape_tree(self.landscape)
+            self.heightfield = helpers.Heightfield(
+                self.landscape, self.opts['heightfield_step'], cache)
 
         # Remove landscape for bounding sphere calculation
         for obj_name in self.opts['landscape']:
@@ -137,6 +192,19 @@ class Render():
         # Initialise things
         self.sun = self.new_sun()
         self.camera = self.new_camera()
+        self.acceptance = {}  # test -> [passed, tested]
+        # Render phases are timed here (see metrics.Metrics)
+        self.metrics = metrics.Metrics()
+        # Tile size and threads of this host (see hostprofile.py)
+        self.profiles = profiles.Profiles()
+        # Threads fixed by the caller (e.g. for parallel workers) are kept
+        self.fixed_threads = False
+        self.rasterizer = raster.Rasterizer()
+        # Screen coverage of the bridge for rejecting camera poses
+        self.coverage = None
+        if self.opts['camera_min_coverage'] > 0:
+            self.coverage = coverage.Coverage(
+                self.objects, self.camera.data, self.opts['resolution'])
 
     def _default(self):
         """Read default configuration parameters if not given."""
@@ -167,19 +235,19 @@ class Render():
         emission.inputs['Color'].default_value = self.opts['sun_color']
         return sun
 
-    def random_sun(self):
+    def random_sun(self, rng=np.random):
         """Generate a random rotation for the sun."""
-        theta = np.random.uniform(self.opts['sun_theta'][0],
-                                  self.opts['sun_theta'][1])
-        phi = np.random.uniform(0, 2*np.pi)
+        theta = rng.uniform(self.opts['sun_theta'][0],
+                            self.opts['sun_theta'][1])
+        phi = rng.uniform(0, 2*np.pi)
         return [theta, 0, phi]
 
-    def place_sun(self, rotation=None):
-        """Place the sun at specified angle."""
+    def place_sun(self, rotation=None, sky: dict=None):
+        """Place the sun at specified angle and set sky (random if None)."""
         if rotation is None:
             rotation = self.random_sun()
         self.sun.rotation_euler = rotation
-        self.set_sky()  # Set sun direction and randomise clouds
+        self.set_sky(sky)  # Set sun direction and clouds
         return self.sun
 
     def new_camera(self):
@@ -200,11 +268,15 @@ class Render():
             np.log(self.opts['camera_lens']['mean']),
             self.opts['camera_lens']['log_sigma'])
         self.camera.data.lens = focal_length
-        # Two major approaches to placing the camera
-        if self.opts.get('lines') is not None:
-            return self.random_camera_line(focal_length)
-        else:
-            return self.random_camera_sphere(focal_length)
+        while True:
+            # Two major approaches to placing the camera
+            if self.opts.get('lines') is not None:
+                pose = self.random_camera_line(focal_length)
+            else:
+                pose = self.random_camera_sphere(focal_length)
+            if self._covered(np.array([pose[1]]), np.array([pose[2]]),
+                             focal_length)[0]:
+                return pose
 
     def random_camera_sphere(self, focal_length):
         """Choose a camera position around a bounding sphere."""
@@ -248,38 +320,191 @@ class Render():
 
     def _choose_rotation(self, location):
         """Choose a random rotation that has bridge in view."""
-        # Choose a rotation
-        theta = np.pi/2 + np.random.normal(0, self.opts['camera_sigma'])
-        phi = np.random.uniform(0, 2*np.pi)
+        return self._sample(
+            'rotation', lambda size: self._draw_rotations(np.random, size),
+            lambda rotations: self._in_view(
+                location, rotations, self.camera.data.angle_y), 16)
+
+    def _draw_rotations(self, rng, size: int):
+        """Draw camera rotations around horizontal."""
+        theta = np.pi/2 + rng.normal(0, self.opts['camera_sigma'], size)
+        phi = rng.uniform(0, 2*np.pi, size)
         # Adjust rotation for non-standard axis
-        rotation = np.array([theta, 0, phi - np.pi/2])
-        # Use rotation if it has at least one bounding sphere centre in view
-        direction = np.array([np.sin(theta)*np.cos(phi),
-                              np.sin(theta)*np.sin(phi),
-                              np.cos(theta)])
-        for sphere in self.opts['spheres'].values():
-            to_centre = sphere['centre'] - location
-            cos_angle = np.dot(direction, to_centre)/np.linalg.norm(to_centre)
-            if np.arccos(cos_angle) < self.camera.data.angle_y/2:
-                return rotation
-        return self._choose_rotation(location)
-
-    def _choose_height(self, location):
+        return np.stack([theta, np.zeros(size), phi - np.pi/2], axis=1)
+
+    def _in_view(self, location, rotations, angle_y):
+        """Return which rotations have a bounding sphere centre in view."""
+        theta = rotations[:, 0]
+        phi = rotations[:, 2] + np.pi/2
+        directions = np.stack([np.sin(theta)*np.cos(phi),
+                               np.sin(theta)*np.sin(phi),
+                               np.cos(theta)], axis=1)
+        to_centres = np.array([sphere['centre'] for sphere
+                               in self.opts['spheres'].values()]) - location
+        to_centres /= np.linalg.norm(to_centres, axis=1)[:, np.newaxis]
+        cos_angles = np.dot(directions, to_centres.T)
+        return np.any(cos_angles > np.cos(angle_y/2), axis=1)
+
+    def _covered(self, locations, rotations, lens: float):
+        """Return which camera poses see enough of the bridge.
+
+        Poses are tested against `camera_min_coverage` (all pass if
+        it is 0) and the counts are recorded as the "coverage" test.
+
+        """
+        if self.coverage is None:
+            return np.ones(len(locations), dtype=bool)
+        passed = self.coverage.estimate(locations, rotations, lens) >= \
+            self.opts['camera_min_coverage']
+        stats = self.acceptance.setdefault('coverage', [0, 0])
+        stats[0] += int(np.count_nonzero(passed))
+        stats[1] += len(passed)
+        return passed
+
+    def _sample(self, test: str, draw, accept, size: int):
+        """Draw batches of candidates until one is accepted and return it.
+
+        `draw(size)` returns an array of candidates and `accept` returns
+        a boolean mask of candidates passing the test. The number of
+        candidates tested and passed is recorded for `test`.
+
+        """
+        stats = self.acceptance.setdefault(test, [0, 0])
+        while True:
+            candidates = draw(size)
+            passed = np.flatnonzero(accept(candidates))
+            stats[0] += len(passed)
+            stats[1] += size
+            if len(passed) > 0:
+                return candidates[passed[0]]
+
+    def _choose_height(self, location, rng=np.random):
         """Choose height for camera above ground."""
+        return self._choose_heights(location[np.newaxis], rng)[0]
+
+    def _choose_heights(self, locations, rng=np.random):
+        """Choose heights for cameras above ground (modified in place).
+
+        Heights within the clearance band above the floor are kept,
+        others are drawn uniformly from the band.
+
+        """
         clearance = self.opts['camera_clearance']
-        closest_vertex, _, _ = self.landscape_tree.find(location)
-        floor = closest_vertex[2]
-        # Optionally, have a set absolute floor configured (e.g. water level)
-        camera_floor = self.opts.get('camera_floor')
-        if camera_floor is not None and camera_floor > floor:
-            floor = camera_floor
-        # Check clearance
-        if (location[2] > floor + clearance[0]
-                and location[2] < floor + clearance[1]):
-            return location
-        # Set and check new height
-        location[2] = floor + np.random.uniform(clearance[0], clearance[1])
-        return self._choose_height(location)
+        # Optionally, have a set absolute floor (e.g. water level)
+        floor = self.heightfield.height(locations,
+                                        self.opts.get('camera_floor'))
+        outside = ((locations[:, 2] <= floor + clearance[0])
+                   | (locations[:, 2] >= floor + clearance[1]))
+        locations[outside, 2] = floor[outside] + rng.uniform(
+            clearance[0], clearance[1], np.count_nonzero(outside))
+        return locations
+
+    def random_points(self, indices, seed: int, size: int=64):
+        """Generate random sun and camera setups for point indices.
+
+        Every point is drawn from its own random stream keyed by
+        (seed, index), so that any point can be regenerated without
+        generating the points before it. Candidate camera poses are
+        drawn and tested in batches of `size`. Rejection test counts
+        are accumulated in `acceptance` (see `acceptance_rates`).
+
+        """
+        return {index: self.random_point(seed, index, size)
+                for index in indices}
+
+    def random_point(self, seed: int, index: int, size: int=64):
+        """Generate the random sun and camera setup of point index."""
+        rng = np.random.RandomState([seed, index])
+        sun_rotation = self.random_sun(rng)
+        # Random focal length (approx median, relative sigma)
+        lens = rng.lognormal(np.log(self.opts['camera_lens']['mean']),
+                             self.opts['camera_lens']['log_sigma'])
+        if self.opts.get('lines') is not None:
+            location, rotation = self._sample_line(rng, lens, size)
+        else:
+            location, rotation = self._sample_sphere(rng, lens, size)
+        return {'sun_rotation': sun_rotation, 'camera_lens': lens,
+                'camera_location': location.tolist(),
+                'camera_rotation': rotation.tolist(),
+                'seed': [seed, index]}
+
+    def acceptance_rates(self):
+        """Return the fraction of candidates passing each rejection test."""
+        return {test: passed/tested
+                for test, (passed, tested) in self.acceptance.items()}
+
+    def _angle_y(self, lens: float):
+        """Return vertical field of view of the camera with lens."""
+        return 2*np.arctan(self.camera.data.sensor_height/(2*lens))
+
+    def _sample_line(self, rng, lens: float, size: int):
+        """Choose a camera location on a line and a rotation in batches.
+
+        Rotations must have a bounding sphere centre in view and cover
+        enough of the bridge (before the rotation noise is added).
+
+        """
+        angle_y = self._angle_y(lens)
+        lines = list(self.opts['lines'].values())
+        line = lines[rng.randint(len(lines))]
+        location = ((line['end'] - line['start']) * rng.random_sample()
+                    + line['start'])
+        location += rng.randn(3) * self.opts['camera_location_noise']
+        rotation = self._sample(
+            'rotation', lambda size: self._draw_rotations(rng, size),
+            lambda rotations: self._in_view(location, rotations, angle_y) &
+            self._covered(np.tile(location, (len(rotations), 1)), rotations,
+                          lens), size)
+        rotation += rng.randn(3) * self.opts['camera_noise']
+        return location, rotation
+
+    def _sample_sphere(self, rng, lens: float, size: int):
+        """Choose camera poses around bounding spheres in batches.
+
+        Poses must cover enough of the bridge (see `_covered`), without
+        a minimum coverage a single pose is drawn.
+
+        """
+        angle_y = self._angle_y(lens)
+        spheres = list(self.opts['spheres'].values())
+
+        def draw(size):
+            """Draw candidate poses as rows of location and rotation."""
+            chosen = rng.randint(len(spheres), size=size)
+            centres = np.array([spheres[i]['centre'] for i in chosen])
+            radii = np.array([spheres[i]['radius'] for i in chosen])
+            # Spherical coordinates of the camera position
+            distance = radii / np.tan(angle_y/2) * rng.normal(
+                self.opts['camera_distance_factor']['mean'],
+                self.opts['camera_distance_factor']['sigma'], size)
+            phi = rng.uniform(0, 2*np.pi, size)
+            # No landscape means any direction is fine
+            if self.landscape is None:
+                theta = rng.uniform(0, np.pi, size)
+            else:
+                theta = np.full(size, np.pi/2)
+            # Set the camera to face near sphere centre
+            rotation = np.stack([theta, np.zeros(size), np.pi + phi], axis=1)
+            rotation += rng.randn(size, 3) * self.opts['camera_noise']
+            # Location axes rotated due to default camera orientation
+            location = centres + distance[:, np.newaxis] * np.stack(
+                [np.sin(theta)*np.sin(-phi),
+                 np.sin(theta)*np.cos(phi),
+                 np.cos(theta)], axis=1)
+            if self.landscape is not None:
+                # Place above landscape by specified amount
+                self._choose_heights(location, rng)
+            return np.concatenate([location, rotation], axis=1)
+
+        if self.coverage is None:
+            # Nothing to reject, so only one pose is drawn
+            pose = draw(1)[0]
+        else:
+            pose = self._sample(
+                'pose', draw,
+                lambda poses: self._covered(poses[:, :3], poses[:, 3:],
+                                            lens), size)
+        return pose[:3], pose[3:]
 
     def place_camera(self, focal_length=None, location=None, rotation=None):
         """Place the camera at specified location and rotation."""
@@ -303,61 +528,187 @@ class Render():
         rendering.
 
         """
+        self._setup_cycles(gpu)
+        bpy.data.scenes[0].render.use_persistent_data = \
+            self.opts['persistent_data']
+        if self.opts.get('compositing_mist') is not None:
+            self._composite_visual()
+        self._render_write(path)
+
+    def render_combined(self, path: str, depth_path: str, index_path: str,
+                        gpu: bool=False):
+        """Render the visual scene, depth and object index in one pass.
+
+        The Z and object index passes are enabled in the render layer
+        and written to OpenEXR files by a compositor File Output node
+        while the visual image is rendered. Object pass indices should
+        be set beforehand (see Labels.index_level); these passes are
+        not anti-aliased so the index map holds exact integers.
+
+        """
+        self._setup_cycles(gpu)
+        bpy.data.scenes[0].render.use_persistent_data = \
+            self.opts['persistent_data']
+        layer = bpy.data.scenes[0].render.layers[0]
+        layer.use_pass_z = True
+        layer.use_pass_object_index = True
+        tree, render_layers = self._composite_visual()
+
+        # Add depth and index outputs to the visual compositing tree
+        file_output = tree.nodes.new('CompositorNodeOutputFile')
+        file_output.format.file_format = 'OPEN_EXR'
+        file_output.base_path = os.path.dirname(path)
+        depth_exr = self._file_slot(file_output.file_slots[0], depth_path)
+        self._depth_format(file_output.file_slots[0], depth_path)
+        index_exr = self._file_slot(file_output.file_slots.new('index'),
+                                    index_path)
+        tree.links.new(render_layers.outputs['Z'], file_output.inputs[0])
+        tree.links.new(render_layers.outputs['IndexOB'],
+                       file_output.inputs[1])
+
+        # Write the render and move the passes into place
+        self._render_write(path)
+        with self.metrics.phase('rename'):
+            os.replace(index_exr, index_path)
+            self._move_depth(depth_exr, depth_path)
+
+    def _render_write(self, path: str):
+        """Render the scene and write the result to path."""
+        with self.metrics.phase('render'):
+            bpy.ops.render.render()
+        with self.metrics.phase('write'):
+            bpy.data.images['Render Result'].save_render(path)
+
+    def _setup_cycles(self, gpu: bool=False):
+        """Set the Cycles parameters from the configuration."""
         # Render with Cycles engine
         bpy.data.scenes[0].render.engine = 'CYCLES'
         if gpu:
             bpy.data.scenes[0].cycles.device = 'GPU'
+        self.apply_profile(gpu)
         bpy.data.scenes[0].cycles.film_exposure = self.opts['film_exposure']
-        bpy.data.scenes[0].cycles.samples = self.opts['cycles_samples']
+        samples, denoise = self.sample_budget()
+        bpy.data.scenes[0].cycles.samples = samples
+        layer = bpy.data.scenes[0].render.layers[0]
+        if hasattr(layer, 'cycles'):
+            layer.cycles.use_denoising = denoise
+        elif denoise:
+            print("==> Denoising needs Blender 2.79, not denoising")
         if self.opts.get('clamp_indirect') is not None:
             bpy.data.scenes[0].cycles.sample_clamp_indirect = \
                 self.opts['clamp_indirect']
-        if self.opts.get('compositing_mist') is not None:
-            bpy.data.scenes[0].render.layers[0].use_pass_mist = True
-            bpy.data.scenes[0].use_nodes = True
-            tree = bpy.data.scenes[0].node_tree
-            tree.nodes.clear()
-            tree.links.clear()
-            render_layers = tree.nodes.new('CompositorNodeRLayers')
-            output = tree.nodes.new('CompositorNodeComposite')
-            screen = tree.nodes.new('CompositorNodeMixRGB')
-            screen.blend_type = 'SCREEN'
-            map_value = tree.nodes.new('CompositorNodeMapValue')
-            map_value.size[0] = self.opts['compositing_mist']
-            tree.links.new(render_layers.outputs['Image'], screen.inputs[1])
-            tree.links.new(render_layers.outputs['Mist'],
-                           map_value.inputs['Value'])
-            tree.links.new(map_value.outputs['Value'], screen.inputs[0])
-            tree.links.new(screen.outputs['Image'], output.inputs['Image'])
-        bpy.data.scenes[0].render.filepath = path
-        bpy.ops.render.render(write_still=True)
-
-    def render_semantic(self, path: str):
+
+    def apply_profile(self, gpu: bool=False):
+        """Set tile size and threads from the profile of this host.
+
+        Nothing is changed if the host has not been profiled for the
+        resolution and device or profiles is None. Threads are kept if
+        fixed_threads is set.
+
+        """
+        if self.profiles is None:
+            return
+        profile = self.profiles.get(self.opts['resolution'],
+                                    'GPU' if gpu else 'CPU')
+        if profile is not None:
+            profiles.apply(profile, not self.fixed_threads)
+
+    def sample_budget(self):
+        """Return the Cycles samples and denoising for the current sun."""
+        samples = self.opts['cycles_samples']
+        denoise = self.opts['cycles_denoise']
+        theta = self.sun.rotation_euler[0]
+        entries = sorted(self.opts.get('cycles_samples_sun') or [],
+                         key=lambda entry: entry['theta'])
+        for entry in entries:
+            if entry['theta'] <= theta:
+                samples = entry['samples']
+                denoise = entry.get('denoise', denoise)
+        return samples, denoise
+
+    def _composite_visual(self):
+        """Create the visual compositing tree, with mist if configured.
+
+        Return the tree and its render layers node.
+
+        """
+        bpy.data.scenes[0].use_nodes = True
+        tree = bpy.data.scenes[0].node_tree
+        tree.nodes.clear()
+        tree.links.clear()
+        render_layers = tree.nodes.new('CompositorNodeRLayers')
+        output = tree.nodes.new('CompositorNodeComposite')
+        if self.opts.get('compositing_mist') is None:
+            tree.links.new(render_layers.outputs['Image'],
+                           output.inputs['Image'])
+            return tree, render_layers
+        bpy.data.scenes[0].render.layers[0].use_pass_mist = True
+        screen = tree.nodes.new('CompositorNodeMixRGB')
+        screen.blend_type = 'SCREEN'
+        map_value = tree.nodes.new('CompositorNodeMapValue')
+        map_value.size[0] = self.opts['compositing_mist']
+        tree.links.new(render_layers.outputs['Image'], screen.inputs[1])
+        tree.links.new(render_layers.outputs['Mist'],
+                       map_value.inputs['Value'])
+        tree.links.new(map_value.outputs['Value'], screen.inputs[0])
+        tree.links.new(screen.outputs['Image'], output.inputs['Image'])
+        return tree, render_layers
+
+    def render_semantic(self, path: str, backend: str=None):
         """Render the semantic labels.
 
+        The backend is "internal" (Blender Render) or "raster" (see
+        raster.Rasterizer), by default semantic_backend.
+
         WARNING: This will probably screw up any careful configuration
         for visual renders.
 
         """
+        if backend is None:
+            backend = self.opts['semantic_backend']
+        if backend == 'raster':
+            bpy.data.scenes[0].world.horizon_color = (0, 0, 0)
+            with self.metrics.phase('render'):
+                image = self.rasterizer.render(bpy.data.scenes[0])
+            with self.metrics.phase('write'):
+                raster.write(image, path, bpy.data.scenes[0].render.
+                             image_settings.color_mode)
+            return
+        if backend != 'internal':
+            raise ValueError("Unknown semantic backend {:s}".format(backend))
         # Render with Blender engine, disable node tree and anti-aliasing
         bpy.data.scenes[0].render.engine = 'BLENDER_RENDER'
         bpy.data.scenes[0].use_nodes = False
         bpy.data.scenes[0].render.use_antialiasing = False
         bpy.data.scenes[0].world.horizon_color = (0, 0, 0)
-        bpy.data.scenes[0].render.filepath = path
-        bpy.ops.render.render(write_still=True)
+        self._render_write(path)
 
-    def render_depth(self, path: str, gpu: bool=False):
+    def render_depth(self, path: str, gpu: bool=False, backend: str=None):
         """Render depth.
 
+        The backend is "cycles" (Z pass) or "raster" (see
+        depth.render), by default depth_backend.
+
         WARNING: This will clear the scene node tree. Any custom
         configuration will be lost and other types of rendering will
         not work afterwards.
 
         """
+        if backend is None:
+            backend = self.opts['depth_backend']
+        if backend == 'raster':
+            with self.metrics.phase('render'):
+                values = depth.render(self.rasterizer, bpy.data.scenes[0])
+            with self.metrics.phase('write'):
+                depth.write(values, path, self.opts['depth_half'],
+                            self.opts['depth_codec'])
+            return
+        if backend != 'cycles':
+            raise ValueError("Unknown depth backend {:s}".format(backend))
         bpy.data.scenes[0].render.engine = 'CYCLES'
         if gpu:
             bpy.data.scenes[0].cycles.device = 'GPU'
+        self.apply_profile(gpu)
         # Use Compositing nodes for Scene
         bpy.data.scenes[0].use_nodes = True
         tree = bpy.data.scenes[0].node_tree
@@ -368,25 +719,85 @@ class Render():
         file_output = tree.nodes.new('CompositorNodeOutputFile')
         file_output.format.file_format = 'OPEN_EXR'
         file_output.base_path = os.path.dirname(path)
-
-        # Generate random collisionless filename from location
-        digest = hashlib.sha1(np.array(self.camera.location)).hexdigest()
-        file_output.file_slots[0].path = digest + '_'
-        bpy.data.scenes[0].render.filepath = os.path.join('/tmp',
-                                                          digest + '.png')
+        depth_exr = self._file_slot(file_output.file_slots[0], path)
+        self._depth_format(file_output.file_slots[0], path)
 
         # Connect depth rendering to outputs
         tree.links.clear()
         tree.links.new(render_layers.outputs['Z'], file_output.inputs[0])
 
-        # Write the render and rename
-        bpy.ops.render.render(write_still=True)
-        os.rename(
-            glob.glob(os.path.join(os.path.dirname(path), digest + '*'))[0],
-            path)
+        # Render (the File Output node writes the pass) and move
+        with self.metrics.phase('render'):
+            bpy.ops.render.render()
+        with self.metrics.phase('rename'):
+            self._move_depth(depth_exr, path)
+
+    def depth_extension(self):
+        """Return the file extension of depth outputs (see depth_format)."""
+        return '.' + self.opts['depth_format']
+
+    def depth_output(self):
+        """Return the depth output settings."""
+        return {key: self.opts[key]
+                for key in ('depth_format', 'depth_half', 'depth_codec')}
+
+    @staticmethod
+    def _file_slot(slot, path: str):
+        """Write File Output slot next to path, return the file it writes.
 
-    def set_sky(self):
-        """Set sun direction consistent with the sun and randomise clouds.
+        The frame number replaces the hashes of the slot path.
+
+        """
+        stem = os.path.splitext(os.path.basename(path))[0]
+        slot.path = stem + '_####'
+        return os.path.join(os.path.dirname(path), "{:s}_{:04d}.exr".format(
+            stem, bpy.data.scenes[0].frame_current))
+
+    def _depth_format(self, slot, path: str):
+        """Set the OpenEXR format of the File Output slot for depth.
+
+        Depth that is converted to another format is written without
+        compression and at full precision.
+
+        """
+        slot.use_node_format = False
+        slot.format.file_format = 'OPEN_EXR'
+        slot.format.color_depth = '32'
+        slot.format.exr_codec = 'NONE'
+        if path.endswith('.exr'):
+            slot.format.color_depth = '16' if self.opts['depth_half'] else '32'
+            slot.format.exr_codec = self.opts['depth_codec']
+
+    def _move_depth(self, exr_path: str, path: str):
+        """Move depth written to exr_path into place, converting format."""
+        if path.endswith('.exr'):
+            os.replace(exr_path, path)
+        else:
+            depth.write(depth.read(exr_path), path, self.opts['depth_half'])
+            os.remove(exr_path)
+
+    def random_sky(self, rng=np.random):
+        """Generate random cloud parameters for set_sky."""
+        sky = self.opts['sky']
+        params = {}
+        if 'noise_scale' in sky:
+            params['noise_scale'] = rng.lognormal(
+                np.log(sky['noise_scale']['mean']),
+                sky['noise_scale']['log_sigma'])
+        if 'cloud_ramp' in sky:
+            params['cloud_ramp'] = rng.uniform(
+                sky['cloud_ramp']['min'], sky['cloud_ramp']['max'])
+            params['cloud_diff'] = sky['cloud_ramp']['diff']
+        if 'translate' in sky:
+            params['translate'] = rng.uniform(
+                sky['translate'][0], sky['translate'][1])
+        return params
+
+    def set_sky(self, params: dict=None):
+        """Set sun direction consistent with the sun and set clouds.
+
+        Cloud parameters are drawn randomly if not given (see
+        random_sky) and returned.
 
         Configuration options (optional):
 
@@ -396,7 +807,8 @@ class Render():
 
         cloud_ramp (dict: min, max, diff): Clouds are created by
             ramping the noise: black is drawn between min and max and
-            white is diff away.
+            white is diff away (diff is stored in the parameters, the
+            configuration or CLOUD_DIFF is used for older points).
 
         translate (list): Translate the cloud texture randomly within
             given limits.
@@ -411,25 +823,33 @@ class Render():
                 [np.sin(theta)*np.sin(phi),
                  -np.sin(theta)*np.cos(phi),
                  np.cos(theta)]
-        # Randomise clouds
-        sky = self.opts['sky']
-        if 'noise_scale' in sky and 'Noise Texture' in tree.nodes:
+        # Set clouds
+        if params is None:
+            params = self.random_sky()
+        if 'noise_scale' in params and 'Noise Texture' in tree.nodes:
             tree.nodes['Noise Texture'].inputs['Scale'].default_value \
-                = np.random.lognormal(np.log(sky['noise_scale']['mean']),
-                                      sky['noise_scale']['log_sigma'])
-        if 'cloud_ramp' in sky and 'ColorRamp' in tree.nodes:
+                = params['noise_scale']
+        if 'cloud_ramp' in params and 'ColorRamp' in tree.nodes:
             ramp = tree.nodes['ColorRamp'].color_ramp
-            ramp.elements[0].position = np.random.uniform(
-                sky['cloud_ramp']['min'], sky['cloud_ramp']['max'])
-            ramp.elements[1].position = ramp.elements[0].position \
-                + sky['cloud_ramp']['diff']
-        if 'translate' in sky and 'Mapping' in tree.nodes:
-            tree.nodes['Mapping'].translation[0] = np.random.uniform(
-                sky['translate'][0], sky['translate'][1])
-
-    def displace_landscape(self):
-        """Randomise the location mapping for landscape variety."""
+            ramp.elements[0].position = params['cloud_ramp']
+            diff = params.get('cloud_diff', self.opts['sky'].get(
+                'cloud_ramp', {}).get('diff', CLOUD_DIFF))
+            ramp.elements[1].position = ramp.elements[0].position + diff
+        if 'translate' in params and 'Mapping' in tree.nodes:
+            tree.nodes['Mapping'].translation[0] = params['translate']
+        return params
+
+    @staticmethod
+    def random_displacement(rng=np.random):
+        """Generate a random landscape texture translation."""
+        return rng.uniform(0, 1000, 3).tolist()
+
+    def displace_landscape(self, translation=None):
+        """Set the location mapping for landscape variety (random if None)."""
+        if translation is None:
+            translation = self.random_displacement()
         tree = self.landscape.data.materials[0].node_tree
         mapping = tree.nodes.get('Mapping')
         if mapping is not None:
-            mapping.translation = np.random.uniform(0, 1000, 3)
+            mapping.translation = translation
+        return translation
@@ -3,6 +3,7 @@ import json
 import numpy as np
 import bpy  # pylint: disable=import-error
 from . import helpers
+from .materials import DEFAULT
 
 
 class Textures():
@@ -19,9 +20,19 @@ class Textures():
 
     """
 
-    def __init__(self, objects: list):
-        """Create Textures object for Blender objects list."""
-        self.objects = objects[:]
+    def __init__(self, objects, materials=None):
+        """Create Textures object for Blender objects list or registry.
+
+        A registry (see helpers.Registry) can be shared with others so
+        that objects added later are textured as well. Materials are
+        assigned through `materials` (see materials.Materials),
+        default is the engine shared with Labels.
+
+        """
+        if not isinstance(objects, helpers.Registry):
+            objects = helpers.Registry(objects)
+        self.objects = objects
+        self.materials = DEFAULT if materials is None else materials
         self.textures = helpers.Dict()
         self.groups = helpers.Dict()
 
@@ -82,33 +93,42 @@ class Textures():
         """Assign parts to belong in a group that gets textured the same."""
         self.groups[group] += parts
 
-    def texture(self):
-        """Texture all objects (assumes all parts have been UV projected)."""
-        for group, textures in self.textures.items():
-            texture = np.random.choice(textures)
+    def random_draw(self, rng=np.random):
+        """Return a random texture for every group (or ungrouped part)."""
+        return {group: str(rng.choice(textures))
+                for group, textures in sorted(self.textures.items())}
+
+    def texture(self, draw: dict=None):
+        """Texture all objects (assumes all parts have been UV projected).
+
+        Textures are given by `draw` (see random_draw), drawn randomly
+        if None. Return the textures used.
+
+        """
+        if draw is None:
+            draw = self.random_draw()
+        for group, texture in draw.items():
             if group in self.groups:
                 for part in self.groups[group]:
                     self._texture_parts(part, texture)
             else:
                 self._texture_parts(group, texture)
+        return draw
 
     def _texture_parts(self, part: str, texture: str):
         """Texture all instances of a part, or all objects if part is ''."""
-        instances = helpers.all_instances(part, self.objects)
-        for obj in instances:
-            texture_object(obj, texture)
+        material = self.materials.get(texture)
+        for obj in self.objects.find(part):
+            self.materials.assign(obj, material)
 
 
-def texture_object(obj, texture: str):
+def texture_object(obj, texture: str, materials=None):
     """Texture an object with texture.
 
-    Find a material with the name `texture` and make this the active
-    material of the object
+    Find a material with the name `texture` and make this the only
+    material of the object (unless it already is)
 
     """
-    material = bpy.data.materials[texture]
-    # Assign the material to object
-    for _ in range(len(obj.material_slots)):
-        bpy.ops.object.material_slot_remove({'object': obj})
-    obj.data.materials.clear()
-    obj.active_material = material
+    if materials is None:
+        materials = DEFAULT
+    materials.assign(obj, materials.get(texture))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Summarise the metrics of a generation run.
+
+Every rendered output is recorded by generate.py as a JSON line in
+metrics.N.jsonl (one file per worker) with the wall time of each phase,
+the render time and peak memory reported by the renderer, the number
+of operator calls and the size of the written files. For every render
+type, print the throughput over the time the run was rendering, time
+percentiles of every phase and the slowest points.
+
+"""
+import sys
+import os
+import glob
+import json
+import argparse
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+
+
+def load(path: str):
+    """Return all metrics records of the run in path."""
+    records = []
+    for filename in sorted(glob.glob(os.path.join(path, 'metrics.*.jsonl'))):
+        with open(filename) as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # Truncated by a crash
+    return records
+
+
+def throughput(records: list):
+    """Return images per hour over the time any output was rendering.
+
+    Workers render in parallel, so the union of the time spans of the
+    outputs is used rather than the sum of the output times. Idle time
+    between invocations of a rerun run is not counted.
+
+    """
+    spans = sorted((record['start'], record['start'] + record['time'])
+                   for record in records)
+    elapsed = 0.
+    start, end = spans[0]
+    for span_start, span_end in spans[1:]:
+        if span_start > end:
+            elapsed += end - start
+            start = span_start
+        end = max(end, span_end)
+    elapsed += end - start
+    return 3600*len(records)/max(elapsed, 1e-9)
+
+
+def summarise(records: list, slowest: int=5):
+    """Return summary lines of records of one render type."""
+    lines = ["  {:d} images, {:.1f} images/hour".format(
+        len(records), throughput(records))]
+    columns = [('time', [record['time'] for record in records])]
+    phases = sorted(set(phase for record in records
+                        for phase in record['phases']))
+    columns += [(phase, [record['phases'].get(phase, 0.)
+                         for record in records]) for phase in phases]
+    for key in ('render_time', 'peak_memory', 'ops', 'bytes'):
+        values = [record[key] for record in records if key in record]
+        if len(values) > 0:
+            columns.append((key, values))
+    lines.append("  {:<12s}{:>12s}".format('', 'mean') + "".join(
+        "{:>12s}".format("p{:d}".format(percentile))
+        for percentile in PERCENTILES))
+    for name, values in columns:
+        lines.append("  {:<12s}".format(name) + "".join(
+            "{:>12.3f}".format(value) for value in
+            [np.mean(values)] + list(np.percentile(values, PERCENTILES))))
+    lines.append("  slowest: " + ", ".join(
+        "{:s} ({:.1f} s)".format(record['seq'], record['time'])
+        for record in sorted(records, key=lambda record: -record['time'])
+        [:slowest]))
+    return lines
+
+
+def main():
+    """Print the summary of the metrics of a run."""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+    parser.add_argument('path', type=str, help="Run directory")
+    parser.add_argument('-n', '--slowest', metavar='N', type=int, default=5,
+                        help="Number of slowest points to list (default: 5)")
+    args = parser.parse_args()
+
+    records = load(args.path)
+    if len(records) == 0:
+        sys.exit("{:s}: No metrics found".format(os.path.basename(__file__)))
+    types = sorted(set(record['type'] for record in records))
+    for render_type in types:
+        print("{:s}:".format(render_type))
+        print("\n".join(summarise([record for record in records
+                                   if record['type'] == render_type],
+                                  args.slowest)))
+
+if __name__ == "__main__":
+    main()
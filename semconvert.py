@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""Convert level 2 semantic renders to class index arrays on all levels.
+
+Label levels 0 and 1 are deterministic functions of level 2 as defined
+by `levels` and `parts` in the labels file. A lookup table from level 2
+colours to class indices on every level is built from the labels file
+and applied to level 2 colour renders (NNN.sem.2.png) or label index
+maps (NNN.idx.exr). Class indices are positions in the palette of the
+level: black (unlabelled) first, then the other colours sorted.
+
+Outputs are paletted PNG images (shown with the label colours) or
+uint8 NumPy arrays, named NNN.sem.L.png or NNN.sem.L.npy.
+
+"""
+import sys
+import os
+import json
+import argparse
+import multiprocessing
+import numpy as np
+from PIL import Image
+try:
+    import OpenEXR
+    import Imath
+except ImportError:
+    OpenEXR = None
+
+BLACK = '#000000'
+
+
+def palette(levels: list, level: int):
+    """Return the colors of level: black first, then sorted."""
+    colors = set(color.lower() for color in levels[level].values())
+    return [BLACK] + sorted(colors - {BLACK})
+
+
+def level_colors(levels: list, parts: dict, level: int):
+    """Return the color of every labelled name on level.
+
+    Colors are assigned in the same order as when coloring the model
+    (see Labels.color_level), later assignments taking precedence.
+
+    """
+    colors = {}
+    if level == 2:
+        colors.update(levels[2])
+    elif level == 1:
+        for structure, color in levels[1].items():
+            if structure in parts:
+                colors.update({part: color for part in parts[structure]})
+            else:
+                colors[structure] = color
+    elif level == 0:
+        for feature, color in levels[0].items():
+            if feature != 'bridge':
+                colors[feature] = color
+            else:
+                colors.update({part: levels[0]['bridge']
+                               for structure in parts
+                               for part in parts[structure]})
+    return {name: color.lower() for name, color in colors.items()}
+
+
+def hex_to_code(color: str):
+    """Convert a hex color code into a packed 24-bit integer."""
+    return int(color[1:], 16)
+
+
+class Lookup():
+    """Map level 2 label colours to class indices on all levels."""
+
+    def __init__(self, label_file: str):
+        """Build the lookup tables from labels file."""
+        with open(label_file) as file:
+            data = json.load(file)
+        levels, parts = data['levels'], data['parts']
+        self.palettes = [palette(levels, level) for level in range(3)]
+        if max(len(colors) for colors in self.palettes) > 256:
+            raise ValueError("Too many labels for uint8 class indices")
+        # Sorted hex codes are also sorted as packed integers
+        self.codes = np.array([hex_to_code(color)
+                               for color in self.palettes[2]])
+
+        # Level 2 class index -> class index on each level
+        self.tables = np.zeros((3, len(self.palettes[2])), dtype=np.uint8)
+        names = level_colors(levels, parts, 2)
+        for level in range(3):
+            colors = level_colors(levels, parts, level)
+            for index, color in enumerate(self.palettes[2]):
+                targets = sorted(set(
+                    colors.get(name, BLACK)
+                    for name, color_ in names.items() if color_ == color))
+                if len(targets) > 1:
+                    print("semconvert: WARNING: level 2 color {:s} is "
+                          "ambiguous on level {:d}, using {:s}".format(
+                              color, level, targets[0]))
+                if len(targets) > 0:
+                    self.tables[level, index] = \
+                        self.palettes[level].index(targets[0])
+
+    def index(self, image):
+        """Return level 2 class indices of an RGB image (unknown is 0)."""
+        image = image.astype(np.uint32)
+        codes = (image[..., 0] << 16) | (image[..., 1] << 8) | image[..., 2]
+        index = np.searchsorted(self.codes, codes)
+        index[index == len(self.codes)] = 0
+        index[self.codes[index] != codes] = 0
+        return index.astype(np.uint8)
+
+    def convert(self, index, level: int):
+        """Return class indices on level from level 2 class indices."""
+        return self.tables[level][index]
+
+    def read(self, path: str):
+        """Read level 2 class indices from a colour render or index map."""
+        if path.endswith('.exr'):
+            return read_index_map(path)
+        with Image.open(path) as image:
+            return self.index(np.array(image.convert('RGB')))
+
+    def write(self, path: str, index, level: int):
+        """Write class indices on level as paletted PNG or NumPy array."""
+        if path.endswith('.npy'):
+            np.save(path, index)
+            return
+        image = Image.fromarray(index, mode='P')
+        image.putpalette([channel for color in self.palettes[level]
+                          for channel in bytes.fromhex(color[1:])])
+        image.save(path)
+
+
+def read_index_map(path: str):
+    """Read an object index map rendered to OpenEXR as class indices."""
+    if OpenEXR is None:
+        raise ImportError("OpenEXR is required to read index maps")
+    exr = OpenEXR.InputFile(path)
+    window = exr.header()['dataWindow']
+    index = np.frombuffer(exr.channel(
+        'R', Imath.PixelType(Imath.PixelType.FLOAT)), dtype=np.float32)
+    index = index.reshape(window.max.y - window.min.y + 1,
+                          window.max.x - window.min.x + 1)
+    return np.rint(index).astype(np.uint8)
+
+
+def output_path(path: str, level: int, ext: str):
+    """Return the output path of level for a source render."""
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, "{:s}.sem.{:d}.{:s}".format(
+        basename.split('.')[0], level, ext))
+
+
+def is_current(src: str, dest: str):
+    """Return True if dest exists and is newer or already converted."""
+    if dest == src:
+        with Image.open(src) as image:
+            return image.mode == 'P'
+    return (os.path.isfile(dest)
+            and os.path.getmtime(dest) >= os.path.getmtime(src))
+
+
+def convert_file(lookup: Lookup, src: str, levels: list, ext: str,
+                 force: bool=False):
+    """Convert a level 2 source file to all levels; return number written.
+
+    Outputs newer than the source are skipped unless forced. Each
+    output is written to a temporary file first, so a source can be
+    replaced by its paletted version in place.
+
+    """
+    targets = [(level, output_path(src, level, ext)) for level in levels]
+    if not force:
+        targets = [(level, dest) for level, dest in targets
+                   if not is_current(src, dest)]
+    if len(targets) == 0:
+        return 0
+    index = lookup.read(src)
+    # Replace source first so that other outputs are newer
+    for level, dest in sorted(targets, key=lambda target: target[1] != src):
+        dirname, basename = os.path.split(dest)
+        temp = os.path.join(dirname, '.' + basename)
+        lookup.write(temp, lookup.convert(index, level), level)
+        os.replace(temp, dest)
+    return len(targets)
+
+
+def _init_worker(label_file: str):
+    """Build the lookup tables once in each worker process."""
+    global _LOOKUP  # pylint: disable=global-variable-undefined
+    _LOOKUP = Lookup(label_file)
+
+
+def _convert_worker(args):
+    """Convert a file in a worker process."""
+    return convert_file(_LOOKUP, *args)
+
+
+def find_sources(path: str):
+    """Return level 2 renders and index maps in a run directory."""
+    sources = {}
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            if filename.startswith('.'):
+                continue
+            seq = os.path.join(dirpath, filename.split('.')[0])
+            # Prefer the exact index map over the colour render
+            if filename.endswith('.idx.exr'):
+                sources[seq] = os.path.join(dirpath, filename)
+            elif filename.endswith('.sem.2.png'):
+                sources.setdefault(seq, os.path.join(dirpath, filename))
+    return sorted(sources.values())
+
+
+def main():
+    """Convert all level 2 renders in a run directory."""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+    parser.add_argument('labels', type=str, help="Labels file")
+    parser.add_argument('path', type=str, help="Run directory")
+    parser.add_argument(
+        '-l', '--levels', metavar='L', type=int, nargs='+', default=[0, 1, 2],
+        help="Levels to write (default: all)")
+    parser.add_argument(
+        '-f', '--format', choices=['png', 'npy'], default='png',
+        help="Output format: paletted PNG or NumPy array (default: png)")
+    parser.add_argument(
+        '-p', '--processes', metavar='N', type=int,
+        help="Number of processes (default: number of CPUs)")
+    parser.add_argument('--force', action='store_true',
+                        help="Convert even if outputs are up to date")
+    args = parser.parse_args()
+
+    src = find_sources(args.path)
+    if len(src) == 0:
+        sys.exit("{:s}: No level 2 renders found".format(
+            os.path.basename(__file__)))
+    jobs = [(path, args.levels, args.format, args.force) for path in src]
+    with multiprocessing.Pool(args.processes, _init_worker,
+                              (args.labels,)) as pool:
+        written = sum(pool.imap_unordered(_convert_worker, jobs, 16))
+    print("{:s}: Wrote {:d} file(s) from {:d} source(s)".format(
+        os.path.basename(__file__), written, len(src)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""Submit render jobs to a generate.py daemon and wait for them.
+
+A daemon (`generate.py MODEL --daemon SPOOL`) loads the model once and
+keeps it prepared between jobs. Jobs are JSON files in the spool
+directory: they are submitted to SPOOL/new, moved to SPOOL/work by the
+daemon that renders them and their result is written to SPOOL/done.
+Files are written under a temporary name and renamed, so several
+clients and daemons can share a spool directory. Jobs in SPOOL/work
+are named by the process and host that claimed them, and jobs of
+processes that are no longer running are submitted again when a
+daemon starts.
+
+"""
+import sys
+import os
+import time
+import json
+import socket
+import argparse
+
+NEW, WORK, DONE = "new", "work", "done"
+
+
+def init(spool: str):
+    """Create the spool directories if they do not exist."""
+    for state in (NEW, WORK, DONE):
+        os.makedirs(os.path.join(spool, state), exist_ok=True)
+
+
+def write(path: str, data: dict):
+    """Write data to path as JSON atomically."""
+    dirname, basename = os.path.split(path)
+    temp = os.path.join(dirname, '.' + basename)
+    with open(temp, 'w') as file:
+        json.dump(data, file)
+    os.replace(temp, path)
+
+
+def work_path(spool: str, job_id: str, pid: int=None, host: str=None):
+    """Return the path of a job claimed by process pid on host.
+
+    By default the job is claimed by this process.
+
+    """
+    if pid is None:
+        pid = os.getpid()
+    if host is None:
+        host = socket.gethostname()
+    return os.path.join(spool, WORK, "{:s}.{:d}@{:s}.json".format(
+        job_id, pid, host))
+
+
+def running(pid: int):
+    """Return True if process pid is running on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def requeue(spool: str):
+    """Submit jobs claimed by processes of this host that have stopped.
+
+    Return the identifiers of the jobs submitted again.
+
+    """
+    host = socket.gethostname()
+    requeued = []
+    for filename in sorted(os.listdir(os.path.join(spool, WORK))):
+        if filename.startswith('.') or not filename.endswith('.json'):
+            continue
+        job_id, claimer = filename[:-len('.json')].split('.', 1)
+        pid, claimer_host = claimer.split('@', 1)
+        if claimer_host != host or running(int(pid)):
+            continue
+        try:
+            os.replace(os.path.join(spool, WORK, filename),
+                       os.path.join(spool, NEW, job_id + '.json'))
+        except FileNotFoundError:
+            continue  # Submitted again by another daemon
+        requeued.append(job_id)
+    return requeued
+
+
+def submit(spool: str, job: dict):
+    """Submit a job and return its identifier."""
+    init(spool)
+    job_id = "{:d}-{:d}-{:s}".format(
+        int(time.time()*1000), os.getpid(), os.urandom(4).hex())
+    write(os.path.join(spool, NEW, job_id + '.json'), job)
+    return job_id
+
+
+def claim(spool: str):
+    """Return (identifier, job) of the oldest submitted job, or None.
+
+    The job is moved to the work directory under the name of this
+    process (see work_path), so that no other daemon renders it.
+
+    """
+    for filename in sorted(os.listdir(os.path.join(spool, NEW))):
+        if filename.startswith('.') or not filename.endswith('.json'):
+            continue
+        path = work_path(spool, filename[:-len('.json')])
+        try:
+            os.replace(os.path.join(spool, NEW, filename), path)
+        except FileNotFoundError:
+            continue  # Claimed by another daemon
+        with open(path) as file:
+            return filename[:-len('.json')], json.load(file)
+    return None
+
+
+def finish(spool: str, job_id: str, result: dict):
+    """Record the result of a job and remove it from the work directory."""
+    write(os.path.join(spool, DONE, job_id + '.json'), result)
+    os.remove(work_path(spool, job_id))
+
+
+def wait(spool: str, job_id: str, timeout: float=None,
+         interval: float=0.5):
+    """Return the result of a job once done, or None after timeout."""
+    path = os.path.join(spool, DONE, job_id + '.json')
+    start = time.time()
+    while not os.path.isfile(path):
+        if timeout is not None and time.time() - start > timeout:
+            return None
+        time.sleep(interval)
+    with open(path) as file:
+        return json.load(file)
+
+
+def main():
+    """Submit a render job and wait for the result."""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+    parser.add_argument('spool', type=str, help="Spool directory")
+    parser.add_argument("-n", "--name", type=str, required=True,
+                        help="Name of the generation run")
+    parser.add_argument("-c", "--conf", metavar="FILE", default="conf.json",
+                        help="Configuration file (default: conf.json)")
+    parser.add_argument("-s", "--size", metavar="N", type=int, default=4,
+                        help="Number of images if the run is new (default: 4)")
+    parser.add_argument(
+        "--seed", metavar="N", type=int,
+        help="Seed for generating points (default: random)")
+    parser.add_argument(
+        "-p", "--points", metavar="SEQ", nargs="+",
+        help="Render only given points of the run (default: all)")
+    parser.add_argument(
+        "-r", "--render", metavar="TYPE", nargs="+",
+        help="Render only given types (see generate.py)")
+    parser.add_argument(
+        "-l", "--all-levels", action='store_true',
+        help="Generate all levels of semantic labels (default only level 2)")
+    parser.add_argument(
+        "--timeout", metavar="SECONDS", type=float,
+        help="Stop waiting after given time (job is not cancelled)")
+    parser.add_argument("--no-wait", action='store_true',
+                        help="Only submit the job and print its identifier")
+    args = parser.parse_args()
+
+    job = {'name': args.name, 'conf': os.path.abspath(args.conf),
+           'size': args.size, 'seed': args.seed, 'points': args.points,
+           'render': args.render, 'all_levels': args.all_levels}
+    job_id = submit(args.spool, job)
+    print(job_id)
+    if args.no_wait:
+        return
+    result = wait(args.spool, job_id, args.timeout)
+    if result is None:
+        sys.exit("{:s}: Timed out waiting for job {:s}".format(
+            os.path.basename(__file__), job_id))
+    if result['status'] != 'ok':
+        sys.exit("{:s}: Job {:s} failed: {:s}".format(
+            os.path.basename(__file__), job_id, result['error']))
+    print("{:s}: Job {:s} done in {:.1f} s".format(
+        os.path.basename(__file__), job_id, result['time']))
+
+if __name__ == "__main__":
+    main()
@@ -12,10 +12,12 @@ import sys
 import os
 import json
 import argparse
-import itertools
 import numpy as np
+import scipy.ndimage
+import scipy.spatial
 import bpy  # pylint: disable=import-error
 import render.helpers as helpers
+import render.cache
 
 __doc__ = """Place trees randomly across scene."""
 
@@ -23,65 +25,93 @@ __doc__ = """Place trees randomly across scene."""
 class BaseTreeGrow():
     """Grow trees! Base class for the novice landscape architect."""
 
-    def __init__(self, landscape):
-        """Create the landscape tree and set some default values."""
-        # Create landscape tree for fast closest point lookup
+    def __init__(self, landscape, heightfield=None, cache=None,
+                 registry=None):
+        """Create the landscape heights and set some default values.
+
+        Trees are found in and new trees added to `registry` (see
+        helpers.Registry), by default one of all objects.
+
+        """
         self.landscape = landscape
-        self.landscape_tree = helpers.landscape_tree(landscape)
+        self.cache = cache
+        if registry is None:
+            registry = helpers.Registry(bpy.data.objects)
+        self.registry = registry
+        # Ground heights can be shared with Render
+        if heightfield is None:
+            heightfield = helpers.Heightfield(landscape, cache=cache)
+        self.heightfield = heightfield
 
         # Set some default values
         self._dig = 0.1
         self._init_height = 15
 
     def _find_height(self, location):
-        """Find the correct height for the tree."""
-        closest_vertex, _, _ = self.landscape_tree.find(location)
-        if (location[2] > closest_vertex[2] - self._dig
-                and location[2] < closest_vertex[2]):
-            return np.array(location)
-        location[2] = closest_vertex[2] - np.random.uniform(0, self._dig)
-        return self._find_height(location)
+        """Find the correct height for the tree (dug into the ground)."""
+        return self._find_heights(np.array([location], dtype=float))[0]
+
+    def _find_heights(self, locations):
+        """Find the correct heights for trees at locations (in place)."""
+        ground = self.heightfield.height(locations)
+        sunk = ~((ground - self._dig < locations[:, 2])
+                 & (locations[:, 2] < ground))
+        locations[sunk, 2] = ground[sunk] - np.random.uniform(
+            0, self._dig, np.count_nonzero(sunk))
+        return locations
 
 
 class TreeGrow(BaseTreeGrow):
     """Grow trees at specified locations."""
 
-    def __init__(self, landscape, locations: dict):
+    def __init__(self, landscape, locations: dict, heightfield=None,
+                 cache=None, registry=None):
         """Create trees on `landscape` as specified by `trees`.
 
         Dictionary `trees` should have existing object names as keys
         and corresponding lists of coordinate values. Already existing
         objects will be moved to specified coordinates and new trees
-        will be grown as necessary.
+        will be grown as necessary. Existing objects beyond the number
+        of locations (e.g. grown for another run) are hidden.
 
         """
-        BaseTreeGrow.__init__(self, landscape)
+        BaseTreeGrow.__init__(self, landscape, heightfield, cache, registry)
         self.locations = locations
+        self.grown = []  # New objects created
 
     def grow_trees(self, key: str):
         """Grow trees with the specified key."""
         locations = self.locations[key]
-        previous_trees = helpers.all_instances(key, bpy.data.objects)
+        previous_trees = self.registry.find(key)
         self._init_height = previous_trees[0].location[2]
-        for location, tree in itertools.zip_longest(locations, previous_trees):
-            if location is None:
-                break
-            if tree is None:
-                # Duplicate last tree
-                bpy.ops.object.select_all(action='DESELECT')
-                previous_trees[-1].select = True
-                bpy.ops.object.duplicate_move_linked(
-                    OBJECT_OT_duplicate={"linked": True})
-                tree = bpy.context.selected_objects[0]
-            if not location.get("fixed"):
-                # Find appropriate z coordinate at x, y position
-                location["location"][2] = self._init_height
-                location["location"] = \
-                    self._find_height(location["location"]).tolist()
-                location["rotation"] = [0, 0, np.random.uniform(0, 2*np.pi)]
+
+        # Find heights and rotations of new locations at once
+        new = [location for location in locations
+               if not location.get("fixed")]
+        if len(new) > 0:
+            coords = np.array([location["location"] for location in new],
+                              dtype=float)
+            coords[:, 2] = self._init_height
+            coords = self._find_heights(coords).tolist()
+            angles = np.random.uniform(0, 2*np.pi, len(new)).tolist()
+            for location, coord, angle in zip(new, coords, angles):
+                location["location"] = coord
+                location["rotation"] = [0, 0, angle]
                 location["fixed"] = True
+
+        # Instance the last tree for locations without a tree
+        missing = len(locations) - len(previous_trees)
+        if missing > 0:
+            grown = helpers.linked_copies(previous_trees[-1], missing)
+            self.registry.add(grown)
+            self.grown += grown
+            previous_trees += grown
+        for location, tree in zip(locations, previous_trees):
             tree.location = location["location"]
             tree.rotation_euler = location["rotation"]
+            tree.hide_render = False
+        for tree in previous_trees[len(locations):]:
+            tree.hide_render = True
         return locations
 
     def grow_all(self):
@@ -91,44 +121,159 @@ class TreeGrow(BaseTreeGrow):
         return self.locations
 
 
+class PointGrid():
+    """Grid of placed points for constant time clearance tests.
+
+    Cells are small enough (clearance/sqrt(2)) that points with
+    clearance between them are in different cells, so each cell holds
+    the index of at most one point and a clearance test only looks at
+    the 5x5 cells around a location. Points in already occupied cells
+    (e.g. seed trees placed by hand) are kept in an overflow list.
+
+    """
+
+    def __init__(self, origin, extent, clearance: float):
+        """Create an empty grid covering extent from origin."""
+        self.clearance = clearance
+        self.size = clearance/np.sqrt(2)
+        self.origin = np.asarray(origin, dtype=float)
+        shape = np.ceil(np.asarray(extent)/self.size).astype(int) + 1
+        self.cells = np.full(shape, -1, dtype=int)
+        self.points = np.zeros((16, 2))
+        self.overflow = np.zeros((0, 2))
+        self._count = 0
+
+    def _cells(self, points):
+        """Return cell indices of points (clipped to the grid)."""
+        cells = np.floor((points - self.origin)/self.size).astype(int)
+        return np.clip(cells, 0, np.array(self.cells.shape) - 1)
+
+    def add(self, point):
+        """Add the (x, y) of a point to the grid."""
+        point = np.asarray(point, dtype=float)[:2]
+        i, j = self._cells(point)
+        if self.cells[i, j] >= 0:
+            self.overflow = np.vstack([self.overflow, point])
+            return
+        # Grow storage geometrically for constant amortised cost
+        if self._count == len(self.points):
+            self.points = np.resize(self.points, (2*len(self.points), 2))
+        self.points[self._count] = point
+        self.cells[i, j] = self._count
+        self._count += 1
+
+    def clear(self, points):
+        """Return which (x, y) of points have no point within clearance."""
+        points = np.asarray(points, dtype=float)[:, :2]
+        offsets = np.stack(np.mgrid[-2:3, -2:3], axis=-1).reshape(-1, 2)
+        cells = self._cells(points)[:, np.newaxis] + offsets
+        cells = np.clip(cells, 0, np.array(self.cells.shape) - 1)
+        neighbours = self.cells[cells[..., 0], cells[..., 1]]
+        dist2 = np.sum((self.points[np.maximum(neighbours, 0)]
+                        - points[:, np.newaxis])**2, axis=-1)
+        clear = ~np.any((neighbours >= 0)
+                        & (dist2 < self.clearance**2), axis=1)
+        if len(self.overflow) > 0:
+            dist2 = np.sum((self.overflow[np.newaxis]
+                            - points[:, np.newaxis])**2, axis=-1)
+            clear &= ~np.any(dist2 < self.clearance**2, axis=1)
+        return clear
+
+
+class OccupancyGrid():
+    """Ground within clearance of static obstacles as a boolean raster.
+
+    Obstacle vertices above the ground are rasterised onto a grid of
+    cells of a quarter of the clearance, which is then dilated by the
+    clearance, so that testing a location is a single lookup.
+
+    """
+
+    def __init__(self, heightfield, clearance: float):
+        """Create an empty grid covering the heightfield."""
+        self.heightfield = heightfield
+        self.clearance = clearance
+        self.size = clearance/4
+        self.origin = heightfield.origin
+        extent = (np.array(heightfield.heights.shape) - 1)*heightfield.step
+        self.shape = tuple(np.ceil(extent/self.size).astype(int) + 1)
+        self.occupied = np.zeros(self.shape, dtype=bool)
+
+    def _cells(self, points):
+        """Return cell indices of points (clipped to the grid)."""
+        cells = np.floor((points[:, :2] - self.origin)/self.size).astype(int)
+        return np.clip(cells, 0, np.array(self.shape) - 1)
+
+    def rasterise(self, points):
+        """Return the occupancy of obstacles with vertices points."""
+        above = points[points[:, 2] > self.heightfield.height(points)]
+        occupied = np.zeros(self.shape, dtype=bool)
+        cells = self._cells(above)
+        occupied[cells[:, 0], cells[:, 1]] = True
+        radius = int(np.ceil(self.clearance/self.size))
+        i, j = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+        return scipy.ndimage.binary_dilation(occupied,
+                                             i**2 + j**2 <= radius**2)
+
+    def blocked(self, points):
+        """Return which points are within clearance of an obstacle."""
+        cells = self._cells(np.asarray(points, dtype=float))
+        return self.occupied[cells[:, 0], cells[:, 1]]
+
+
 class TreeGrowRandom(BaseTreeGrow):
     """Grow random trees  with a specified scale and hard clearance."""
 
     def __init__(self, landscape, other_trees: set,
-                 scale: float=8., clearance: float=8.):
+                 scale: float=8., clearance: float=8., cache=None,
+                 registry=None):
         """Create object on landscape with other trees to avoid."""
-        BaseTreeGrow.__init__(self, landscape)
+        BaseTreeGrow.__init__(self, landscape, cache=cache,
+                              registry=registry)
         self.scale = scale
         self.clearance = clearance
-        # Find existing trees
+        # Find existing trees and index them for clearance tests
         self.trees = [obj for tree in other_trees
-                      for obj in helpers.all_instances(tree, bpy.data.objects)]
+                      for obj in self.registry.find(tree)]
+        extent = ((np.array(self.heightfield.heights.shape) - 1)
+                  * self.heightfield.step)
+        self.tree_grid = PointGrid(self.heightfield.origin, extent, clearance)
+        for tree in self.trees:
+            self.tree_grid.add(tree.location)
 
         # Avoid other objects in the scene
-        avoid_objects = [obj for obj in bpy.data.objects
+        avoid_objects = [obj for obj in self.registry
                          if obj.type == "MESH"
                          and obj.name.split('.')[0] not in other_trees]
         avoid_objects.remove(self.landscape)
-        self.avoid_tree = helpers.avoid_tree(avoid_objects)
+        self.occupancy = OccupancyGrid(self.heightfield, clearance)
+        self.occupancy.occupied = helpers.cached(
+            cache, 'occupancy', avoid_objects + [self.landscape],
+            lambda: self.occupancy.rasterise(helpers.cached(
+                cache, 'avoid', avoid_objects, lambda: np.concatenate(
+                    [helpers.vertices(obj) for obj in avoid_objects]))),
+            clearance, self.heightfield.step)
 
     def grow_trees(self, number: int, seed_tree: list):
         """Grow trees using last element of seed_tree as a starting point."""
-        if number == 0:
-            return seed_tree
-        print("==> Still growing {:d} tree(s)".format(number))
-        seed_tree.append(self.grow_tree(seed_tree[-1]))
-        return self.grow_trees(number - 1, seed_tree)
+        for remaining in range(number, 0, -1):
+            print("==> Still growing {:d} tree(s)".format(remaining))
+            seed_tree.append(self.grow_tree(seed_tree[-1]))
+        return seed_tree
 
     def grow_tree(self, parent_tree):
         """Grow a tree near parent_tree and return it."""
         # Find an empty area for the tree with a preference for close placement
         print("Find location...")
         while True:
-            dist = np.random.exponential(self.scale)
-            angle = np.random.uniform(0, 2*np.pi)
-            translate = np.array([np.cos(angle), np.sin(angle), 0]) * dist
-            location = translate + parent_tree.location
-            if self._found_clearing(location):
+            dist = np.random.exponential(self.scale, 16)
+            angle = np.random.uniform(0, 2*np.pi, 16)
+            translate = np.stack([np.cos(angle), np.sin(angle),
+                                  np.zeros(16)], axis=1) * dist[:, np.newaxis]
+            locations = translate + np.array(parent_tree.location)
+            clear = np.flatnonzero(self._found_clearings(locations))
+            if len(clear) > 0:
+                location = locations[clear[0]]
                 break
 
         # Find appropriate z coordinate at x, y position
@@ -136,38 +281,136 @@ class TreeGrowRandom(BaseTreeGrow):
         location[2] = self._init_height
         location = self._find_height(location)
         self._init_height = location[2]
-        translate = location - parent_tree.location
 
-        # Duplicate parent tree with translation and add a random rotation
+        # Instance parent tree at location and add a random rotation
         print("Place tree...")
-        bpy.ops.object.select_all(action='DESELECT')
-        parent_tree.select = True
-        bpy.ops.object.duplicate_move_linked(
-            OBJECT_OT_duplicate={"linked": True, "mode": 'TRANSLATION'},
-            TRANSFORM_OT_translate={"value": translate})
-        bpy.ops.transform.rotate(value=np.random.uniform(0, 2*np.pi),
-                                 axis=(0, 0, 1))
+        tree, = helpers.linked_copies(parent_tree, 1)
+        self.registry.add([tree])
+        tree.location = location
+        tree.rotation_euler[2] += np.random.uniform(0, 2*np.pi)
 
         # Add tree to list
-        tree = bpy.context.selected_objects[0]
         self.trees.append(tree)
+        self.tree_grid.add(location)
         return tree
 
     def _found_clearing(self, location):
         """Check if any other objects or trees are too close."""
-        # Check with avoid tree
-        closest_landscape, _, _ = self.landscape_tree.find(location)
-        closest_avoid, _, _ = self.avoid_tree.find(location)
-        if (closest_avoid[2] > closest_landscape[2]
-                and np.linalg.norm(np.array(location[:2]) - closest_avoid[:2])
-                < self.clearance):
-            return False
-
-        # Yes, I know... This scales quadratically.
-        for tree in self.trees:
-            if np.linalg.norm(location - tree.location) < self.clearance:
-                return False
-        return True
+        return self._found_clearings(np.array([location]))[0]
+
+    def _found_clearings(self, locations):
+        """Check which locations have no objects or trees too close."""
+        return (~self.occupancy.blocked(locations)
+                & self.tree_grid.clear(locations))
+
+
+class TreeGrowPoisson(TreeGrowRandom):
+    """Place many trees at once by clustered Poisson-disk sampling.
+
+    Trees spread out from the seed trees as in Bridson's algorithm:
+    in every round, all active trees propose candidates at once at the
+    clearance plus an exponentially distributed distance (`scale`),
+    which keeps trees in clusters. Candidates must be on the landscape
+    and clear of obstacles and other trees. Trees that find no room are
+    retired and a new cluster is started at a random clear location
+    when no active trees are left. Only locations are generated, in
+    the format used by TreeGrow.
+
+    """
+
+    def place(self, number: int, seed_trees: list, candidates: int=16):
+        """Return (x, y) of number new trees and their seed tree indices."""
+        lower = self.heightfield.origin
+        upper = lower + ((np.array(self.heightfield.heights.shape) - 1)
+                         * self.heightfield.step)
+        active = np.array([tree.location[:2] for tree in seed_trees])
+        kinds = np.arange(len(seed_trees))
+        placed, placed_kinds = np.zeros((0, 2)), np.zeros(0, dtype=int)
+        while len(placed) < number:
+            if len(active) == 0:
+                active = self._new_cluster(lower, upper, candidates)
+                if active is None:
+                    print("treegrow: WARNING: no room for more trees")
+                    break
+                kinds = np.random.randint(len(seed_trees), size=1)
+                new, new_kinds = active, kinds
+            else:
+                # Every active tree proposes candidates around it
+                dist = self.clearance + np.random.exponential(
+                    self.scale, (len(active), candidates))
+                angle = np.random.uniform(0, 2*np.pi, dist.shape)
+                proposed = active[:, np.newaxis] + np.stack(
+                    [np.cos(angle), np.sin(angle)], axis=-1) * \
+                    dist[..., np.newaxis]
+                clear = self._clear(proposed.reshape(-1, 2))
+                clear = clear.reshape(dist.shape)
+                found = np.any(clear, axis=1)
+                new = proposed[found, np.argmax(clear, axis=1)[found]]
+                new_kinds = kinds[found]
+                # Candidates from different trees may be too close
+                keep = self._independent(new)
+                new, new_kinds = new[keep], new_kinds[keep]
+                active = np.concatenate([active[found], new])
+                kinds = np.concatenate([kinds[found], new_kinds])
+            new = new[:number - len(placed)]
+            for point in new:
+                self.tree_grid.add(point)
+            placed = np.concatenate([placed, new])
+            placed_kinds = np.concatenate(
+                [placed_kinds, new_kinds[:len(new)]])
+            print("==> Placed {:d} tree(s)".format(len(placed)))
+        return placed, placed_kinds
+
+    def locations(self, number: int, seed_trees: list):
+        """Return locations of seed trees and number new trees by key.
+
+        Existing instances of each seed tree are listed first as in
+        the output of TreeGrowRandom.
+
+        """
+        placed, kinds = self.place(number, seed_trees)
+        heights = self.heightfield.height(placed) - np.random.uniform(
+            0, self._dig, len(placed))
+        angles = np.random.uniform(0, 2*np.pi, len(placed))
+        out = {}
+        for kind, seed_tree in enumerate(seed_trees):
+            key = seed_tree.name.split('.')[0]
+            out[key] = [{"location": np.array(x.location).tolist(),
+                         "rotation": np.array(x.rotation_euler).tolist(),
+                         "fixed": True}
+                        for x in self.registry.find(key)]
+            out[key] += [{"location": [x, y, z], "rotation": [0, 0, angle],
+                          "fixed": True}
+                         for (x, y), z, angle in zip(
+                             placed[kinds == kind].tolist(),
+                             heights[kinds == kind].tolist(),
+                             angles[kinds == kind].tolist())]
+        return out
+
+    def _clear(self, points):
+        """Check which points are on the landscape and clear."""
+        return (self.heightfield.on_landscape(points)
+                & self._found_clearings(points))
+
+    def _independent(self, points):
+        """Return mask of points keeping clearance between them."""
+        keep = np.ones(len(points), dtype=bool)
+        if len(points) < 2:
+            return keep
+        pairs = scipy.spatial.cKDTree(points).query_pairs(self.clearance)
+        for i, j in sorted(pairs):
+            if keep[i] and keep[j]:
+                keep[j] = False
+        return keep
+
+    def _new_cluster(self, lower, upper, candidates: int, tries: int=64):
+        """Return a random clear location as array, or None if none found."""
+        for _ in range(tries):
+            points = np.random.uniform(lower, upper, (candidates, 2))
+            clear = np.flatnonzero(self._clear(points))
+            if len(clear) > 0:
+                return points[clear[:1]]
+        return None
 
 
 def segment(number: int, pieces: int, res: list=None):
@@ -210,11 +453,28 @@ def main():
         help="Clearance between trees (default: 8.0)")
     parser.add_argument("-o", "--out", metavar="FILE", type=str,
                         help="Write generated tree locations to file")
+    parser.add_argument(
+        "-b", "--batch", action='store_true',
+        help="Place all trees at once by clustered Poisson-disk sampling "
+        "and only write their locations to file (requires --out)")
     args = parser.parse_args(argv)
 
+    if args.batch:
+        if args.out is None:
+            parser.error("--batch requires --out")
+        place = TreeGrowPoisson(
+            bpy.data.objects[args.landscape], set(args.trees), args.scale,
+            args.clearance, render.cache.GeometryCache())
+        out = place.locations(
+            args.number, [bpy.data.objects[tree] for tree in args.trees])
+        with open(args.out, 'w') as file:
+            json.dump(out, file)
+        return
+
     # Grow the trees
     grow = TreeGrowRandom(bpy.data.objects[args.landscape], set(args.trees),
-                          args.scale, args.clearance)
+                          args.scale, args.clearance,
+                          render.cache.GeometryCache())
     numbers = segment(args.number, len(args.trees))
     tree_types = []
     for tree, number in zip(args.trees, numbers):
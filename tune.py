@@ -0,0 +1,262 @@
+#!/bin/bash
+# -*- mode: python;-*-
+"true" '''\'
+model=$1
+shift
+
+exec ./blender "$model" --factory-startup --background --python "$0" -- "$@"
+
+exit 127
+'''
+import sys
+import os
+import json
+import argparse
+import tempfile
+import numpy as np
+import scipy.ndimage
+import bpy  # pylint: disable=import-error
+import generate
+
+__doc__ = """Tune the Cycles samples of a run to a target image quality.
+
+A few points of the run, spread over sun elevations, are rendered with
+a high reference number of samples and with every candidate number of
+samples, with and without denoising. The cheapest setting (by mean
+render time) whose images all reach the target PSNR and SSIM against
+the reference is written to the render configuration. With
+`--adaptive N`, the points are split into N groups by sun polar angle
+and each group gets its own setting (`cycles_samples_sun`).
+
+"""
+
+
+def read_image(path: str):
+    """Return the RGB pixels of an image file as an array."""
+    image = bpy.data.images.load(path)
+    width, height = image.size
+    pixels = np.array(image.pixels[:]).reshape(
+        height, width, image.channels)[..., :3]
+    bpy.data.images.remove(image)
+    return pixels
+
+
+def luminance(image):
+    """Return the luminance of RGB image (ITU-R BT.601)."""
+    return np.dot(image[..., :3], [0.299, 0.587, 0.114])
+
+
+def psnr(image, reference):
+    """Return the peak signal-to-noise ratio (dB) of image in [0, 1]."""
+    mse = np.mean((np.asarray(image) - reference)**2)
+    if mse == 0:
+        return np.inf
+    return 10 * np.log10(1 / mse)
+
+
+def ssim(image, reference, sigma: float=1.5):
+    """Return the mean structural similarity of the image luminance.
+
+    Local statistics use a Gaussian window of sigma as in Wang et al.
+    (2004) with the usual constants for a dynamic range of 1.
+
+    """
+    x, y = luminance(image), luminance(reference)
+    c_1, c_2 = 0.01**2, 0.03**2
+
+    def blur(values):
+        """Return the local mean of values."""
+        return scipy.ndimage.gaussian_filter(values, sigma, truncate=3.5)
+
+    mu_x, mu_y = blur(x), blur(y)
+    var_x = blur(x*x) - mu_x**2
+    var_y = blur(y*y) - mu_y**2
+    cov = blur(x*y) - mu_x*mu_y
+    index = ((2*mu_x*mu_y + c_1) * (2*cov + c_2) /
+             ((mu_x**2 + mu_y**2 + c_1) * (var_x + var_y + c_2)))
+    return float(np.mean(index))
+
+
+def choose_points(data: dict, count: int):
+    """Return count points spread evenly over the sun polar angles."""
+    seqs = sorted(data, key=lambda seq: data[seq]['sun_rotation'][0])
+    indices = np.unique(np.round(
+        np.linspace(0, len(seqs) - 1, min(count, len(seqs)))).astype(int))
+    return [seqs[index] for index in indices]
+
+
+def render_point(gen, path: str, samples: int, denoise: bool, gpu: bool):
+    """Render the current scene, return the pixels and render time."""
+    gen.render.opts['cycles_samples'] = samples
+    gen.render.opts['cycles_denoise'] = denoise
+    # Settings by sun elevation of a previous tune would override these
+    gen.render.opts['cycles_samples_sun'] = None
+    gen.metrics.start('tune', os.path.basename(path))
+    gen.render.render(path, gpu)
+    record = gen.metrics.finish(path)
+    return read_image(path), record['phases']['render']
+
+
+def measure(gen, data: dict, seqs: list, candidates: list,
+            reference: int, gpu: bool, directory: str):
+    """Render points seqs with every candidate (samples, denoise).
+
+    Return a dict of candidate -> list of (time, PSNR, SSIM) in the
+    order of seqs.
+
+    """
+    results = {candidate: [] for candidate in candidates}
+    for seq in seqs:
+        print("==Point {:s}: reference ({:d} samples)==".format(
+            seq, reference))
+        gen.set_scene(data[seq])
+        gen.place_camera(data[seq])
+        ref_image, _ = render_point(
+            gen, os.path.join(directory, seq + ".ref.png"), reference,
+            False, gpu)
+        for samples, denoise in candidates:
+            path = os.path.join(directory, "{:s}.{:d}{:s}.png".format(
+                seq, samples, "d" if denoise else ""))
+            image, seconds = render_point(gen, path, samples, denoise, gpu)
+            quality = (seconds, psnr(image, ref_image),
+                       ssim(image, ref_image))
+            results[samples, denoise].append(quality)
+            print("==> {:4d} samples{:s}: {:.2f} s, PSNR {:.2f} dB, "
+                  "SSIM {:.4f}".format(samples, ", denoised" if denoise
+                                       else "", *quality))
+            sys.stdout.flush()
+    return results
+
+
+def choose(results: dict, indices, min_psnr: float, min_ssim: float):
+    """Return the cheapest candidate meeting the targets on all indices.
+
+    None is returned if no candidate meets the targets.
+
+    """
+    passing = []
+    for candidate, qualities in results.items():
+        qualities = [qualities[index] for index in indices]
+        if all(value[1] >= min_psnr and value[2] >= min_ssim
+               for value in qualities):
+            passing.append((np.mean([value[0] for value in qualities]),
+                            candidate))
+    if len(passing) == 0:
+        return None
+    return min(passing)[1]
+
+
+def update_conf(conf_file: str, budget: tuple, by_sun: list=None):
+    """Write samples and denoising (and budgets by sun) to conf_file."""
+    with open(conf_file) as file:
+        opts = json.load(file)
+    opts['cycles_samples'], opts['cycles_denoise'] = budget
+    opts.pop('cycles_samples_sun', None)
+    if by_sun is not None:
+        opts['cycles_samples_sun'] = by_sun
+    with open(conf_file, 'w') as file:
+        json.dump(opts, file, indent=4)
+
+
+def main():
+    """Parse the arguments, measure candidates and write the result."""
+    print("\n==> {:s}".format(os.path.relpath(__file__)))
+    # Get all arguments after '--'
+    try:
+        argv = sys.argv[sys.argv.index('--') + 1:]
+    except ValueError:
+        argv = []
+
+    prog_text = "( {0:s} MODEL | blender MODEL --background " \
+                "--python {0:s} -- )".format(
+                    os.path.relpath(os.path.realpath(__file__)))
+    parser = argparse.ArgumentParser(
+        prog=prog_text, formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__, epilog="===")
+    parser.add_argument("-n", "--name", type=str, required=True,
+                        help="Name of a run with generated points")
+    parser.add_argument("-c", "--conf", metavar="FILE", default="conf.json",
+                        help="Configuration file (default: conf.json)")
+    parser.add_argument(
+        "-o", "--out", metavar="FILE",
+        help="Render configuration to update (default: the run's)")
+    parser.add_argument("-p", "--points", metavar="N", type=int, default=4,
+                        help="Number of points to render (default: 4)")
+    parser.add_argument(
+        "--reference", metavar="N", type=int, default=1024,
+        help="Samples of the reference renders (default: 1024)")
+    parser.add_argument(
+        "--samples", metavar="N", type=int, nargs="+",
+        default=[8, 16, 32, 64, 128, 256],
+        help="Candidate samples (default: 8 16 32 64 128 256)")
+    parser.add_argument("--no-denoise", action='store_true',
+                        help="Do not try denoising (needs Blender 2.79)")
+    parser.add_argument("--psnr", metavar="DB", type=float, default=35.,
+                        help="Minimum PSNR of every point (default: 35)")
+    parser.add_argument("--ssim", metavar="INDEX", type=float, default=0.95,
+                        help="Minimum SSIM of every point (default: 0.95)")
+    parser.add_argument(
+        "-a", "--adaptive", metavar="N", type=int,
+        help="Choose settings for N groups of points by sun polar angle")
+    parser.add_argument(
+        "-g", "--gpu", nargs="?", const="", metavar="DEVICE",
+        help="Use GPU device for rendering. If specified without an "
+        "argument, the default will be selected.")
+    args = parser.parse_args(argv)
+
+    gpu = False
+    if args.gpu is not None:
+        gpu = True
+        bpy.context.user_preferences.system.compute_device_type = 'CUDA'
+        if len(args.gpu) > 0:
+            bpy.context.user_preferences.system.compute_device = args.gpu
+
+    path, files = generate.setup_run(args.conf, args.name)
+    if not os.path.getsize(files['out']):
+        sys.exit("{:s}: no points in run {:s}".format(
+            os.path.basename(__file__), args.name))
+    gen = generate.Generate(path, files)
+    if files.get('trees') is not None:
+        gen.grow_trees(write=False)
+    data = gen.load_points()
+    seqs = choose_points(data, args.points)
+    candidates = [(samples, denoise) for samples in sorted(args.samples)
+                  for denoise in ((False,) if args.no_denoise
+                                  else (False, True))]
+    with tempfile.TemporaryDirectory() as directory:
+        results = measure(gen, data, seqs, candidates, args.reference,
+                          gpu, directory)
+
+    budget = choose(results, range(len(seqs)), args.psnr, args.ssim)
+    if budget is None:
+        print("==> No candidate meets the targets, using reference")
+        budget = (args.reference, False)
+    by_sun = None
+    if args.adaptive is not None:
+        # Contiguous groups of points by polar angle, bounds between them
+        by_sun = []
+        thetas = [data[seq]['sun_rotation'][0] for seq in seqs]
+        for group in np.array_split(np.arange(len(seqs)), args.adaptive):
+            if len(group) == 0:
+                continue
+            group_budget = choose(results, group, args.psnr, args.ssim)
+            if group_budget is None:
+                group_budget = budget
+            theta = 0.
+            if group[0] > 0:
+                theta = (thetas[group[0] - 1] + thetas[group[0]]) / 2
+            by_sun.append({'theta': theta, 'samples': group_budget[0],
+                           'denoise': group_budget[1]})
+            print("==> Sun polar angle from {:.3f}: {:d} samples{:s}".format(
+                theta, group_budget[0],
+                ", denoised" if group_budget[1] else ""))
+    print("==> Chosen: {:d} samples{:s}".format(
+        budget[0], ", denoised" if budget[1] else ""))
+
+    conf_file = files['render'] if args.out is None else args.out
+    update_conf(conf_file, budget, by_sun)
+    print("==Wrote {:s}==".format(conf_file))
+
+
+if __name__ == "__main__":
+    main()